@@ -1,16 +1,22 @@
 import os
 import json
 import fitz  # PyMuPDF
-import pytesseract
 import openai
 import re
-from PIL import Image
 from dotenv import load_dotenv
 import logging
-from contextlib import contextmanager
-import tempfile
-from tenacity import retry, stop_after_attempt, wait_exponential
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential, RetryError
 import subprocess
+import contextvars
+from concurrent.futures import ThreadPoolExecutor
+from json_repair import repair_json
+from ocr_backends import image_to_text_with_confidence, resolve_backend
+from page_render import render_page
+from OCR_EC import extract_json_from_image, DEFAULT_TOKEN_BUDGET
+from application_chunks import strip_repeated_lines, chunk_pages, merge_partial_json
+from application_labels import parse_application_labels
+from model_router import route, valid_json_object
+from llm_calls import chat_completion, TRANSIENT_ERRORS
 
 # Setup logging
 logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
@@ -23,27 +29,62 @@ if not openai.api_key:
     logger.error("OPENAI_API_KEY is not set in the environment.")
     raise ValueError("OPENAI_API_KEY is required.")
 
-# Validate Tesseract installation
-try:
-    subprocess.run(["tesseract", "--version"], capture_output=True, check=True)
-except subprocess.CalledProcessError:
-    logger.error("Tesseract OCR is not installed or not found in PATH.")
-    raise EnvironmentError("Tesseract OCR is required. Install it using your package manager (e.g., `apt-get install tesseract-ocr`).")
-
-@contextmanager
-def temp_image_file():
-    fd, path = tempfile.mkstemp(suffix=".png")
-    os.close(fd)  # close the file descriptor immediately so it can be written later
+# Validate Tesseract installation (the in-process tesserocr backend does not need the CLI)
+if resolve_backend() == "pytesseract":
     try:
-        yield path
-    finally:
-        try:
-            os.remove(path)
-        except OSError:
-            pass
+        subprocess.run(["tesseract", "--version"], capture_output=True, check=True)
+    except subprocess.CalledProcessError:
+        logger.error("Tesseract OCR is not installed or not found in PATH.")
+        raise EnvironmentError("Tesseract OCR is required. Install it using your package manager (e.g., `apt-get install tesseract-ocr`).")
+
+# Pages whose mean Tesseract word confidence (0-100) falls below this are read by the vision model
+OCR_MIN_CONFIDENCE = float(os.getenv("OCR_MIN_CONFIDENCE", "60"))
+VISION_FALLBACK_DPI = 200
+# Concurrent structuring calls for long applications (chunk size: APPLICATION_CHUNK_CHARS)
+CHUNK_WORKERS = int(os.getenv("APPLICATION_CHUNK_WORKERS", "4"))
+# Read the known template labels deterministically and ask the model only for the rest
+USE_LABEL_PARSER = os.getenv("APPLICATION_LABEL_PARSER", "1") == "1"
+
+
+def json_to_lines(data, prefix=""):
+    """Flatten a vision JSON page into the 'Key: Value' lines the OCR text would have given."""
+    lines = []
+    items = data.items() if isinstance(data, dict) else enumerate(data, 1)
+    for key, value in items:
+        label = f"{prefix} - {key}" if prefix else str(key)
+        if isinstance(value, (dict, list)):
+            lines.extend(json_to_lines(value, label))
+        else:
+            lines.append(f"{label}: {'' if value is None else value}")
+    return lines
+
+
+def read_page_with_vision(page, page_no):
+    """Vision extraction of one page as 'Key: Value' text, or None if it failed."""
+    try:
+        img = render_page(page, dpi=VISION_FALLBACK_DPI, gray=False)
+        reply = route(
+            "application_page",
+            lambda model: extract_json_from_image(img, 0, DEFAULT_TOKEN_BUDGET, model=model),
+            valid_json_object
+        )
+        data, repairs = repair_json(reply)
+    except RetryError as e:
+        logger.error(f"Page {page_no}: vision fallback failed: {e.last_attempt.exception()}")
+        return None
+    except ValueError as e:
+        logger.error(f"Page {page_no}: vision fallback returned no JSON: {str(e)}")
+        return None
+    except Exception as e:
+        # Rejected requests and render errors are not retried; the page keeps its OCR text
+        logger.error(f"Page {page_no}: vision fallback failed: {type(e).__name__}: {e}")
+        return None
+    if not isinstance(data, (dict, list)) or not data:
+        return None
+    return "\n".join(json_to_lines(data))
 
 
-def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, model="gpt-4o", temperature=0, clean_non_ascii=False):
+def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, model=None, temperature=0, clean_non_ascii=False, ocr_backend=None, min_confidence=None):
     """
     Process a PDF file to extract text using OCR, convert to JSON using OpenAI, and save results.
     
@@ -52,12 +93,14 @@ def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, m
         output_dir (str): Directory to save output files.
         zoom (float): Zoom factor for PDF rendering.
         save_text (bool): Whether to save extracted OCR text.
-        model (str): OpenAI model to use (e.g., 'gpt-4o').
+        model (str): OpenAI model to use (e.g., 'gpt-4o'); None routes cheap-first through model_router.
         temperature (float): Temperature for OpenAI API call.
         clean_non_ascii (bool): Whether to remove non-ASCII characters from text.
+        ocr_backend (str): OCR engine ('tesserocr', 'pytesseract' or 'auto'); defaults to OCR_BACKEND.
+        min_confidence (float): Mean OCR word confidence below which a page is read by the vision model; defaults to OCR_MIN_CONFIDENCE.
     
     Returns:
-        dict: Paths to output files and extracted data.
+        dict: Paths to output files, extracted data, the repairs applied to the model's JSON and the OCR confidence and source of each page.
     """
     # Validate inputs
     if not os.path.exists(pdf_path):
@@ -82,23 +125,35 @@ def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, m
         logger.error(f"Failed to open PDF: {str(e)}")
         raise
 
-    all_text = ""
+    min_confidence = OCR_MIN_CONFIDENCE if min_confidence is None else min_confidence
+    page_texts = []
+    page_sources = []
     for page_num in range(len(doc)):
         try:
             page = doc.load_page(page_num)
-            mat = fitz.Matrix(zoom, zoom)
-            pix = page.get_pixmap(matrix=mat, alpha=False)
-            with temp_image_file() as temp_img_path:
-                img = Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-                img.save(temp_img_path, format="PNG")
-                text = pytesseract.image_to_string(img)
-                all_text += text + "\n"
+            # Single-channel render handed to the OCR engine without copying the pixels
+            img = render_page(page, zoom=zoom)
+            text, confidence = image_to_text_with_confidence(img, ocr_backend)
+            source = "ocr"
+            # Faxed or skewed pages give garbage text, and scans OCR cannot read give no words at all;
+            # only those pay for a vision call
+            if confidence is None or confidence < min_confidence:
+                found = "no words found" if confidence is None else f"mean OCR confidence {confidence:.0f} below {min_confidence:.0f}"
+                logger.warning(f"Page {page_num + 1}: {found}, reading it with the vision model.")
+                vision_text = read_page_with_vision(page, page_num + 1)
+                if vision_text:
+                    text, source = vision_text, "vision"
+            page_sources.append({"page": page_num + 1, "confidence": None if confidence is None else round(confidence, 1), "source": source})
+            page_texts.append(text)
         except Exception as e:
             logger.error(f"Failed to process page {page_num + 1}: {str(e)}")
-            all_text += f"[Error on page {page_num + 1}: {str(e)}]\n"
+            page_texts.append(f"[Error on page {page_num + 1}: {str(e)}]")
 
     if clean_non_ascii:
-        all_text = re.sub(r'[^\x00-\x7F]+', ' ', all_text)
+        page_texts = [re.sub(r'[^\x00-\x7F]+', ' ', text) for text in page_texts]
+    # Running headers and footers repeat on every page and only cost tokens
+    page_texts = strip_repeated_lines(page_texts)
+    all_text = "\n".join(page_texts) + "\n"
 
     if save_text:
         try:
@@ -109,14 +164,23 @@ def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, m
             logger.error(f"Failed to save OCR text to {text_output_path}: {str(e)}")
             raise
 
-    @retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-    def call_openai_api(text):
-        return openai.chat.completions.create(
-            model=model,
+    label_fields, unresolved = parse_application_labels(all_text) if USE_LABEL_PARSER else ({}, [])
+    if label_fields:
+        logger.info(f"Read {len(label_fields)} fields from the template labels; {len(unresolved)} left for the model.")
+        # The model is asked only for the fields the labels did not resolve
+        system_prompt = ("Extract the values of only these fields from the input text: " + "; ".join(unresolved) +
+                         ". Use exactly these names as keys, fill a missing field with empty string, and return a valid JSON object.")
+    else:
+        system_prompt = "Extract all possible key-value pairs from the input text. Fill the missing filed with empty string, don't miss any key, and return a valid JSON object."
+
+    @retry(retry=retry_if_exception_type(TRANSIENT_ERRORS), stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+    def call_openai_api(text, model_name):
+        return chat_completion(
+            model=model_name,
             messages=[
                 {
                     "role": "system",
-                    "content": "Extract all possible key-value pairs from the input text. Fill the missing filed with empty string, don't miss any key, and return a valid JSON object." 
+                    "content": system_prompt 
                 },
                 {
                     "role": "user",
@@ -126,43 +190,64 @@ def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, m
             temperature=temperature
         )
 
-    def clean_response(response_text):
-        response_text = response_text.strip()
-        if response_text.startswith("```json"):
-            response_text = response_text.removeprefix("```json").removesuffix("```").strip()
-        elif response_text.startswith("```"):
-            response_text = response_text.removeprefix("```").removesuffix("```").strip()
-        elif response_text.lower().startswith("json"):
-            response_text = response_text[4:].strip()
-        return response_text
-
-    try:
-        response = call_openai_api(all_text)
-        if not response.choices or not hasattr(response.choices[0].message, "content"):
-            logger.error("No valid response content from OpenAI.")
-            raise ValueError("No valid response content from OpenAI.")
+    def structure_chunk(text):
+        """Structured JSON of one chunk of OCR text and the repairs it needed."""
+        def ask(model_name):
+            response = call_openai_api(text, model_name)
+            if not response.choices or not hasattr(response.choices[0].message, "content"):
+                logger.error("No valid response content from OpenAI.")
+                raise ValueError("No valid response content from OpenAI.")
+            return response.choices[0].message.content
 
-        raw_response = response.choices[0].message.content
-        cleaned_response = clean_response(raw_response)
+        if model:
+            raw_response = ask(model)
+        else:
+            # Escalate when the reply misses requested keys or holds implausible elevations
+            raw_response = route("application", ask, lambda reply: valid_json_object(reply, unresolved if label_fields else None))
         try:
-            json_data = json.loads(cleaned_response)
+            json_data, repairs = repair_json(raw_response)
+            if repairs:
+                logger.warning(f"Repaired JSON response: {', '.join(repairs)}")
             if not isinstance(json_data, dict):
                 logger.warning("OpenAI response is not a dictionary, wrapping as error.")
-                json_data = {"error": "Non-dict response", "raw": cleaned_response}
-        except json.JSONDecodeError as e:
-            logger.error(f"JSON decode error: {str(e)}, raw response: {cleaned_response}")
-            json_data = {"error": "Invalid JSON", "raw": cleaned_response}
-
-    except openai.APIError as e:
-        logger.error(f"OpenAI API error: {str(e)}")
-        json_data = {"error": f"OpenAI API error: {str(e)}"}
-        with open(raw_response_path, "w", encoding="utf-8") as f:
-            f.write(f"OpenAI API error: {str(e)}")
-    except Exception as e:
-        logger.error(f"Unexpected error during API call: {str(e)}")
-        json_data = {"error": f"Unexpected error: {str(e)}"}
-        with open(raw_response_path, "w", encoding="utf-8") as f:
-            f.write(f"Exception occurred: {str(e)}")
+                json_data = {"error": "Non-dict response", "raw": raw_response}
+        except ValueError as e:
+            logger.error(f"JSON decode error: {str(e)}, raw response: {raw_response}")
+            json_data, repairs = {"error": "Invalid JSON", "raw": raw_response}, []
+        return json_data, repairs
+
+    repairs = []
+    if label_fields and not unresolved:
+        # Templated application: every field was read from its label, no model call needed
+        json_data = dict(label_fields)
+    else:
+        try:
+            # Long packets are split on page / section boundaries and the chunks structured concurrently
+            chunks = chunk_pages(page_texts)
+            if len(chunks) > 1:
+                logger.info(f"Structuring {len(chunks)} chunks of OCR text concurrently.")
+            with ThreadPoolExecutor(max_workers=max(1, min(CHUNK_WORKERS, len(chunks)))) as executor:
+                # Each chunk runs in a copy of this context, so its model calls count towards the caller's measure_usage()
+                futures = [executor.submit(contextvars.copy_context().run, structure_chunk, chunk) for chunk in chunks or [all_text]]
+                results = [future.result() for future in futures]
+            parts = [data for data, _ in results if "error" not in data]
+            repairs = list(dict.fromkeys(r for _, chunk_repairs in results for r in chunk_repairs))
+            # Results are merged in document order, so the output does not depend on completion order
+            json_data = merge_partial_json(parts) if parts else results[0][0]
+
+        except openai.APIError as e:
+            logger.error(f"OpenAI API error: {str(e)}")
+            json_data = {"error": f"OpenAI API error: {str(e)}"}
+            with open(raw_response_path, "w", encoding="utf-8") as f:
+                f.write(f"OpenAI API error: {str(e)}")
+        except Exception as e:
+            logger.error(f"Unexpected error during API call: {str(e)}")
+            json_data = {"error": f"Unexpected error: {str(e)}"}
+            with open(raw_response_path, "w", encoding="utf-8") as f:
+                f.write(f"Exception occurred: {str(e)}")
+        if label_fields:
+            # Values read from the printed labels take precedence over the model's
+            json_data = merge_partial_json([{} if "error" in json_data else json_data, label_fields])
 
     try:
         with open(json_output_path, "w", encoding="utf-8") as json_file:
@@ -177,7 +262,10 @@ def process_application(pdf_path, output_dir="JSONs", zoom=4, save_text=False, m
         "text_path": text_output_path if save_text else "",
         "json_path": json_output_path,
         "raw_response_path": raw_response_path,
-        "data": json_data
+        "data": json_data,
+        "repairs": repairs,
+        "pages": page_sources,
+        "label_fields": sorted(label_fields)
     }
 
 if __name__ == "__main__":
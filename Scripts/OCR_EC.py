@@ -4,13 +4,20 @@ import os
 import json
 import re
 import logging
-from PIL import Image
+import threading
 import fitz  # PyMuPDF
 from dotenv import load_dotenv
 from contextlib import contextmanager
 import tempfile
-from tenacity import retry, stop_after_attempt, wait_exponential, RetryError
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential, RetryError
 from io import BytesIO
+from layout_EC import extract_layout_page, has_text_layer, overlay_fields, is_layout_complete, MIN_TEXT_LAYER_WORDS
+from page_classifier import classify_pages, save_photo_pages, PAGE_DATA, PAGE_PHOTO
+from ec_meta import save_EC_meta
+from json_repair import repair_json
+from page_render import render_page
+from model_router import route, valid_json_object
+from llm_calls import chat_completion, TRANSIENT_ERRORS
  
 # Load environment variables
 load_dotenv()
@@ -45,6 +52,11 @@ def temp_image_file():
     with tempfile.NamedTemporaryFile(suffix=".png", delete=True) as temp_file:
         yield temp_file.name
 
+# Render a single PDF page to an RGB PIL image for the vision model (checkboxes and hand-filled
+# entries are often coloured; grayscale renders are for OCR only)
+def page_to_image(page, dpi):
+    return render_page(page, dpi=dpi, gray=False)
+
 # Convert PDF to list of PIL images
 def pdf_to_images(path, dpi, page_limit):
     try:
@@ -52,10 +64,7 @@ def pdf_to_images(path, dpi, page_limit):
         total_pages = len(doc)
         if total_pages > page_limit:
             logger.warning(f"PDF has {total_pages} pages, but only {page_limit} will be processed.")
-        return [
-            Image.frombytes("RGB", [pix.width, pix.height], pix.samples)
-            for pix in [doc[i].get_pixmap(dpi=dpi) for i in range(min(total_pages, page_limit))]
-        ]
+        return [page_to_image(doc[i], dpi) for i in range(min(total_pages, page_limit))]
     except Exception as e:
         logger.error(f"Failed to process PDF: {str(e)}")
         raise
@@ -71,43 +80,167 @@ def image_to_base64(image):
         logger.exception("Failed to convert image to base64")
         raise
 
+# Output-token budgets per EC section, used for pages without a text layer to size the request
+SECTION_TOKEN_BUDGETS = {"a": 1300, "b": 900, "c": 1100, "d": 500, "e": 800, "f": 400, "g": 600, "h": 700}
+DEFAULT_TOKEN_BUDGET = 1800
+# Output repeats most of the printed labels plus the values
+TOKENS_PER_WORD = 1.4
+MIN_TOKEN_BUDGET = 600
+# Growth factor per page type, raised whenever a page of that type still comes back truncated and
+# decayed back towards 1 by every page of that type that fits; shared by concurrent extractions
+BUDGET_GROWTH = 1.5
+BUDGET_DECAY = 0.9
+MAX_BUDGET_GROWTH = 4.0
+_budget_growth = {}
+_budget_lock = threading.Lock()
+
+CONTINUE_PROMPT = "Your previous reply was cut off. Continue the JSON exactly where it stopped, without repeating anything and without code fences."
+
+
+def _page_type(sections):
+    return "+".join(sections) or "unknown"
+
+
+def estimate_max_tokens(page, sections):
+    words = len(page.get_text("words"))
+    if words >= MIN_TEXT_LAYER_WORDS:
+        estimate = int(words * TOKENS_PER_WORD) + 200
+    else:
+        estimate = sum(SECTION_TOKEN_BUDGETS.get(s, 0) for s in sections) or DEFAULT_TOKEN_BUDGET
+    with _budget_lock:
+        growth = _budget_growth.get(_page_type(sections), 1.0)
+    estimate = int(estimate * growth)
+    ceiling = int(os.getenv("EC_MAX_TOKENS_CEILING", 4096))
+    return max(MIN_TOKEN_BUDGET, min(estimate, ceiling))
+
+
+def record_truncation(sections):
+    key = _page_type(sections)
+    with _budget_lock:
+        growth = _budget_growth[key] = min(_budget_growth.get(key, 1.0) * BUDGET_GROWTH, MAX_BUDGET_GROWTH)
+    logger.info(f"Token budget for '{key}' pages raised to x{growth:.2f}.")
+
+
+def record_fit(sections):
+    key = _page_type(sections)
+    with _budget_lock:
+        if key in _budget_growth:
+            growth = _budget_growth[key] * BUDGET_DECAY
+            if growth <= 1.0:
+                del _budget_growth[key]
+            else:
+                _budget_growth[key] = growth
+
+
+def strip_code_fences(content):
+    content = content.strip()
+    if content.startswith("```json"):
+        content = content[7:]
+    elif content.startswith("```"):
+        content = content[3:]
+    if content.endswith("```"):
+        content = content[:-3]
+    return content.strip()
+
+# A continuation resumes mid-token, so only the fence lines are removed; the whitespace at the cut is content
+LEADING_FENCE = re.compile(r"^\s*```(?:json)?[ \t]*\n?")
+TRAILING_FENCE = re.compile(r"\n?[ \t]*```\s*$")
+
+
+def strip_fence_markers(content):
+    return TRAILING_FENCE.sub("", LEADING_FENCE.sub("", content, count=1), count=1)
+
 # Retryable: Extract JSON from image via OpenAI Vision API
-@retry(stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
-def extract_json_from_image(image, temperature, max_tokens):
+# Truncated replies (finish_reason "length") are continued up to EC_MAX_CONTINUATIONS times;
+# when info is given it receives the model and budget used and whether the reply was truncated.
+@retry(retry=retry_if_exception_type(TRANSIENT_ERRORS), stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def extract_json_from_image(image, temperature, max_tokens, info=None, model="gpt-4o"):
     try:
         base64_img = image_to_base64(image)
-        response = openai.chat.completions.create(
-            model="gpt-4o",
-            messages=[
-                {
-                    "role": "user",
-                    "content": [
-                        {
-                            "type": "text",
-                            "text": "Extract all meaningful key-value pairs from this image, try to structure the key-values pairs according to sections. Some keys may repeat, fetch them as it, nothing to miss if any key does not have any value fill it with empty string, and return only a valid JSON object."
-                        },
-                        {
-                            "type": "image_url",
-                            "image_url": {"url": f"data:image/png;base64,{base64_img}"}
-                        }
-                    ]
-                }
-            ],
-            temperature=temperature,
-            max_tokens=max_tokens
-        )
-        content = response.choices[0].message.content.strip()
-        if content.startswith("```json"):
-            content = content[7:-3].strip()
-        elif content.startswith("```"):
-            content = content[3:-3].strip()
-        return content
+        messages = [
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": "Extract all meaningful key-value pairs from this image, try to structure the key-values pairs according to sections. Some keys may repeat, fetch them as it, nothing to miss if any key does not have any value fill it with empty string, and return only a valid JSON object."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/png;base64,{base64_img}"}
+                    }
+                ]
+            }
+        ]
+        max_continuations = int(os.getenv("EC_MAX_CONTINUATIONS", 2))
+        parts = []
+        for attempt in range(max_continuations + 1):
+            response = chat_completion(
+                model=model,
+                messages=messages,
+                temperature=temperature,
+                max_tokens=max_tokens
+            )
+            choice = response.choices[0]
+            part = choice.message.content or ""
+            parts.append(part if attempt == 0 else strip_fence_markers(part))
+            if choice.finish_reason != "length":
+                break
+            logger.warning(f"Response truncated at {max_tokens} tokens (attempt {attempt + 1}).")
+            messages = messages + [
+                {"role": "assistant", "content": part},
+                {"role": "user", "content": CONTINUE_PROMPT}
+            ]
+        if info is not None:
+            info.update({
+                "model": model,
+                "max_tokens": max_tokens,
+                "continuations": len(parts) - 1,
+                "truncated": choice.finish_reason == "length"
+            })
+        return strip_code_fences("".join(parts))
     except Exception as e:
         logger.exception("OpenAI API call failed inside extract_json_from_image")
         raise
 
+# Vision extraction of one page; returns the raw page dict, an error dict, or None for an empty page
+def extract_page_with_vision(img, page_no, temperature, max_tokens, info=None, model=None):
+    try:
+        if model:
+            result = extract_json_from_image(img, temperature, max_tokens, info, model=model)
+        else:
+            # Cheap model first; the stronger one only if the reply is not a plausible page object
+            result = route(
+                "ec_page",
+                lambda m: extract_json_from_image(img, temperature, max_tokens, info, model=m),
+                valid_json_object
+            )
+        try:
+            parsed, repairs = repair_json(result)
+            if repairs:
+                logger.warning(f"Page {page_no}: Repaired JSON response ({', '.join(repairs)}).")
+                if info is not None:
+                    info["repairs"] = repairs
+            if not isinstance(parsed, dict):
+                logger.warning(f"Page {page_no}: Response is not a dictionary, skipping.")
+                return {"error": "Non-dict response", "raw": result}
+            if not parsed:
+                logger.info(f"Page {page_no}: Empty JSON object, skipping.")
+                return None
+            return parsed
+        except ValueError as e:
+            logger.error(f"Page {page_no}: JSON decode error: {str(e)}")
+            return {"error": "Invalid JSON", "raw": result}
+    except RetryError as e:
+        root_cause = e.last_attempt.exception()
+        logger.error(f"Page {page_no}: RetryError - {type(root_cause).__name__}: {root_cause}")
+        return {"error": "RetryError", "details": str(root_cause)}
+    except Exception as e:
+        logger.error(f"Page {page_no}: Failed to process: {str(e)}")
+        return {"error": str(e)}
+
 # Main processing function
-def process_EC(pdf_path, output_dir="JSONs", dpi=300, page_limit=None, temperature=0.2, max_tokens=1800):
+def process_EC(pdf_path, output_dir="JSONs", dpi=300, page_limit=None, temperature=0.2, max_tokens=None, use_layout=True, min_confidence=None, model=None):
     os.makedirs(output_dir, exist_ok=True)
 
     if not os.path.exists(pdf_path):
@@ -117,43 +250,85 @@ def process_EC(pdf_path, output_dir="JSONs", dpi=300, page_limit=None, temperatu
     page_limit = page_limit or int(os.getenv("VALID_PAGES_LIMIT", 8))
     if page_limit <= 0:
         raise ValueError("Page limit must be a positive integer.")
+    if min_confidence is None:
+        min_confidence = float(os.getenv("EC_LAYOUT_MIN_CONFIDENCE", 0.8))
 
     logger.info(f"Processing PDF: {pdf_path}")
-    images = pdf_to_images(pdf_path, dpi=dpi, page_limit=page_limit)
+    try:
+        doc = fitz.open(pdf_path)
+    except Exception as e:
+        logger.error(f"Failed to process PDF: {str(e)}")
+        raise
+    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
+
+    # Route pages locally before paying for any vision call
+    classify_limit = int(os.getenv("EC_CLASSIFY_PAGES_LIMIT", 30))
+    labels = classify_pages(doc, classify_limit)
+    data_pages = [i for i, label in enumerate(labels) if label["label"] == PAGE_DATA]
+    photo_pages = [i for i, label in enumerate(labels) if label["label"] == PAGE_PHOTO]
+    if len(data_pages) > page_limit:
+        logger.warning(f"PDF has {len(data_pages)} data pages, but only {page_limit} will be processed.")
+        data_pages = data_pages[:page_limit]
+    photo_paths = save_photo_pages(doc, photo_pages, os.path.join(output_dir, base_name + "_photos"))
+    render_dir = os.path.join(output_dir, base_name + "_pages") if os.getenv("EC_CACHE_RENDERS", "1") == "1" else None
+
     all_pages_data = {}
+    pages_meta = {
+        f"page_{i+1}": {"label": label["label"], "sections": label["sections"], "reason": label["reason"]}
+        for i, label in enumerate(labels)
+    }
 
-    for i, img in enumerate(images):
+    for i in data_pages:
         logger.info(f"Processing page {i+1}")
-        try:
-            result = extract_json_from_image(img, temperature, max_tokens)
-            try:
-                parsed = json.loads(result)
-                if not isinstance(parsed, dict):
-                    logger.warning(f"Page {i+1}: Response is not a dictionary, skipping.")
-                    all_pages_data[f"page_{i+1}"] = {"error": "Non-dict response", "raw": result}
-                    continue
-                if not parsed:
-                    logger.info(f"Page {i+1}: Empty JSON object, skipping.")
-                    continue
-                all_pages_data[f"page_{i+1}"] = convert_keys_to_camel_case(parsed)
-            except json.JSONDecodeError as e:
-                logger.error(f"Page {i+1}: JSON decode error: {str(e)}")
-                all_pages_data[f"page_{i+1}"] = {"error": "Invalid JSON", "raw": result}
-        except RetryError as e:
-            root_cause = e.last_attempt.exception()
-            logger.error(f"Page {i+1}: RetryError - {type(root_cause).__name__}: {root_cause}")
-            all_pages_data[f"page_{i+1}"] = {"error": "RetryError", "details": str(root_cause)}
-        except Exception as e:
-            logger.error(f"Page {i+1}: Failed to process: {str(e)}")
-            all_pages_data[f"page_{i+1}"] = {"error": str(e)}
+        page = doc[i]
+        layout_data, confidence, regions = {}, {}, {}
+        if use_layout and has_text_layer(page):
+            layout_data, confidence, regions = extract_layout_page(page)
+
+        # Every anchored field read confidently from the text layer, and no field outside the template on the
+        # page: no vision call. Other pages are extracted in full and the confident fields overlaid.
+        if confidence and min(confidence.values()) >= min_confidence and is_layout_complete(labels[i]["sections"]):
+            logger.info(f"Page {i+1}: {len(confidence)} fields read from the text layer.")
+            all_pages_data[f"page_{i+1}"] = convert_keys_to_camel_case(layout_data)
+            pages_meta[f"page_{i+1}"].update({"source": "layout", "confidence": confidence, "regions": regions})
+            continue
+
+        img = page_to_image(page, dpi)
+        if render_dir:
+            # Kept for field-targeted re-extraction of missing values
+            os.makedirs(render_dir, exist_ok=True)
+            render_path = os.path.join(render_dir, f"page_{i+1}.png")
+            img.save(render_path)
+            pages_meta[f"page_{i+1}"].update({"render": render_path, "dpi": dpi})
+        # Size the output budget for this page type instead of the worst case on every page
+        sections = labels[i]["sections"]
+        budget = max_tokens or estimate_max_tokens(page, sections)
+        info = {}
+        parsed = extract_page_with_vision(img, i + 1, temperature, budget, info, model)
+        if info.get("continuations"):
+            record_truncation(sections)
+        elif "continuations" in info:
+            record_fit(sections)
+        pages_meta[f"page_{i+1}"].update(info)
+        source = "vision"
+        if confidence:
+            if parsed is None or "error" in parsed:
+                logger.warning(f"Page {i+1}: vision fallback failed, keeping the text layer fields.")
+                parsed, source = layout_data, "layout"
+            else:
+                parsed, source = overlay_fields(parsed, layout_data, confidence, min_confidence), "layout+vision"
+        pages_meta[f"page_{i+1}"].update({"source": source, "confidence": confidence, "regions": regions})
+        if parsed is None:
+            continue
+        all_pages_data[f"page_{i+1}"] = parsed if "error" in parsed else convert_keys_to_camel_case(parsed)
 
-    base_name = os.path.splitext(os.path.basename(pdf_path))[0]
     json_path = os.path.join(output_dir, base_name + ".json")
 
     try:
         with open(json_path, "w", encoding="utf-8") as f:
             json.dump(all_pages_data, f, ensure_ascii=False, indent=2)
         logger.info(f"JSON saved to: {json_path}")
+        save_EC_meta(json_path, {"pdf_path": pdf_path, "pages": pages_meta, "photos": photo_paths})
     except IOError as e:
         logger.error(f"Failed to write JSON to {json_path}: {str(e)}")
         raise
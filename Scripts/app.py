@@ -1,24 +1,105 @@
 import os
-import subprocess
-import sys
+import json
+import time
+import threading
 from flask import Flask, request, jsonify, render_template
 
 from OCR_EC import process_EC
+from ec_meta import load_EC_meta
 from OCR_Application import process_application
 import Scripts.compare_2 as compare_2
+from photo_prep import prepare_photos, upload_names
+from photo_quality import check_photo_quality, QUALITY_REJECTED
+from model_router import routing_summary
+import workspace
+import blob_store
+import storage
+import results_store
+from llm_calls import measure_usage
+import shadow
 
 app = Flask(__name__)
-app.config['UPLOAD_FOLDER'] = 'uploads'
 ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'pdf', 'webp'}
 
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('JSONs', exist_ok=True)
+# Old jobs and unreferenced upload blobs are collected at most this often
+GC_INTERVAL_SECONDS = int(os.getenv("GC_INTERVAL_SECONDS", "3600"))
+_last_gc = 0.0
+_gc_lock = threading.Lock()
+
+os.makedirs(workspace.JOBS_DIR, exist_ok=True)
 
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
 
+def requested_job_id():
+    return request.values.get('job_id') or (request.get_json(silent=True) or {}).get('job_id')
+
+
+def job_for_upload():
+    """The job named in the request, or a new job when the upload starts a submission."""
+    job_id = requested_job_id()
+    if not job_id:
+        housekeeping()
+        return workspace.create_job()
+    if not workspace.job_exists(job_id):
+        return None
+    return job_id
+
+
+def store_upload(job_id, file):
+    """Stream an upload into the blob store and reference it from the job. Returns (digest, path)."""
+    digest, path, deduplicated = blob_store.put_stream(file.stream, os.path.splitext(file.filename)[1], job_id)
+    workspace.record_upload(job_id, file.filename, digest)
+    if deduplicated:
+        app.logger.info(f"{file.filename}: identical content already stored as {digest}.")
+    return digest, path
+
+
+def _has_error(data):
+    return 'error' in data or any(isinstance(v, dict) and 'error' in v for v in data.values())
+
+
+def cached_extraction(digest, kind, extract):
+    """
+    JSON path of extract(output_dir) for an uploaded blob. The digest is the cache key, so identical
+    content is extracted once; outputs holding an error are extracted again on the next upload.
+    """
+    out_dir = blob_store.derived_dir(digest, kind)
+    json_path = os.path.join(out_dir, digest + '.json')
+    with blob_store.derive_lock(digest, kind):
+        # Another node may have extracted it already
+        storage.ensure_local_tree(out_dir)
+        if os.path.exists(json_path):
+            with open(json_path, encoding='utf-8') as f:
+                if not _has_error(json.load(f)):
+                    app.logger.info(f"{kind} extraction of {digest} served from cache.")
+                    return json_path
+        # The extractors check the output directory is writable before creating it
+        os.makedirs(out_dir, exist_ok=True)
+        result_path = extract(out_dir)
+        storage.sync_tree(out_dir)
+        return result_path
+
+
+def housekeeping():
+    """Expire old jobs, then unreferenced blobs, in the background at most every GC_INTERVAL_SECONDS."""
+    global _last_gc
+    with _gc_lock:
+        if time.time() - _last_gc < GC_INTERVAL_SECONDS:
+            return
+        _last_gc = time.time()
+
+    def collect():
+        try:
+            workspace.expire_jobs()
+            blob_store.collect_garbage(workspace.job_exists)
+        except Exception as e:
+            app.logger.error(f"Garbage collection failed: {e}")
+    threading.Thread(target=collect, daemon=True).start()
+
+
 @app.route('/')
 def index():
     return render_template('index.html')
@@ -29,20 +110,33 @@ def upload_ec():
     file = request.files.get('ec_file')
     if not file or file.filename == '':
         return jsonify({'error': 'No EC file uploaded'}), 400
-    path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(path)
-    result_path = process_EC(path, output_dir='JSONs')
-    return jsonify({'json_path': result_path})
+    job_id = job_for_upload()
+    if not job_id:
+        return jsonify({'error': 'Unknown job'}), 404
+    digest, path = store_upload(job_id, file)
+    with measure_usage() as usage:
+        result_path = cached_extraction(digest, 'ec', lambda out_dir: process_EC(path, output_dir=out_dir))
+    workspace.set_artifact(job_id, 'ec_json', result_path)
+    # A sample of the ECs is extracted again in the background with the shadow candidate configuration
+    if shadow.sampled():
+        shadow.shadow_EC(process_EC, path, result_path, usage, os.path.join(workspace.output_dir(job_id), 'shadow'))
+    # Photo pages found inside the EC are rendered for the image rules, next to the uploaded photos
+    return jsonify({'job_id': job_id, 'json_path': result_path, 'photo_paths': load_EC_meta(result_path)['photos']})
 
 @app.route('/upload_application', methods=['POST'])
 def upload_application_route():
     file = request.files.get('application_file')
     if not file or file.filename == '':
         return jsonify({'error': 'No application file uploaded'}), 400
-    path = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-    file.save(path)
-    result = process_application(path, output_dir='JSONs')
-    return jsonify({'json_path': result['json_path']})
+    job_id = job_for_upload()
+    if not job_id:
+        return jsonify({'error': 'Unknown job'}), 404
+    digest, path = store_upload(job_id, file)
+    json_path = cached_extraction(
+        digest, 'application', lambda out_dir: process_application(path, output_dir=out_dir)['json_path']
+    )
+    workspace.set_artifact(job_id, 'application_json', json_path)
+    return jsonify({'job_id': job_id, 'json_path': json_path})
 
 
 @app.route('/upload_photos', methods=['POST'])
@@ -50,29 +144,105 @@ def upload_photos():
     files = request.files.getlist('photos')
     if not files:
         return jsonify({'error': 'No photo files uploaded'}), 400
+    job_id = job_for_upload()
+    if not job_id:
+        return jsonify({'error': 'Unknown job'}), 404
     saved_paths = []
     for f in files:
         if f and allowed_file(f.filename):
-            p = os.path.join(app.config['UPLOAD_FOLDER'], f.filename)
-            f.save(p)
-            saved_paths.append(p)
+            saved_paths.append(store_upload(job_id, f)[1])
     if not saved_paths:
         return jsonify({'error': 'No valid photos uploaded'}), 400
-    result = compare_2.analyze_image(saved_paths, ["Validate photographs"])
-    return jsonify({'result': result})
+    names_token = upload_names.set(workspace.upload_names(job_id))
+    try:
+        # Decode and encode the photos once; every image rule reuses these payloads
+        quality = check_photo_quality(prepare_photos(saved_paths))
+        if all(v['status'] == QUALITY_REJECTED for v in quality):
+            return jsonify({'job_id': job_id, 'error': 'No usable photos uploaded', 'quality': quality}), 400
+        workspace.set_artifact(job_id, 'photos', saved_paths)
+        # Photo-only rules run in the background while the EC and application are extracted
+        compare_2.start_photo_only_rules(saved_paths)
+        result = compare_2.analyze_image(saved_paths, ["Validate photographs"])
+    finally:
+        upload_names.reset(names_token)
+    return jsonify({'job_id': job_id, 'result': result, 'quality': quality})
 
 
 @app.route('/process', methods=['POST'])
 def process_all():
-    """Run all comparison rules using compare.py."""
+    """Run all comparison rules on the EC, application and photos uploaded to a job."""
+    job_id = requested_job_id()
+    if not job_id:
+        return jsonify({'error': 'No job_id given'}), 400
+    if not workspace.job_exists(job_id):
+        return jsonify({'error': 'Unknown job'}), 404
+    # Rules whose inputs are unchanged since the job's last evaluation are reused, unless full=1
+    full = str(request.values.get('full') or (request.get_json(silent=True) or {}).get('full') or '') in ('1', 'true')
+    previous = None if full else results_store.previous_results(job_id)
+    try:
+        results = compare_2.run_all_comparisons(job_id=job_id, previous=previous)
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    if 'error' in results:
+        return jsonify(results), 500
+    workspace.save_json(job_id, 'results', results)
+    # The results are already saved with the job; a failing results store only costs the reporting history
     try:
-        completed = subprocess.run([
-            sys.executable,
-            'compare.py'
-        ], capture_output=True, text=True, check=True) 
-        return jsonify({'output': completed.stdout})
-    except subprocess.CalledProcessError as e:
-        return jsonify({'error': e.stderr or str(e)}), 500
+        results_store.save_submission(job_id, results, workspace.load_manifest(job_id).get('uploads'))
+    except Exception as e:
+        app.logger.error(f"Storing the results of job {job_id} failed: {e}")
+    # Verdicts on the shadow extraction of this EC, when it was sampled
+    ec_json = workspace.get_artifact(job_id, 'ec_json')
+    if ec_json:
+        _, data_app, _, _ = workspace.load_job_inputs(job_id)
+        shadow.shadow_verdicts(compare_2.run_all_comparisons, load_EC_meta, ec_json, data_app, results)
+    return jsonify(dict(results, job_id=job_id))
+
+
+@app.route('/results', methods=['GET'])
+def query_results():
+    """Stored rule results, e.g. /results?rule=7&status=fail&since=2026-10-12&until=2026-10-18."""
+    args = request.args
+    rows = results_store.query_rule_results(
+        rule=args.get('rule'), status=args.get('status'), since=args.get('since'), until=args.get('until'),
+        limit=args.get('limit', 100, type=int), offset=args.get('offset', 0, type=int),
+    )
+    return jsonify({'count': len(rows), 'results': rows})
+
+
+@app.route('/results/stats', methods=['GET'])
+def results_stats():
+    """Per rule pass / fail / warning counts in a date range."""
+    return jsonify(results_store.rule_statistics(request.args.get('since'), request.args.get('until')))
+
+
+@app.route('/results/<job_id>', methods=['GET'])
+def stored_results(job_id):
+    """Stored outcome of a job."""
+    submission = results_store.get_submission(job_id)
+    if submission is None:
+        return jsonify({'error': 'No stored results for this job'}), 404
+    return jsonify(submission)
+
+
+@app.route('/jobs/<job_id>', methods=['GET'])
+def job_status(job_id):
+    """Manifest of a job: its uploads and extraction / result artifacts."""
+    if not workspace.job_exists(job_id):
+        return jsonify({'error': 'Unknown job'}), 404
+    return jsonify(workspace.load_manifest(job_id))
+
+
+@app.route('/model_stats', methods=['GET'])
+def model_stats():
+    """Per call class escalation rate and latency of the model cascade, and per rule image detail escalations."""
+    return jsonify(dict(routing_summary(), detail_escalations=compare_2.detail_escalation_summary()))
+
+
+@app.route('/shadow_report', methods=['GET'])
+def shadow_report():
+    """Agreement, latency and token deltas of the shadow candidate configuration."""
+    return jsonify(shadow.shadow_report(limit=request.args.get('limit', 50, type=int)))
 
 
 if __name__ == '__main__':
@@ -0,0 +1,103 @@
+import os
+import re
+from collections import Counter
+
+# Splitting of long application OCR text into chunks that are structured concurrently,
+# and the deterministic merge of the partial JSON objects.
+CHUNK_CHARS = int(os.getenv("APPLICATION_CHUNK_CHARS", "12000"))
+# Lines looked at, at the top and bottom of each page, when detecting running headers / footers
+EDGE_LINES = 3
+# A line counts as a header / footer when it is on at least this share of the pages
+REPEATED_SHARE = 0.5
+
+SECTION_HEADING = re.compile(r"^\s*(section|part)\s+[a-z0-9]+\b|^\s*[A-Z][A-Z0-9 &/,\-]{6,}$", re.IGNORECASE)
+# "Label: value" lines are form data even when a value repeats on every page (applicant name, policy number)
+LABEL_VALUE = re.compile(r"^[^:]{1,80}:\s*\S")
+
+
+def _edge_lines(lines):
+    """Indexes of the first and last EDGE_LINES non-empty lines of a page."""
+    filled = [i for i, line in enumerate(lines) if line.strip()]
+    return set(filled[:EDGE_LINES] + filled[-EDGE_LINES:])
+
+
+def strip_repeated_lines(page_texts):
+    """
+    Drop running headers and footers: lines at the top or bottom of a page whose exact text is at the top
+    or bottom of at least half of the pages. Lines in the body of a page and "label: value" lines are kept.
+    """
+    if len(page_texts) < 2:
+        return page_texts
+    pages = [text.splitlines() for text in page_texts]
+    counts = Counter()
+    for lines in pages:
+        counts.update({lines[i].strip() for i in _edge_lines(lines)})
+    repeated = {line for line, n in counts.items()
+                if n >= max(2, REPEATED_SHARE * len(page_texts)) and not LABEL_VALUE.match(line)}
+    if not repeated:
+        return page_texts
+    stripped = []
+    for lines in pages:
+        edges = _edge_lines(lines)
+        stripped.append("\n".join(line for i, line in enumerate(lines) if i not in edges or line.strip() not in repeated))
+    return stripped
+
+
+def _split_sections(text, max_chars):
+    """Split one oversized page on section headings, then on blank lines, then hard."""
+    blocks, current = [], []
+    for line in text.splitlines():
+        if current and SECTION_HEADING.match(line):
+            blocks.append("\n".join(current))
+            current = []
+        current.append(line)
+    blocks.append("\n".join(current))
+
+    pieces = []
+    for block in blocks:
+        while len(block) > max_chars:
+            cut = block.rfind("\n\n", 0, max_chars)
+            cut = cut if cut > 0 else block.rfind("\n", 0, max_chars)
+            cut = cut if cut > 0 else max_chars
+            pieces.append(block[:cut])
+            block = block[cut:].lstrip("\n")
+        pieces.append(block)
+    return pieces
+
+
+def chunk_pages(page_texts, max_chars=None):
+    """Pack whole pages (or the sections of oversized pages) into chunks of at most max_chars."""
+    max_chars = max_chars or CHUNK_CHARS
+    pieces = []
+    for text in page_texts:
+        pieces.extend([text] if len(text) <= max_chars else _split_sections(text, max_chars))
+
+    chunks, current = [], ""
+    for piece in pieces:
+        if current and len(current) + len(piece) + 1 > max_chars:
+            chunks.append(current)
+            current = ""
+        current = f"{current}\n{piece}" if current else piece
+    if current.strip():
+        chunks.append(current)
+    return chunks
+
+
+def _is_empty(value):
+    return value is None or value == "" or value == [] or value == {}
+
+
+def merge_partial_json(parts):
+    """
+    Merge the chunk objects in document order. As with duplicate keys in one JSON reply, the later
+    value wins, except that an empty value never overwrites a filled one (every chunk is asked to
+    return missing fields as empty strings). Nested objects are merged key by key.
+    """
+    merged = {}
+    for part in parts:
+        for key, value in part.items():
+            if key in merged and isinstance(merged[key], dict) and isinstance(value, dict):
+                merged[key] = merge_partial_json([merged[key], value])
+            elif key not in merged or not _is_empty(value):
+                merged[key] = value
+    return merged
@@ -0,0 +1,141 @@
+import re
+
+# Rule-based reading of the printed labels on the carrier application templates.
+# Output keys are the ones extract_essential_variables looks up (they must normalize to its lookups);
+# each field lists the label variants printed on the templates, longest first, and a value kind.
+APPLICATION_FIELDS = [
+    ("Property Address", ["Property Address", "Insured Property Address", "Property Location"], "text"),
+    ("Building Diagram Number", ["Building Diagram Number", "Diagram Number"], "diagram"),
+    ("Top of Bottom Floor", ["Top of Bottom Floor"], "number"),
+    ("Top of Next Higher Floor", ["Top of Next Higher Floor"], "number"),
+    ("Lowest Adjacent Grade (LAG)", ["Lowest Adjacent Grade (LAG)", "Lowest Adjacent Grade"], "number"),
+    ("Enclosure/Crawlspace Size", ["Enclosure/Crawlspace Size", "Enclosure Size", "Crawlspace Size"], "number"),
+    ("Building Located In CBRS/OPA", ["Building Located In CBRS/OPA", "Located in CBRS/OPA", "CBRS/OPA"], "yesno"),
+    ("Building in Course of Construction", ["Building in Course of Construction", "Course of Construction"], "yesno"),
+    ("Elevation Certificate First Floor Height", ["Elevation Certificate First Floor Height", "First Floor Height"], "number"),
+    ("Lowest Floor Elevation", ["Elevation Certificate Lowest Floor Elevation", "Lowest (Rating) Floor Elevation", "Lowest Floor Elevation"], "number"),
+    ("Elevation Certificate Section Used", ["Elevation Certificate Section Used", "EC Section Used"], "section"),
+    ("Current Base Flood Elevation(BFE)", ["Current Base Flood Elevation (BFE)", "Current Base Flood Elevation", "Base Flood Elevation"], "number"),
+    ("Machinery or Equipment Above", ["Machinery or Equipment Above", "Machinery and Equipment Above"], "text"),
+    ("Number of Openings", ["Number of Permanent Openings", "Number of Flood Openings", "Number of Openings"], "number"),
+    ("Area of Permanent Openings (Sq. In.)", ["Area of Permanent Openings (Sq. In.)", "Area of Permanent Openings"], "number"),
+    ("Occupancy Type", ["Occupancy Type", "Occupancy"], "text"),
+    ("Total # of floors in building", ["Total # of Floors in Building", "Total Number of Floors in Building", "Number of Floors"], "number"),
+    ("Building Construction Type", ["Building Construction Type", "Construction Type"], "text"),
+    ("Foundation", ["Foundation Type", "Foundation"], "text"),
+    ("Appliances on First Floor", ["Are all appliances elevated above the first floor?", "Appliances on First Floor"], "yesno"),
+    ("Current Flood Zone", ["Current Flood Zone", "Flood Zone"], "zone"),
+    ("Map Panel Suffix", ["Map Panel Suffix", "Panel Suffix"], "suffix"),
+    ("FIRM Date", ["Current FIRM Date", "FIRM Date"], "date"),
+]
+
+VALUE_PATTERNS = {
+    "number": re.compile(r"^-?\d[\d,]*(\.\d+)?\b"),
+    "yesno": re.compile(r"^(yes|no|y|n)\b", re.IGNORECASE),
+    "zone": re.compile(r"^(A|AE|AH|AO|AR|A99|A\d{1,2}|V|VE|V\d{1,2}|D|B|C|X)\b", re.IGNORECASE),
+    "suffix": re.compile(r"^[A-Z]$", re.IGNORECASE),
+    "date": re.compile(r"^\d{1,2}[/\-.]\d{1,2}[/\-.]\d{2,4}\b"),
+    "diagram": re.compile(r"^[1-9][AB]?\b", re.IGNORECASE),
+    "section": re.compile(r"^(section\s+)?[CEH]\b", re.IGNORECASE),
+}
+# Checkboxes and the Yes / No options they belong to, e.g. "☐ Yes ☒ No" or "Yes [ ] No [X]"
+CHECKBOX_TOKEN = re.compile(
+    r"(?P<checked>\[\s*[xX✓✔]\s*\]|[☒☑■✓✔])|(?P<unchecked>\[\s*\]|[☐□])|\b(?P<option>yes|no)\b", re.IGNORECASE
+)
+# Labels of earlier values ("Prior Flood Zone") are not the current field
+PRIOR_LABEL = re.compile(r"\b(prior|previous)\s*$", re.IGNORECASE)
+# Values on the next line are taken only when that line is short and carries no label
+MAX_NEXT_LINE_VALUE = 60
+
+_LABELS = sorted(((variant, key) for key, variants, _ in APPLICATION_FIELDS for variant in variants),
+                 key=lambda pair: len(pair[0]), reverse=True)
+_LABEL_RE = re.compile("|".join(rf"(?<![A-Za-z])({re.escape(v)})" for v, _ in _LABELS), re.IGNORECASE)
+_KEY_BY_LABEL = {variant.lower(): key for variant, key in _LABELS}
+_KIND = {key: kind for key, _, kind in APPLICATION_FIELDS}
+
+
+def _clean(value):
+    return value.strip(" \t:-_|.").strip()
+
+
+def _checked_option(value):
+    """
+    The ticked option of a Yes / No checkbox pair; the value itself when it has no checkboxes, and ""
+    when the ticks cannot be told apart (no option ticked, both ticked, a box not next to its option).
+    """
+    tokens = list(CHECKBOX_TOKEN.finditer(value))
+    if not any(t.lastgroup != "option" for t in tokens):
+        return value
+    # The line's layout decides the side: boxes before their options ("☒ Yes") or after them ("Yes ☒")
+    boxes_first = tokens[0].lastgroup != "option"
+    checked = set()
+    for n, token in enumerate(tokens):
+        if token.lastgroup == "option":
+            continue
+        k = n + 1 if boxes_first else n - 1
+        if not 0 <= k < len(tokens) or tokens[k].lastgroup != "option":
+            return ""
+        option = tokens[k]
+        between = value[token.end():option.start()] if boxes_first else value[option.end():token.start()]
+        if between.strip():
+            return ""
+        if token.lastgroup == "checked":
+            checked.add(option.group().lower())
+    return checked.pop() if len(checked) == 1 else ""
+
+
+def _valid(kind, value):
+    if not value:
+        return False
+    if kind == "text":
+        # Checkbox leftovers and OCR noise are not values
+        return len(re.sub(r"[^A-Za-z0-9]", "", value)) >= 2
+    return bool(VALUE_PATTERNS[kind].match(value))
+
+
+def _normalize_value(kind, value):
+    if kind == "number":
+        return VALUE_PATTERNS["number"].match(value).group().replace(",", "")
+    if kind == "yesno":
+        return "Yes" if value.lower().startswith("y") else "No"
+    if kind in ("zone", "suffix", "diagram"):
+        return VALUE_PATTERNS[kind].match(value).group().upper()
+    if kind == "date":
+        return VALUE_PATTERNS["date"].match(value).group()
+    if kind == "section":
+        return VALUE_PATTERNS["section"].match(value).group()[-1].upper()
+    return value
+
+
+def parse_application_labels(text):
+    """
+    Read the known application labels from OCR / text-layer output.
+
+    Returns:
+        tuple: ({key: value} for the fields read with a valid value, [keys left unresolved]).
+    """
+    fields = {}
+    lines = text.splitlines()
+    for i, line in enumerate(lines):
+        matches = list(_LABEL_RE.finditer(line))
+        for n, match in enumerate(matches):
+            key = _KEY_BY_LABEL[match.group().lower()]
+            if key in fields or PRIOR_LABEL.search(line[:match.start()]):
+                continue
+            end = matches[n + 1].start() if n + 1 < len(matches) else len(line)
+            segment = line[match.end():end]
+            value = _clean(segment)
+            # Free-text values need "Label: value" so labels quoted in running text are not read
+            explicit = segment.lstrip().startswith(":")
+            if not value and n + 1 == len(matches) and i + 1 < len(lines):
+                following = lines[i + 1].strip()
+                if len(following) <= MAX_NEXT_LINE_VALUE and not _LABEL_RE.search(following):
+                    value, explicit = _clean(following), True
+            kind = _KIND[key]
+            if kind == "yesno":
+                value = _checked_option(value)
+            if (explicit or kind != "text") and _valid(kind, value):
+                fields[key] = _normalize_value(kind, value)
+
+    unresolved = [key for key, _, _ in APPLICATION_FIELDS if key not in fields]
+    return fields, unresolved
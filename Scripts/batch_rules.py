@@ -0,0 +1,339 @@
+import json
+import time
+import inspect
+import operator
+import logging
+import argparse
+
+import numpy as np
+import pandas as pd
+
+import results_store
+from compare_2 import RULE_SPECS, evaluate_rule
+
+logger = logging.getLogger(__name__)
+
+# Columnar re-scoring of the numeric rules over the whole book of stored submissions (e.g. after a rules
+# update). The extracted variables of every submission are loaded into one column per variable and each
+# rule is applied as boolean masks over whole columns instead of once per submission. The verdicts are
+# those of the rule functions: rows whose inputs are not plain numbers (missing, None, text) are evaluated
+# by the rule function itself, and a rule whose arguments do not bind to its function fails everywhere.
+BATCH_RULES = ["rule_3", "rule_7", "rule_8", "rule_9", "rule_10", "rule_11"]
+PASS, FAIL, WARNING = "✅", "❌", "⚠️"
+# Integers beyond this do not compare exactly once converted to float64
+MAX_EXACT_INT = 2 ** 53
+# Rule arguments holding the diagram numbers a branch applies to; constant within a rules version
+CHOICE_PREFIXES = ("diagram_choices", "diagrams_for")
+
+_SPECS = {key: (label, rule_fn, inputs) for key, label, rule_fn, inputs in RULE_SPECS}
+_equal = np.frompyfunc(operator.eq, 2, 1)
+
+
+def _numbers(column):
+    """(float64 values, mask of the rows holding a plain number) of an object column."""
+    if pd.api.types.infer_dtype(column, skipna=False) == "floating":
+        exact = np.ones(len(column), dtype=bool)
+    else:
+        exact = column.map(type).isin([float, int, bool]).to_numpy()
+    values = column.where(exact, 0.0).to_numpy(dtype=float)
+    # NaN compares like in Python; integers too large for float64 are left to the rule function
+    return values, exact & ~(np.abs(values) >= MAX_EXACT_INT)
+
+
+def _text(column, strip=True):
+    """str(value).lower().strip() of every row, as the rules compare them; once per distinct string."""
+    values = column.to_numpy(dtype=object)
+    strings = column.map(type).to_numpy() == str
+    codes, uniques = pd.factorize(values[strings])
+    normalized = [value.lower().strip() if strip else value.lower() for value in uniques]
+    text = np.empty(len(values), dtype=object)
+    text[strings] = np.array(normalized, dtype=object)[codes]
+    text[~strings] = [str(value).lower().strip() if strip else str(value).lower() for value in values[~strings]]
+    return pd.Series(text, dtype=object)
+
+
+def _member(values, choices):
+    """Mask of `value in choices` (a substring test when choices is a str), evaluated once per distinct value."""
+    if pd.api.types.infer_dtype(values, skipna=False) == "string":
+        codes, uniques = pd.factorize(values)
+        return np.array([value in choices for value in uniques], dtype=bool)[codes]
+    return values.map(lambda value: value in choices).to_numpy(dtype=bool)
+
+
+def _status(fail, warning=None):
+    status = np.full(len(fail), PASS, dtype=object)
+    if warning is not None:
+        status[warning] = WARNING
+    status[fail] = FAIL
+    return status
+
+
+def _versions(column):
+    """Codes grouping the rows by value of a rule constant (lists included); all 0 within one rules version."""
+    values = column.to_numpy(dtype=object)
+    codes = np.zeros(len(values), dtype=int)
+    if len(values):
+        first = np.empty((), dtype=object)
+        first[()] = values[0]
+        other = ~_equal(values, first).astype(bool)
+        codes[other] = 1 + pd.factorize(column[other].map(repr))[0]
+    return codes
+
+
+# ---------------------------------------------------------------------------
+# Rule kernels: the status logic of the rule functions over columns. Each gets the rule's arguments by
+# parameter name (numbers as float64 arrays, choices as constants, anything else as a Series).
+# ---------------------------------------------------------------------------
+
+def _crawlspace(a):
+    # verify_crawlSpace_details
+    listed = _member(a["diagramNumber_pdf"], a["diagrams_for_crawlspace"])
+    return _status(listed & (a["total_square_footage"] != a["enclosure_Size"]))
+
+
+def _section_c(a):
+    # verify_sectionC_measurements
+    hag, lag, lag_app = a["HAG_pdf"], a["LAG_pdf"], a["LAG_app"]
+    bottom, bottom_app = a["top_of_bottom_floor_pdf"], a["top_of_bottom_floor_app"]
+    higher, higher_app = a["top_of_next_higher_floor_pdf"], a["top_of_next_higher_floor_app"]
+    diagram = _text(a["diagramNumber_pdf"])
+    # elif chain: only the first matching choice applies its elevation logic
+    c1 = _member(diagram, a["diagram_choices_1"])
+    c2 = ~c1 & _member(diagram, [a["diagram_choices_2"]])
+    c3 = ~c1 & ~c2 & _member(diagram, a["diagram_choices_3"])
+    c4 = ~c1 & ~c2 & ~c3 & _member(diagram, a["diagram_choices_4"])
+    used = a["section_c_measurements_used"].map(bool).to_numpy(dtype=bool)
+    measurements = (
+        (bottom != bottom_app) | (higher_app != higher) | (lag_app != lag)
+        | c1 & ~((bottom < lag + 2) & (bottom >= lag))
+        | c2 & ~((lag <= bottom) & (bottom < lag + 6))
+        | c3 & ~(bottom < lag)
+        | c4 & ~((lag <= bottom) & (bottom <= lag + 20))
+        | _member(diagram, a["diagram_choices_5"]) & ~((higher != 0) & (higher > bottom))
+        | (np.abs(lag - bottom) > 20) | (np.abs(lag - higher) > 20)
+    )
+    return _status((hag < lag) | used & measurements)
+
+
+def _section_e(a):
+    # verify_sectionE_measurements
+    e1a, e1b, e2, lag, bottom_app = a["e1a"], a["e1b"], a["e2"], a["LAG_pdf"], a["top_of_bottom_floor_app"]
+    used = _text(a["Elevation_Certificate_Section_Used"]).str.contains("e", regex=False).to_numpy(dtype=bool)
+    diagram = _text(a["diagramNumber_pdf"])
+    c6 = _member(diagram, a["diagram_choices_6"])
+    c7 = ~c6 & _member(diagram, [a["diagram_choices_7"]])
+    c8 = ~c6 & ~c7 & _member(diagram, a["diagram_choices_8"])
+    c9 = ~c6 & ~c7 & ~c8 & _member(diagram, a["diagram_choices_9"])
+    measurements = (
+        (np.abs(e1b) != np.abs(bottom_app))
+        | c6 & ~((e1b < lag + 2) & (e1b >= lag))
+        | c7 & ~((e1b <= lag + 6) & (e1b >= lag))
+        | c8 & ~((e1b <= lag + 20) & (e1b >= lag))
+        | c9 & ~(e1b < lag)
+        | _member(diagram, a["diagram_choices_10"]) & ((e2 == 0) | ~(e2 > e1a))
+        | (e1a > 20) | (e1b > 20) | (e2 > 20)
+    )
+    return _status(~used | measurements)
+
+
+def _section_h(a):
+    # verify_sectionH_measurements
+    h1a, h1b, lag = a["h1a_top_of_bottom_floor"], a["h1b_top_of_next_higher_floor"], a["LAG_pdf"]
+    used = _member(_text(a["Elevation_Certificate_Section_Used"]), ["h"])
+    diagram = _text(a["diagramNumber_pdf"])
+    c11 = _member(diagram, a["diagram_choices_11"])
+    c1b = ~c11 & _member(diagram, ["1b"])
+    c12 = ~c11 & ~c1b & _member(diagram, a["diagram_choices_12"])
+    c5 = ~c11 & ~c1b & ~c12 & _member(diagram, ["5"])
+    measurements = (
+        c11 & ~((h1a <= lag + 2) & (h1a >= lag))
+        | c1b & ~((lag <= h1a) & (h1a < lag + 6))
+        | c12 & ~(lag > h1a)
+        | c5 & ~((h1a <= lag + 20) & (lag <= h1a))
+        | _member(diagram, a["diagram_choices_13"]) & ((h1b == 0) | ~(h1b > h1a) | (h1a > 20) | (h1b > 20))
+    )
+    return _status(used & measurements)
+
+
+def _machinery(a):
+    # verify_Machinery_logic
+    bfe, machinery_elevation, platform = a["bfe"], a["c2e_elevation_of_machinery"], a["e4_top_of_platform"]
+    bottom, higher, e1b, e2 = a["top_of_bottom_floor_pdf"], a["top_of_next_higher_floor_pdf"], a["e1b"], a["e2"]
+    h2_no = _member(_text(a["h2"]), ["no"])
+    diagram = _text(a["diagramNumber_pdf"])
+    c14 = _member(diagram, a["diagram_choices_14"])
+    # This branch matches the diagram number without stripping it
+    c15 = ~c14 & _member(_text(a["diagramNumber_pdf"], strip=False), a["diagram_choices_15"])
+    c5 = ~c14 & ~c15 & _member(diagram, ["5"])
+    fail = _member(_text(a["machinery"]), ["yes"]) & (
+        c14 & (
+            np.where(higher != 0, ~(machinery_elevation >= higher), ~(machinery_elevation >= bottom + 8))
+            | ~(platform >= e1b + 8) | h2_no
+        )
+        | c15 & (~(machinery_elevation >= higher) | ~(platform >= e2))
+        | c5 & (~(machinery_elevation >= bottom) | ~(platform >= e1b) | h2_no)
+    )
+    # Otherwise the status is the one left by the BFE check
+    return _status(fail, warning=~(machinery_elevation >= bfe))
+
+
+def _vents(a):
+    # verify_vents_details
+    listed = _member(_text(a["diagramNumber_pdf"]), a["diagram_choices_10"])
+    return _status(listed & (
+        (a["total_number_of_openings"] != a["number_of_flood_openings_app"])
+        | (a["total_area_of_openings"] != a["area_of_flood_openings_app"])
+    ))
+
+
+# Result key -> (kernel, parameters of the rule function that must hold plain numbers)
+KERNELS = {
+    "rule_3": (_crawlspace, ["total_square_footage", "enclosure_Size", "crawlspace_square_footage", "garage_square_footage"]),
+    "rule_7": (_section_c, ["HAG_pdf", "LAG_pdf", "top_of_bottom_floor_pdf", "top_of_bottom_floor_app", "top_of_next_higher_floor_app", "top_of_next_higher_floor_pdf", "LAG_app"]),
+    "rule_8": (_section_e, ["e1b", "top_of_bottom_floor_app", "LAG_pdf", "e2", "e1a"]),
+    "rule_9": (_section_h, ["h1a_top_of_bottom_floor", "LAG_pdf", "h1b_top_of_next_higher_floor"]),
+    "rule_10": (_machinery, ["bfe", "top_of_next_higher_floor_pdf", "c2e_elevation_of_machinery", "top_of_bottom_floor_pdf", "e4_top_of_platform", "e1b", "e2"]),
+    "rule_11": (_vents, ["total_number_of_openings", "number_of_flood_openings_app", "total_area_of_openings", "area_of_flood_openings_app"]),
+}
+
+
+def _columns(variables, names):
+    """One object column per variable name, plus the mask of the submissions that have it."""
+    frame = pd.DataFrame(variables, columns=names, index=range(len(variables)), dtype=object)
+    present = {name: np.ones(len(variables), dtype=bool) for name in names}
+    wanted = set(names)
+    complete = np.array([v.keys() >= wanted for v in variables], dtype=bool)
+    for i in np.flatnonzero(~complete):
+        for name in wanted - variables[i].keys():
+            present[name][i] = False
+    return frame, present
+
+
+def rescore_rule(key, frame, present, variables, cache=None):
+    """
+    Statuses of one rule for every submission; cache keeps column conversions shared between rules.
+
+    Returns:
+        tuple: (array of status glyphs, number of submissions evaluated by the rule function itself)
+    """
+    label, rule_fn, inputs = _SPECS[key]
+    kernel, numeric = KERNELS[key]
+    cache = {} if cache is None else cache
+    status = np.empty(len(frame), dtype=object)
+    done = np.zeros(len(frame), dtype=bool)
+    signature = inspect.signature(rule_fn)
+    try:
+        signature.bind(*inputs)
+    except TypeError:
+        # Arguments that do not bind to the function make every call raise, reported as failed
+        return np.full(len(frame), FAIL, dtype=object), 0
+    params = list(signature.parameters)
+    if len(params) == len(inputs):
+        args = {param: frame[name] for param, name in zip(params, inputs)}
+        vectorized = np.logical_and.reduce([present[name] for name in inputs])
+        names = dict(zip(params, inputs))
+        for param in numeric:
+            if ("numbers", names[param]) not in cache:
+                cache["numbers", names[param]] = _numbers(args[param])
+            args[param], exact = cache["numbers", names[param]]
+            vectorized &= exact
+        choices = [param for param in params if param.startswith(CHOICE_PREFIXES)]
+        # Submissions scored under different rules versions may carry different choices
+        for param in choices:
+            if ("versions", names[param]) not in cache:
+                cache["versions", names[param]] = _versions(args[param])
+        versions = np.zeros(len(frame), dtype=np.int64)
+        for param in choices:
+            codes = cache["versions", names[param]]
+            versions = pd.factorize(versions * (codes.max() + 1 if len(codes) else 1) + codes)[0].astype(np.int64)
+        rows = np.flatnonzero(vectorized)
+        codes = pd.factorize(versions[rows])[0]
+        for version in range(codes.max() + 1 if len(codes) else 0):
+            group = rows[codes == version]
+            group_args = {
+                param: value[group] if isinstance(value, np.ndarray) else value.iloc[group].reset_index(drop=True)
+                for param, value in args.items()
+            }
+            for param in choices:
+                group_args[param] = args[param].iloc[group[0]]
+            try:
+                status[group] = kernel(group_args)
+                done[group] = True
+            except TypeError as e:
+                # Choices of an unexpected type; the rule function decides what they mean
+                logger.info(f"{key}: {len(group)} submissions left to the rule function ({e})")
+
+    scalar_rows = np.flatnonzero(~done)
+    for i in scalar_rows:
+        status[i] = evaluate_rule(label, rule_fn, inputs, variables[i])["status"]
+    return status, len(scalar_rows)
+
+
+def rescore(book, rules=None):
+    """
+    Statuses of the batch rules for every submission of the book (see results_store.load_book).
+
+    Returns:
+        tuple: (DataFrame of status glyphs indexed by job_id with a column per rule,
+                {rule key: number of submissions evaluated by the rule function itself})
+    """
+    rules = rules or BATCH_RULES
+    variables = [entry["variables"] for entry in book]
+    names = sorted({name for key in rules for name in _SPECS[key][2]})
+    frame, present = _columns(variables, names)
+    statuses = pd.DataFrame(index=pd.Index([entry["job_id"] for entry in book], name="job_id"))
+    scalar_rows, cache = {}, {}
+    for key in rules:
+        statuses[key], scalar_rows[key] = rescore_rule(key, frame, present, variables, cache)
+    return statuses, scalar_rows
+
+
+def verify_parity(book, statuses, rules=None):
+    """Rows where the batch statuses differ from those of the rule functions, one submission at a time."""
+    mismatches = []
+    for key in rules or BATCH_RULES:
+        label, rule_fn, inputs = _SPECS[key]
+        for entry, batch_status in zip(book, statuses[key]):
+            scalar_status = evaluate_rule(label, rule_fn, inputs, entry["variables"])["status"]
+            if scalar_status != batch_status:
+                mismatches.append({"job_id": entry["job_id"], "rule": key, "batch": batch_status, "scalar": scalar_status})
+    return mismatches
+
+
+def rescore_book(since=None, until=None, rules=None, db_path=None, verify=False):
+    """Re-score the stored submissions evaluated in the date range; returns (report, statuses)."""
+    rules = rules or BATCH_RULES
+    book = results_store.load_book(since, until, db_path)
+    start = time.perf_counter()
+    statuses, scalar_rows = rescore(book, rules)
+    report = {"submissions": len(book), "seconds": round(time.perf_counter() - start, 3), "rules": {}}
+    for key in rules:
+        stored = pd.Series([entry["statuses"].get(key) for entry in book], index=statuses.index, dtype=object)
+        report["rules"][key] = {
+            **{results_store.status_name(glyph): int((statuses[key] == glyph).sum()) for glyph in (PASS, FAIL, WARNING)},
+            # Verdicts that differ from the stored evaluation
+            "changed": int((stored.notna() & (statuses[key] != stored)).sum()),
+            "scalar_rows": scalar_rows[key],
+        }
+    logger.info(f"Re-scored {len(book)} submissions in {report['seconds']}s")
+    if verify:
+        start = time.perf_counter()
+        report["mismatches"] = verify_parity(book, statuses, rules)
+        report["scalar_seconds"] = round(time.perf_counter() - start, 3)
+    return report, statuses
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Re-score the stored submissions with the numeric rules, column-wise.")
+    parser.add_argument("--since", help="Evaluated on or after (ISO date)")
+    parser.add_argument("--until", help="Evaluated on or before (ISO date)")
+    parser.add_argument("--rules", nargs="*", default=BATCH_RULES, choices=BATCH_RULES)
+    parser.add_argument("--db", default=results_store.RESULTS_DB, help="Results database")
+    parser.add_argument("--verify", action="store_true", help="Also run the rule functions and report any difference")
+    parser.add_argument("--output", help="CSV file for the per-submission statuses")
+    args = parser.parse_args()
+
+    report, statuses = rescore_book(args.since, args.until, args.rules, args.db, args.verify)
+    if args.output:
+        statuses.replace({PASS: "pass", FAIL: "fail", WARNING: "warning"}).to_csv(args.output)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,125 @@
+import os
+import json
+import time
+import resource
+import argparse
+import tempfile
+import statistics
+from concurrent.futures import ThreadPoolExecutor
+
+import llm_calls
+from llm_calls import measure_usage
+
+# End-to-end benchmark of the upload -> extract -> compare flow on recorded model responses.
+# Record once against the live API (--mode record), then replay (--mode replay) as often as needed:
+# with the recorded latency the runs are reproducible, with --latency 0 only our own overhead is left.
+
+
+def _peak_rss_mb():
+    # ru_maxrss is in KiB on Linux
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)
+
+
+def run_flow(ec_path, application_path, photo_paths, output_dir):
+    """One submission: EC and application extraction, then every comparison rule. Returns per-stage usage."""
+    # Imported here so the cassette settings are in place before the pipeline modules load
+    from OCR_EC import process_EC, load_EC_meta
+    from OCR_Application import process_application
+    import compare_2
+
+    stages = {}
+    data_pdf = data_app = ec_meta = None
+    if ec_path:
+        with measure_usage() as stages["ec"]:
+            ec_json = process_EC(ec_path, output_dir=output_dir)
+        with open(ec_json, encoding="utf-8") as f:
+            data_pdf = json.load(f)
+        ec_meta = load_EC_meta(ec_json)
+    if application_path:
+        with measure_usage() as stages["application"]:
+            data_app = process_application(application_path, output_dir=output_dir)["data"]
+    with measure_usage() as stages["compare"]:
+        results = compare_2.run_all_comparisons(data_pdf, data_app, photo_paths or None, ec_meta)
+    if "error" in results:
+        raise RuntimeError(results["error"])
+    return stages
+
+
+def _percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(round(share * (len(values) - 1))))]
+
+
+def _stage_report(runs, stage):
+    usages = [run[stage] for run in runs if stage in run]
+    if not usages:
+        return None
+    wall = [u["seconds"] for u in usages]
+    # Time not spent waiting on the model: rendering, OCR, parsing, rules
+    overhead = [max(0.0, u["seconds"] - u["model_seconds"]) for u in usages]
+    return {
+        "runs": len(usages),
+        "model_calls": statistics.mean(u["calls"] for u in usages),
+        "wall_p50_s": round(_percentile(wall, 0.5), 3),
+        "wall_p95_s": round(_percentile(wall, 0.95), 3),
+        "overhead_p50_s": round(_percentile(overhead, 0.5), 3),
+        "overhead_p95_s": round(_percentile(overhead, 0.95), 3),
+    }
+
+
+def benchmark(ec_path, application_path, photo_paths, iterations=5, concurrency=1, warmup=1):
+    """Run the flow iterations times, concurrency at a time, after warmup unmeasured runs."""
+    with tempfile.TemporaryDirectory() as tmp:
+        for i in range(warmup):
+            run_flow(ec_path, application_path, photo_paths, os.path.join(tmp, f"warmup_{i}"))
+
+        rss_before = _peak_rss_mb()
+        errors = []
+
+        def one(i):
+            try:
+                return run_flow(ec_path, application_path, photo_paths, os.path.join(tmp, f"run_{i}"))
+            except Exception as e:
+                errors.append(f"{type(e).__name__}: {e}")
+                return None
+
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            runs = [run for run in executor.map(one, range(iterations)) if run]
+        elapsed = time.perf_counter() - start
+
+    return {
+        "mode": llm_calls.CASSETTE_MODE,
+        "replay_latency": llm_calls.REPLAY_LATENCY,
+        "iterations": iterations,
+        "concurrency": concurrency,
+        "elapsed_s": round(elapsed, 3),
+        "throughput_per_min": round(60 * len(runs) / elapsed, 2) if elapsed else None,
+        "errors": errors,
+        "stages": {stage: _stage_report(runs, stage) for stage in ("ec", "application", "compare")},
+        "peak_rss_mb": {"before": rss_before, "after": _peak_rss_mb()},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark the EC / application / photo flow on recorded model responses.")
+    parser.add_argument("--ec", help="EC PDF")
+    parser.add_argument("--application", help="Application PDF")
+    parser.add_argument("--photos", nargs="*", default=[], help="Building photos")
+    parser.add_argument("--mode", choices=["record", "replay", "off"], default="replay")
+    parser.add_argument("--cassettes", default=llm_calls.CASSETTE_DIR, help="Cassette directory")
+    parser.add_argument("--latency", default=llm_calls.REPLAY_LATENCY, help='"original" or a synthetic latency in seconds')
+    parser.add_argument("--iterations", type=int, default=5)
+    parser.add_argument("--concurrency", type=int, default=1)
+    parser.add_argument("--warmup", type=int, default=1)
+    args = parser.parse_args()
+
+    llm_calls.CASSETTE_MODE = args.mode
+    llm_calls.CASSETTE_DIR = args.cassettes
+    llm_calls.REPLAY_LATENCY = args.latency
+    if args.mode == "record":
+        # One pass records every request; repeating it would only re-record the same pairs
+        args.iterations, args.warmup = 1, 0
+
+    report = benchmark(args.ec, args.application, args.photos, args.iterations, args.concurrency, args.warmup)
+    print(json.dumps(report, indent=2))
@@ -0,0 +1,187 @@
+import os
+import time
+import hashlib
+import logging
+import tempfile
+import threading
+import storage
+
+logger = logging.getLogger(__name__)
+
+# Content-addressed store for uploads. Files are hashed (SHA-256) while they stream to disk and stored
+# once per content as blobs/<aa>/<digest><ext>; resubmissions of the same file reuse the blob.
+# Jobs reference the blobs they use (blobs/refs/<digest>/<job_id>); a blob that loses its last reference
+# gets a blobs/released/<digest> marker holding the time, and is deleted once it has been unreferenced for
+# BLOB_TTL_SECONDS. The digest is also the key of the extraction outputs derived from a blob
+# (blobs/derived/<digest>/<kind>/), which live and die with the blob.
+# Blobs, references and markers are all kept in the storage backend, so any node can collect a shared bucket.
+BLOB_DIR = os.getenv("BLOB_DIR", "blobs")
+BLOB_TTL_SECONDS = int(os.getenv("BLOB_TTL_SECONDS", str(24 * 3600)))
+CHUNK_SIZE = 1024 * 1024
+
+_locks = {}
+_locks_guard = threading.Lock()
+# Held while a blob is referenced and looked up, and while the collector deletes one, so an upload that
+# hits an existing blob cannot lose it between the lookup and its reference. Across nodes the reference
+# is written before the lookup; a collector on another node deleting the same blob in that instant is
+# the remaining (TTL-wide unlikely) window.
+_gc_lock = threading.Lock()
+
+
+def _refs_dir(digest=None):
+    return os.path.join(BLOB_DIR, "refs", digest) if digest else os.path.join(BLOB_DIR, "refs")
+
+
+def _released_path(digest):
+    return os.path.join(BLOB_DIR, "released", digest)
+
+
+def blob_path(digest, ext=""):
+    return os.path.join(BLOB_DIR, digest[:2], digest + ext)
+
+
+def derived_dir(digest, kind):
+    """Directory for outputs derived from a blob (e.g. kind "ec" for the EC extraction)."""
+    return os.path.join(BLOB_DIR, "derived", digest, kind)
+
+
+def derive_lock(digest, kind):
+    """Lock held while deriving kind from a blob, so concurrent jobs with the same file extract it once."""
+    with _locks_guard:
+        return _locks.setdefault((digest, kind), threading.Lock())
+
+
+def put_stream(stream, ext="", job_id=None):
+    """
+    Copy a readable binary stream into the store, hashing it on the way. With job_id the blob is
+    referenced from that job in the same step.
+
+    Returns:
+        tuple: (digest, path, deduplicated) - deduplicated is True when the content was already stored.
+    """
+    tmp_dir = os.path.join(BLOB_DIR, "tmp")
+    os.makedirs(tmp_dir, exist_ok=True)
+    sha = hashlib.sha256()
+    fd, tmp_path = tempfile.mkstemp(dir=tmp_dir)
+    try:
+        with os.fdopen(fd, "wb") as f:
+            while True:
+                chunk = stream.read(CHUNK_SIZE)
+                if not chunk:
+                    break
+                sha.update(chunk)
+                f.write(chunk)
+        digest = sha.hexdigest()
+        path = blob_path(digest, ext.lower())
+        with _gc_lock:
+            if job_id:
+                add_ref(digest, job_id)
+            local = os.path.exists(path)
+            deduplicated = local or storage.stored(path)
+            if local:
+                os.remove(tmp_path)
+            else:
+                # Stored by another node: the upload is its working copy
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                os.replace(tmp_path, path)
+        if not deduplicated:
+            storage.sync_up(path, skip_existing=True)
+        return digest, path, deduplicated
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+def add_ref(digest, job_id):
+    path = os.path.join(_refs_dir(digest), job_id)
+    os.makedirs(_refs_dir(digest), exist_ok=True)
+    open(path, "w").close()
+    storage.sync_up(path)
+    storage.remove(_released_path(digest))
+
+
+def remove_ref(digest, job_id):
+    storage.remove(os.path.join(_refs_dir(digest), job_id))
+    _mark_if_unreferenced(digest)
+
+
+def _refs(digest):
+    return [os.path.basename(path) for path in storage.list_paths(_refs_dir(digest), working_copy=False)]
+
+
+def _released_at(digest):
+    path = _released_path(digest)
+    if not storage.stored(path):
+        return None
+    try:
+        storage.refresh(path)
+        with open(path, encoding="utf-8") as f:
+            return float(f.read().strip())
+    except (FileNotFoundError, ValueError):
+        return None
+
+
+def _mark_if_unreferenced(digest):
+    # The TTL of an unreferenced blob runs from the moment it lost its last reference
+    if not _refs(digest):
+        path = _released_path(digest)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(str(time.time()))
+        storage.sync_up(path)
+
+
+def _blob_paths():
+    """digest -> blob file paths, from the backend and the working copy."""
+    blobs = {}
+    for path in storage.list_paths(BLOB_DIR):
+        folder, name = os.path.split(os.path.relpath(path, os.path.relpath(BLOB_DIR)))
+        if len(folder) == 2 and os.sep not in folder:
+            blobs.setdefault(name.split(".")[0], []).append(path)
+    return blobs
+
+
+def collect_garbage(job_is_live=None, ttl=None):
+    """
+    Drop references of jobs that no longer exist (job_is_live(job_id) is False), then delete blobs,
+    and their derived outputs, that have been unreferenced for longer than ttl seconds.
+
+    Returns:
+        dict: {"dangling_refs", "blobs_deleted", "bytes_freed"} - bytes_freed counts working-copy files
+    """
+    ttl = BLOB_TTL_SECONDS if ttl is None else ttl
+    stats = {"dangling_refs": 0, "blobs_deleted": 0, "bytes_freed": 0}
+    if job_is_live:
+        for path in storage.list_paths(_refs_dir(), working_copy=False):
+            digest, job_id = os.path.split(os.path.relpath(path, os.path.relpath(_refs_dir())))
+            if not job_is_live(job_id):
+                remove_ref(digest, job_id)
+                stats["dangling_refs"] += 1
+
+    cutoff = time.time() - ttl
+    for digest, paths in _blob_paths().items():
+        with _gc_lock:
+            if _refs(digest):
+                continue
+            released = _released_at(digest)
+            if released is None:
+                # Stored before references were kept, or its upload failed before referencing it
+                _mark_if_unreferenced(digest)
+                released = time.time()
+            if released > cutoff:
+                continue
+            for path in paths:
+                if os.path.exists(path):
+                    stats["bytes_freed"] += os.path.getsize(path)
+                storage.remove(path)
+            storage.remove_tree(os.path.join(BLOB_DIR, "derived", digest))
+            storage.remove_tree(_refs_dir(digest))
+            storage.remove(_released_path(digest))
+            with _locks_guard:
+                for key in [key for key in _locks if key[0] == digest]:
+                    del _locks[key]
+            stats["blobs_deleted"] += 1
+    if stats["blobs_deleted"] or stats["dangling_refs"]:
+        logger.info(f"Blob GC: {stats}")
+    return stats
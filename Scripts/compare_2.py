@@ -1,12 +1,24 @@
 import json
 import re
+import hashlib
 from rapidfuzz import fuzz
 import usaddress
 import openai
-import base64
 from typing import List
 import os
+import threading
+import contextvars
 from datetime import date, datetime
+from ec_meta import load_EC_meta
+from workspace import load_job_inputs, upload_names as job_upload_names
+from refine_EC import refine_critical_fields
+from photo_prep import prepare_photos, low_detail_url, upload_names
+from photo_select import select_photos
+from photo_quality import usable_photos
+import speculative
+import shadow
+from model_router import route, valid_true_false, models_for
+from llm_calls import chat_completion, measure_usage
 
 
 def normalize_string(value):
@@ -181,6 +193,13 @@ def extract_float_value(value):
     return float(match.group()) if match else 0.0
 
 
+def has_number(value):
+    """False for the blank values extract_float_value reads as 0.0."""
+    if isinstance(value, (int, float)):
+        return not isinstance(value, bool)
+    return value is not None and re.search(r"-?\d+(\.\d+)?", str(value)) is not None
+
+
 
 def normalize_street_name(street_name, STREET_ABBREVIATIONS):
     words = street_name.split()
@@ -252,35 +271,37 @@ def get_value_by_normalized_key(data, target_keys):
     return 0.0
 
 
-def analyze_image( 
-    image_path: List[str], 
-    question: List[str], 
-    model: str = "gpt-4o"
-) -> str: 
-    """
-    Analyzes multiple images and answers questions about them using OpenAI's vision-capable model.
-    
-    :param image_paths: List of image file paths.
-    :param questions: List of textual questions to ask.
-    :param model: The vision-capable model to use.
-    :return: String with concise answers.
-    """
+# "tiered": ask at low detail first and escalate to high detail when needed; "high" / "low": single pass
+IMAGE_DETAIL_MODE = os.getenv("IMAGE_DETAIL_MODE", "tiered").lower()
+# rule -> {"calls", "escalated", "high_only"}. Each run_all_comparisons counts its own calls in a context
+# variable (concurrent jobs, speculative threads and shadow runs do not mix) and reports them in its summary;
+# every call is also added to the process-wide totals reported by /model_stats.
+_run_detail_stats = contextvars.ContextVar("detail_stats", default=None)
+_detail_totals = {}
+_detail_lock = threading.Lock()
+
+
+def _count_detail(rule, outcome="calls"):
+    with _detail_lock:
+        for stats in (_run_detail_stats.get(), _detail_totals):
+            if stats is not None:
+                stats.setdefault(rule, {"calls": 0, "escalated": 0, "high_only": 0})[outcome] += 1
+
+
+def _ask_vision_model(question_block, image_urls, detail, model):
     encoded_images = []
-    for path in image_path:
-        with open(path, "rb") as img_file:
-            image_base64 = base64.b64encode(img_file.read()).decode("utf-8")
-            encoded_images.append({
-                "type": "image_url",
-                "image_url": {
-                    "url": f"data:image/jpeg;base64,{image_base64}",
-                    "detail": "high" 
-                }
-            })
+    for url in image_urls:
+        encoded_images.append({
+            "type": "image_url",
+            "image_url": {
+                "url": url,
+                "detail": detail 
+            }
+        })
 
-    question_block = "\n".join(f"Q{i+1}: {q}" for i, q in enumerate(question))
     openai.api_key = os.getenv("OPENAI_API_KEY") 
     user_message = [{"type": "text", "text": question_block}] + encoded_images
-    response = openai.chat.completions.create(
+    response = chat_completion(
         model=model,
         messages=[ 
             { 
@@ -301,10 +322,103 @@ def analyze_image(
     return response.choices[0].message.content.strip()
 
 
-def run_all_comparisons(data_pdf=None, data_app=None, image_paths=None):
-    """Run all comparison rules and return consolidated results."""
+def analyze_image( 
+    image_path: List[str], 
+    question: List[str], 
+    model: str = None,
+    needs_detail: bool = False,
+    rule: str = "unlabelled"
+) -> str: 
+    """
+    Analyzes multiple images and answers questions about them using OpenAI's vision-capable model.
+    
+    :param image_paths: List of image file paths.
+    :param questions: List of textual questions to ask.
+    :param model: The vision-capable model to use; None routes cheap-first through model_router.
+    :param needs_detail: Question needs fine detail (counting floors, foundation type); skips the low-detail pass.
+    :param rule: Rule label the escalation statistics are recorded under.
+    :return: String with concise answers.
+    """
+    # Decoded, downscaled and JPEG-encoded once per photo; later rules reuse the cached payloads.
+    # Photos rejected by the quality gate and near-duplicates are dropped, and only the
+    # top PHOTO_TOP_K photos for these questions are sent.
+    photos = usable_photos(prepare_photos(image_path))
+    if not photos:
+        raise ValueError("No usable photos: every photo was rejected by the quality gate.")
+    photos = select_photos(photos, question)
+    question_block = "\n".join(f"Q{i+1}: {q}" for i, q in enumerate(question))
+
+    def urls_for(detail):
+        return [low_detail_url(p) if detail == "low" else p["url"] for p in photos]
+
+    # One escalation ladder of (model, detail) steps: in tiered mode the cheap model at low detail, then the
+    # strongest model at high detail; otherwise the cascade's models at the fixed detail
+    models = [model] if model else models_for("image_question")
+    if IMAGE_DETAIL_MODE == "tiered" and not needs_detail:
+        steps = [(models[0], "low"), (models[-1], "high")]
+    else:
+        detail = "low" if IMAGE_DETAIL_MODE == "low" else "high"
+        steps = [(m, detail) for m in models]
+    # The next step is taken when the reply is not the expected True/False (or, for detail questions such
+    # as floor counts and foundation types, is empty)
+    valid = (lambda a: bool(a.strip())) if needs_detail else (lambda a: valid_true_false(a, len(question)))
+    asked = []
+
+    def ask(m, detail):
+        asked.append(detail)
+        return _ask_vision_model(question_block, urls_for(detail), detail, m)
+
+    _count_detail(rule)
+    if steps[0][1] == "high":
+        _count_detail(rule, "high_only")
+    with measure_usage() as usage:
+        answer = route("image_question", ask, valid, steps)
+    if asked[0] == "low" and asked[-1] == "high":
+        _count_detail(rule, "escalated")
+
+    # A sample of the questions is asked again, in the background, with the shadow candidate configuration
+    if shadow.sampled():
+        shadow.shadow_image_question(
+            lambda m, d: _ask_vision_model(question_block, urls_for(d), d, m), answer, usage, rule
+        )
+    return answer
+
+
+def detail_escalation_summary(detail_stats=None):
+    """Per-rule share of low-detail answers that had to be re-asked at high detail; process-wide by default."""
+    if detail_stats is None:
+        with _detail_lock:
+            detail_stats = {rule: dict(stats) for rule, stats in _detail_totals.items()}
+    summary = {}
+    for rule, stats in detail_stats.items():
+        tiered = stats["calls"] - stats["high_only"]
+        summary[rule] = dict(stats, escalation_rate=round(stats["escalated"] / tiered, 2) if tiered else None)
+    return summary
+
+
+def run_all_comparisons(data_pdf=None, data_app=None, image_paths=None, ec_meta=None, job_id=None, previous=None, refine=True):
+    """
+    Run all comparison rules and return consolidated results.
+    previous: earlier results of the same submission; rules whose inputs did not change are reused from it.
+    refine: re-read missing or implausible critical EC fields (model calls); off for shadow runs.
+    """
     
+    # Inputs not provided are read from the job's workspace
+    if job_id is not None:
+        job_pdf, job_app, job_photos, job_meta = load_job_inputs(job_id)
+        if data_pdf is None:
+            data_pdf, ec_meta = job_pdf, job_meta if ec_meta is None else ec_meta
+        data_app = job_app if data_app is None else data_app
+        image_paths = (job_photos or []) if image_paths is None else image_paths
+        if data_pdf is None:
+            return {"error": "No EC uploaded for this job"}
+        if data_app is None:
+            return {"error": "No application uploaded for this job"}
+
     # Load data if not provided
+    if data_pdf is None and ec_meta is None:
+        ec_meta = load_EC_meta(r"JSONs\EC.json")
+
     if data_pdf is None:
         try:
             with open(r"JSONs\EC.json") as f: 
@@ -330,294 +444,62 @@ def run_all_comparisons(data_pdf=None, data_app=None, image_paths=None):
         extracted_vars = extract_essential_variables(data_pdf, data_app)
     except Exception as e:
         return {"error": f"Failed to extract variables: {str(e)}"}
-    
-    # Initialize results dictionary
-    results = {}
-    
-    # Rule 1: Address verification
-    try:
-        results["rule_1"] = verify_address(
-            extracted_vars["address_pdf"],
-            extracted_vars["address_app"],
-            extracted_vars["street_name_pdf"],
-            extracted_vars["street_number_app"]
-        )
-    except Exception as e:
-        results["rule_1"] = {"rule": "Rule 1 - Address Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 2: Diagram number verification
-    try:
-        results["rule_2"] = verify_diagram_number(
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagram_number_app"],
-            extracted_vars["top_of_bottom_floor_app"],
-            extracted_vars["top_of_next_higher_floor_app"],
-            extracted_vars["Section_C_LAG_app"]
-        )
-    except Exception as e:
-        results["rule_2"] = {"rule": "Rule 2 - Diagram Number Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 3: Crawlspace details
-    try:
-        results["rule_3"] = verify_crawlSpace_details(
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagrams_for_crawlspace"],
-            extracted_vars["total_square_footage"],
-            extracted_vars["enclosure_Size"],
-            extracted_vars["crawlspace_square_footage"],
-            extracted_vars["garage_square_footage"]
-        )
-    except Exception as e:
-        results["rule_3"] = {"rule": "Rule 3 - Crawlspace Details Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 4: CBRS/OPA details
-    try:
-        results["rule_4"] = verify_CBRS_OPA_details(
-            extracted_vars["CBRS_OPA_app"],
-            extracted_vars["CBRS"],
-            extracted_vars["OPA"]
-        )
-    except Exception as e:
-        results["rule_4"] = {"rule": "Rule 4 - CBRS/OPA Details Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 5: Construction status
-    try:
-        results["rule_5"] = verify_construction_status(
-            extracted_vars["Construction_status_pdf"],
-            extracted_vars["Construction_status_app"]
-        )
-    except Exception as e:
-        results["rule_5"] = {"rule": "Rule 5 - Construction Status Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 6: Certifier verification
-    try:
-        results["rule_6"] = verify_certifier(
-            extracted_vars["Elevation_Certificate_Section_Used"],
-            extracted_vars["section_c_measurements_used"],
-            extracted_vars["certifier_name_pdf"],
-            extracted_vars["certifier_license_number"]
-        )
-    except Exception as e:
-        results["rule_6"] = {"rule": "Rule 6 - Certifier Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 7: Section C measurements
-    try:
-        results["rule_7"] = verify_sectionC_measurements(
-            extracted_vars["HAG_pdf"],
-            extracted_vars["LAG_pdf"],
-            extracted_vars["section_c_measurements_used"],
-            extracted_vars["top_of_bottom_floor_pdf"],
-            extracted_vars["top_of_bottom_floor_app"],
-            extracted_vars["top_of_next_higher_floor_app"],
-            extracted_vars["top_of_next_higher_floor_pdf"],
-            extracted_vars["LAG_app"],
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagram_choices_1"],
-            extracted_vars["diagram_choices_2"],
-            extracted_vars["diagram_choices_3"],
-            extracted_vars["diagram_choices_4"],
-            extracted_vars["diagram_choices_5"]
-        )
-    except Exception as e:
-        results["rule_7"] = {"rule": "Rule 7 - Section C Measurements Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 8: Section E measurements
-    try:
-        results["rule_8"] = verify_sectionE_measurements(
-            extracted_vars["Elevation_Certificate_Section_Used"],
-            extracted_vars["section_e_measurements_used"],
-            extracted_vars["e1b"],
-            extracted_vars["top_of_bottom_floor_app"],
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagram_choices_6"],
-            extracted_vars["LAG_pdf"],
-            extracted_vars["diagram_choices_7"],
-            extracted_vars["diagram_choices_8"],
-            extracted_vars["diagram_choices_9"],
-            extracted_vars["diagram_choices_10"],
-            extracted_vars["e2"],
-            extracted_vars["e1a"]
-        )
-    except Exception as e:
-        results["rule_8"] = {"rule": "Rule 8 - Section E Measurements Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 9: Section H measurements
-    try:
-        results["rule_9"] = verify_sectionH_measurements(
-            extracted_vars["Elevation_Certificate_Section_Used"],
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagram_choices_11"],
-            extracted_vars["h1a_top_of_bottom_floor"],
-            extracted_vars["LAG_pdf"],
-            extracted_vars["diagram_choices_12"],
-            extracted_vars["diagram_choices_13"],
-            extracted_vars["h1b_top_of_next_higher_floor"]
-        )
-    except Exception as e:
-        results["rule_9"] = {"rule": "Rule 9 - Section H Measurements Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 10: Machinery logic 
-    try:
-        results["rule_10"] = verify_Machinery_logic(
-            extracted_vars["machinery"],
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagram_choices_14"],
-            extracted_vars["top_of_next_higher_floor_pdf"],
-            extracted_vars["c2e_elevation_of_mahinery"],
-            extracted_vars["top_of_bottom_floor_pdf"],
-            extracted_vars["e4_top_of_platform"],
-            extracted_vars["e1b"],
-            extracted_vars["h2"],
-            extracted_vars["diagram_choices_15"],
-            extracted_vars["e2"]
-        )
-    except Exception as e:
-        results["rule_10"] = {"rule": "Rule 10 - Machinery Logic Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rule 11: Vents details
-    try:
-        results["rule_11"] = verify_vents_details(
-            extracted_vars["diagramNumber_pdf"],
-            extracted_vars["diagram_choices_10"],
-            extracted_vars["total_number_of_openings"],
-            extracted_vars["number_of_flood_openings_app"],
-            extracted_vars["total_area_of_openings"],
-            extracted_vars["area_of_flood_openings_app"]
-        )
-    except Exception as e:
-        results["rule_11"] = {"rule": "Rule 11 - Vents Details Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    # Rules 12-24: Photograph-based rules (only if images are available)
-    if image_paths and all(os.path.exists(path) for path in image_paths):
-        # Rule 12: Photograph requirement
-        try:
-            results["rule_12"] = verify_photograph_requirement(
-                extracted_vars["Construction_status_app"]
-            )
-        except Exception as e:
-            results["rule_12"] = {"rule": "Rule 12 - Photograph Requirement", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 13: Building eligibility
-        try:
-            results["rule_13"] = verify_building_eligibility(image_paths)
-        except Exception as e:
-            results["rule_13"] = {"rule": "Rule 13 - Building Eligibility", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 14: Occupancy verification
-        try:
-            results["rule_14"] = verify_occupancy(
-                extracted_vars["occupancy_type_app"],
-                extracted_vars["occupancy_type_ec"],
-                image_paths
-            )
-        except Exception as e:
-            results["rule_14"] = {"rule": "Rule 14 - Occupancy Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 15: Under water verification
-        try:
-            results["rule_15"] = verify_underWater(image_paths)
-        except Exception as e:
-            results["rule_15"] = {"rule": "Rule 15 - Under Water Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 16: Foundation eligibility
-        try:
-            results["rule_16"] = verify_foundation_eligibility(image_paths)
-        except Exception as e:
-            results["rule_16"] = {"rule": "Rule 16 - Foundation Eligibility", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 17: Foundation type verification
-        try:
-            results["rule_17"] = verify_foundation_type(
-                extracted_vars["diagram_number_app"],
-                image_paths
-            )
-        except Exception as e:
-            results["rule_17"] = {"rule": "Rule 17 - Foundation Type Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 18: Number of floors verification
-        try:
-            results["rule_18"] = verify_number_of_floors(
-                image_paths,
-                extracted_vars["number_of_floors_app"]
-            )
-        except Exception as e:
-            results["rule_18"] = {"rule": "Rule 18 - Number of Floors Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 19: Dormers verification
-        try:
-            results["rule_19"] = verify_dormers(image_paths)
-        except Exception as e:
-            results["rule_19"] = {"rule": "Rule 19 - Dormers Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 20: Construction type verification
-        try:
-            results["rule_20"] = verify_construction_type(
-                extracted_vars["construction_type_app"],
-                image_paths
-            )
-        except Exception as e:
-            results["rule_20"] = {"rule": "Rule 20 - Construction Type Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 21: Additions verification
-        try:
-            results["rule_21"] = verify_additions(image_paths)
-        except Exception as e:
-            results["rule_21"] = {"rule": "Rule 21 - Additions Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 22: Diagram 5 verification
-        try:
-            results["rule_22"] = verify_diagram5(image_paths)
-        except Exception as e:
-            results["rule_22"] = {"rule": "Rule 22 - Diagram 5 Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 23: Diagram 6 verification
-        try:
-            results["rule_23"] = verify_diagram6(
-                extracted_vars["diagram_number_app"],
-                image_paths
-            )
-        except Exception as e:
-            results["rule_23"] = {"rule": "Rule 23 - Diagram 6 Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-        
-        # Rule 24: Machinery verification
+
+    # Re-read missing or implausible critical EC fields from their cropped form region; for an EC
+    # unchanged since the previous evaluation the values read then are applied again
+    refined_fields = []
+    ec_fingerprint = _fingerprint(data_pdf)
+    if previous and previous.get("fingerprints", {}).get("ec") == ec_fingerprint:
+        refined_fields = previous.get("summary", {}).get("refined_fields", [])
+        for entry in refined_fields:
+            if entry.get("status") == "filled":
+                extracted_vars[entry["field"]] = entry["after"]
+    elif refine and os.getenv("EC_REFINE_FIELDS", "1") == "1":
         try:
-            results["rule_24"] = verify_machinery(
-                extracted_vars["appliances_on_first_floor"],
-                extracted_vars["foundation_type_app"],
-                image_paths
-            )
+            refined_fields = refine_critical_fields(extracted_vars, ec_meta)
         except Exception as e:
-            results["rule_24"] = {"rule": "Rule 24 - Machinery Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
+            print(f"⚠️ Field re-extraction skipped: {e}")
     
-    else:
-        # Add placeholders for image-based rules when no images are available
-        for rule_num in range(12, 25):
-            results[f"rule_{rule_num}"] = {
-                "rule": f"Rule {rule_num} - Image Analysis Required",
+    # Initialize results dictionary
+    results = {}
+    detail_stats = {}
+    detail_token = _run_detail_stats.set(detail_stats)
+    # View hints are read from the client file names of the photos
+    names_token = upload_names.set(job_upload_names(job_id) if job_id else {})
+    precomputed_rules = []
+    
+    # Rules whose inputs (extracted variables, photo contents and rule code) are unchanged since the
+    # previous evaluation of this submission are taken from the previous results instead of re-run
+    has_images = bool(image_paths) and all(os.path.exists(path) for path in image_paths)
+    # The photo part of a fingerprint covers the configuration the image rules are answered with
+    photos_fingerprint = _fingerprint([photo_set_fingerprint(image_paths), image_rules_config()]) if has_images else None
+    previous_fingerprints = (previous or {}).get("fingerprints", {}).get("rules", {})
+    fingerprints = {"ec": ec_fingerprint, "rules": {}}
+    reused_rules = []
+    for key, label, rule_fn, inputs in RULE_SPECS:
+        if key in IMAGE_RULES and not has_images:
+            # Placeholder for image-based rules when no images are available
+            results[key] = {
+                "rule": f"Rule {key.split('_')[1]} - Image Analysis Required",
                 "status": "⚠️",
                 "details": ["No images provided or images not found. Rule skipped."]
             }
-    
-    # Additional validations
-    try:
-        results["additional_checks"] = verify_additional_things(
-            extracted_vars["firm_date_app"],
-            extracted_vars["firm_date_pdf"],
-            extracted_vars["suffix_app"],
-            extracted_vars["suffix_pdf"],
-            extracted_vars["flood_zone_app"],
-            extracted_vars["flood_zone_pdf"]
-        )
-    except Exception as e:
-        results["additional_checks"] = {"rule": "Additional Things Verification", "status": "❌", "details": [f"Error: {str(e)}"]}
-    
-    try:
-        results["form_validation"] = form_validation(
-            extracted_vars["EC_expiration"],
-            extracted_vars["survey_date"]
-        )
-    except Exception as e:
-        results["form_validation"] = {"rule": "Form Validation", "status": "❌", "details": [f"Error: {str(e)}"]}
+            continue
+        fingerprint = rule_fingerprint(inputs, extracted_vars, photos_fingerprint)
+        fingerprints["rules"][key] = fingerprint
+        if previous_fingerprints.get(key) == fingerprint and _reusable(previous.get(key)):
+            results[key] = previous[key]
+            reused_rules.append(key)
+            continue
+        if rule_fn is None:
+            try:
+                results[key] = run_photo_only_rule(key, image_paths, precomputed_rules)
+            except Exception as e:
+                results[key] = {"rule": label, "status": "❌", "details": [f"Error: {str(e)}"]}
+        else:
+            results[key] = evaluate_rule(label, rule_fn, inputs, extracted_vars, image_paths)
+    _run_detail_stats.reset(detail_token)
+    upload_names.reset(names_token)
     
     # Generate summary statistics
     total_rules = len([k for k in results.keys() if k.startswith('rule_')])
@@ -631,8 +513,15 @@ def run_all_comparisons(data_pdf=None, data_app=None, image_paths=None):
         "failed_rules": failed_rules,
         "warning_rules": warning_rules,
         "images_processed": len(image_paths) if image_paths else 0,
+        "refined_fields": refined_fields,
+        "detail_escalations": detail_escalation_summary(detail_stats),
+        "precomputed_rules": precomputed_rules,
+        "reused_rules": reused_rules,
         "overall_status": "✅" if failed_rules == 0 and warning_rules == 0 else ("⚠️" if failed_rules == 0 else "❌")
     }
+    # Kept with the results so stored submissions can be re-scored without re-extraction
+    results["extracted_variables"] = extracted_vars
+    results["fingerprints"] = fingerprints
     
     return results
 
@@ -760,12 +649,20 @@ def extract_essential_variables(data_pdf, data_app):
     section_c_measurements_used = False 
     Elevation_Certificate_Section_Used = search_key(data_app, "Elevation Certificate Section Used") 
 
-    top_of_bottom_floor_pdf = extract_float_value(search_key(data_pdf, 'Top of Bottom Floor')) 
+    # Raw EC values of the critical elevations, to tell a blank field from a genuine 0.0
+    raw_elevations_pdf = {
+        "top_of_bottom_floor_pdf": search_key(data_pdf, 'Top of Bottom Floor'),
+        "top_of_next_higher_floor_pdf": search_key(data_pdf, 'Top of Next Higher Floor'),
+        "LAG_pdf": search_key(data_pdf, 'Lowest Adjacent Grade (LAG) next to building'),
+        "HAG_pdf": search_key(data_pdf, 'Highest Adjacent Grade') or search_key(data_pdf, "Highest Adjacent Grade (HAG)") or search_key(data_pdf, "HAG") or search_key(data_pdf, "Highest adjacent (finished) grade next to building (HAG)"),
+    }
+    missing_pdf_fields = sorted(name for name, value in raw_elevations_pdf.items() if not has_number(value))
+    top_of_bottom_floor_pdf = extract_float_value(raw_elevations_pdf["top_of_bottom_floor_pdf"]) 
     top_of_bottom_floor_app = extract_float_value(search_key(data_app, "Top of Bottom Floor")) 
-    top_of_next_higher_floor_pdf = extract_float_value(search_key(data_pdf, 'Top of Next Higher Floor')) 
-    LAG_pdf = extract_float_value(search_key(data_pdf, 'Lowest Adjacent Grade (LAG) next to building')) 
+    top_of_next_higher_floor_pdf = extract_float_value(raw_elevations_pdf["top_of_next_higher_floor_pdf"]) 
+    LAG_pdf = extract_float_value(raw_elevations_pdf["LAG_pdf"]) 
     LAG_app = extract_float_value(search_key(data_app, 'Lowest Adjacent Grade (LAG)') or search_key(data_pdf, "Lowest adjacent (finished) grade next to building (LAG)") or search_key(data_pdf, "Lowest Adjacent Grade") or search_key(data_pdf, "LAG")) 
-    HAG_pdf = extract_float_value(search_key(data_pdf, 'Highest Adjacent Grade') or search_key(data_pdf, "Highest Adjacent Grade (HAG)") or search_key(data_pdf, "HAG") or search_key(data_pdf, "Highest adjacent (finished) grade next to building (HAG)"))    
+    HAG_pdf = extract_float_value(raw_elevations_pdf["HAG_pdf"])    
     diagram_choices_1 = ['1', '1a', '3', '6', '7', '8']
     diagram_choices_2 = '1b'
     diagram_choices_3 = ['2', '2a', '2b', '4', '9']
@@ -877,6 +774,7 @@ def extract_essential_variables(data_pdf, data_app):
     "LAG_pdf": LAG_pdf,
     "LAG_app": LAG_app,
     "HAG_pdf": HAG_pdf,
+    "missing_pdf_fields": missing_pdf_fields,
     "diagram_choices_1": diagram_choices_1,
     "diagram_choices_2": diagram_choices_2,
     "diagram_choices_3": diagram_choices_3,
@@ -898,6 +796,8 @@ def extract_essential_variables(data_pdf, data_app):
     "diagram_choices_13": diagram_choices_13,
     "machinery": machinery,
     "c2e_elevation_of_mahinery": c2e_elevation_of_mahinery,
+    # None when the application gives no BFE; rule 10 reports it as missing
+    "bfe": extract_float_value(bfe) if has_number(bfe) else None,
     "e4_top_of_platform": e4_top_of_platform,
     "h2": h2,
     "diagram_choices_14": diagram_choices_14,
@@ -1553,6 +1453,7 @@ def verify_building_eligibility(image_path):
     
     building_eligibility = analyze_image( 
         image_path=image_path,  
+        rule="Rule 13",
         question=["The building in the image(s) is affixed to a permanent site, and has two or more outside rigid walls with a fully secured roof? (True/False)"]
     )
 
@@ -1585,6 +1486,7 @@ def verify_occupancy(occupancy_type_app, occupancy_type_ec, image_path):
     if str(occupancy_type_app).strip().lower() == "residential" or str(occupancy_type_ec).strip().lower() == "non-residential" or str(occupancy_type_ec).strip().lower() =="other residential" or str(occupancy_type_ec).strip().lower() == "residential condominium building" or str(occupancy_type_ec).strip().lower() == "two-four family":
         result = analyze_image(
             image_path=image_path,  
+            rule="Rule 14",
             question=["The building in the image(s) has multi-unit structures? (True/False)"]
         ) 
 
@@ -1616,6 +1518,7 @@ def verify_underWater(image_path):
     
     under_water = analyze_image(
         image_path=image_path,  
+        rule="Rule 15",
         question=["Some part of the building or entire building in the image(s) is over water? (True/False)"]
     ) 
 
@@ -1645,6 +1548,7 @@ def verify_foundation_eligibility(image_path):
     
     foundation_eligibility = analyze_image(
         image_path=image_path,  
+        rule="Rule 16",
         question=["Does the building in the image(s) show the 'front' and 'back' of the building, including the 'foundation system' and are the 'number of floors' visible clearly? (True/False)"] 
     )  
 
@@ -1695,6 +1599,8 @@ def verify_foundation_type(diagram_number_app, image_path):
 
     foundation_type_ai = analyze_image(
         image_path=image_path,  
+        rule="Rule 17",
+        needs_detail=True,
         question=["Deeply analyze the given image, and tell what is the foundation type of the building in the image(s)? Select only one from give options:"
         "Slab on Grade"
         "Basement"
@@ -1738,6 +1644,8 @@ def verify_number_of_floors(image_path, number_of_floors_app):
 
     number_of_floor_openai = analyze_image(
         image_path=image_path,  
+        rule="Rule 18",
+        needs_detail=True,
         question=["Count the number of floors in the building visible in the image(s). do not count mid-level entries, enclosures, basements, or crawlspaces (on grade or subgrade) as a floor. Respond with only a single integer like 1, 2, 3, etc., with no extra text or explanation. If you are unsure, make your best estimate."]  
     ) 
     results.append(f"Number of floors in the image: {extract_float_value(number_of_floor_openai)}")
@@ -1772,6 +1680,7 @@ def verify_dormers(image_path):
     
     dormers = analyze_image(
         image_path=image_path,  
+        rule="Rule 19",
         question=["Deeply analyze the image and tell does the building in the image(s) have dormers or indicate the presence of an additional floor? (True/False)"]
     )
 
@@ -1801,6 +1710,7 @@ def verify_construction_type(construction_type_app, image_path):
     
     has_brick_or_masonry_walls = analyze_image(
         image_path=image_path,  
+        rule="Rule 20",
         question=["Analyze the image(s) deeply and tell does the building in the image(s) have brick or masonry walls? (True/False)"]
     ).strip().lower() 
 
@@ -1845,6 +1755,7 @@ def verify_additions(image_path):
     
     extra_structure = analyze_image( 
         image_path=image_path,
+        rule="Rule 21",
         question=['Return True, if there is any evidence that another building is attached to the building in image(s) by means of a roof, elevated walkway, rigid exterior wall, or stairway. Else return False.']
     )
 
@@ -1874,6 +1785,7 @@ def verify_diagram5(image_path):
     
     verify_diagram_ai = analyze_image(
         image_path=image_path,  
+        rule="Rule 22",
         question=["If a building has an elevated floor (like a house on stilts), and the space underneath is open with lattice or slats (not solid walls), then that open area does NOT count as an enclosed space. The building would still be classified as 'Diagram 5' (a type of structure where the lower area is not fully enclosed). Tell me if the building in the image(s) is a 'Diagram 5' structure? Answer only in True/False. (True/False)"]  
     ).strip().lower()   
 
@@ -1903,6 +1815,7 @@ def verify_diagram6(diagram_number_app, image_path):
     if str(diagram_number_app).lower().strip() == "5":
         recheck_building_for_diagram = analyze_image(
             image_path=image_path,  
+            rule="Rule 23",
             question=["Analyze the given image(s) deeply and tell is there any evidence of an enclosed elevator shaft? (True/False)"] 
         ).strip().lower()
 
@@ -1941,31 +1854,37 @@ def verify_machinery(appliances_on_first_floor, foundation_type_app, image_path)
         if str(foundation_type_app).lower().strip() == "slab on grade" or str(foundation_type_app).lower() == "Slab on Grade (non-elevated)":
             appliances_eligibility = analyze_image(
                 image_path=image_path,
+                rule="Rule 24",
                 question=["Return True if the given image(s) shows the presence of exterior machine and equipments like 'AC Condenser, Elevator, Generator' elevated atleat to the height of attic in case of single floor, or elevated to atleast within a foot of the height of second or higher floor in case of more than one floor.\n Return False if the given image(s) does not show any exterior machinery or machinery elevated as described above. "] 
             ) 
         elif str(foundation_type_app).lower().strip() == "basement (non-elevated)":
             appliances_eligibility = analyze_image(
                 image_path=image_path,
+                rule="Rule 24",
                 question=["Return True, if the building in the image(s) shows exterior machinery or equipment elevated to atleast within a foot of the height of the floor above the basement or higher, else return False."]
             )  
         elif str(foundation_type_app).lower().strip() in ["elevated without enclosure on posts", "elevated without enclosure on piles", "elevated without enclosure on piers"]:
             appliances_eligibility = analyze_image(
                 image_path=image_path,
+                rule="Rule 24",
                 question=["Return True, if the building the image(s) shows exterior machinery elevated elevated to atleast within a foot of the height of the lowest elevated floor or higher, else return False."]
             ) 
         elif str(foundation_type_app).lower().strip() in ["elevated with enclosure on posts", "elevated with enclosure on piles", "elevated with enclosure on piers"]: 
             appliances_eligibility = analyze_image(
                 image_path=image_path,
+                rule="Rule 24",
                 question=["Return True, if the building the image(s) shows exterior machinery like 'AC Condenser, Elevator, Generator' elevated to atleast within a foot of the height of lowest elevated floor or heigher, else return False."] 
             ).lower().strip()
         elif str(foundation_type_app).lower() in ["elevated with enclosure not posts", "elevated with enclosure not piles", "elevated with enclosure not piers"]:
             appliances_eligibility = analyze_image( 
                 image_path=image_path,
+                rule="Rule 24",
                 question=["Return True, if the building in the image(s) shows exterior machinery like 'AC Condenser, Elevator, Generator' elevated to atleast within a foot of the height of the lowest elevated floor or higher, else return False."] 
             ) 
         elif str(foundation_type_app).lower() in ["crawlspace", "crawlspace (elevated)", "crawlspace (non-elevated)", "crawlspace (subgrade)", "subgrade crawlspace"]:
             appliances_eligibility = analyze_image(
                 image_path=image_path, 
+                rule="Rule 24",
                 question=["Return True, if the building in the image(s) shows exterior machinery like 'AC Condenser, Elevator, Generator' elevated to atleast within a foot of the height of the floor above the crawlspace or higher, else return False."] 
             )  
 
@@ -2100,6 +2019,134 @@ def form_validation(EC_expiration, survey_date):
     }
 
 
+# ===========================================================================================
+# Photo-only rules
+# ===========================================================================================
+# Rules answered from the photos alone; they start in the background when the photos are uploaded
+PHOTO_ONLY_RULES = {
+    "rule_13": verify_building_eligibility,
+    "rule_15": verify_underWater,
+    "rule_16": verify_foundation_eligibility,
+    "rule_19": verify_dormers,
+    "rule_21": verify_additions,
+    "rule_22": verify_diagram5,
+}
+
+
+def start_photo_only_rules(image_paths):
+    return speculative.start_rules(image_paths, PHOTO_ONLY_RULES)
+
+
+def run_photo_only_rule(rule_key, image_paths, precomputed_rules):
+    """Result precomputed on upload when available, otherwise the rule runs now."""
+    result = speculative.collect(image_paths, rule_key)
+    if result is not None:
+        precomputed_rules.append(rule_key)
+        return result
+    return PHOTO_ONLY_RULES[rule_key](image_paths)
+
+
+# ===========================================================================================
+# Rule table and input fingerprints
+# ===========================================================================================
+# Stand-in for the photo paths in a rule's argument list
+IMAGES = "<image_paths>"
+# Rules evaluated only when photos are available
+IMAGE_RULES = {f"rule_{n}" for n in range(12, 25)}
+
+# (result key, label used for errors, rule function - None for photo-only rules -, arguments in order:
+# extracted variable names and IMAGES). Evaluated in this order by run_all_comparisons.
+RULE_SPECS = [
+    ("rule_1", "Rule 1 - Address Verification", verify_address, ["address_pdf", "address_app", "street_name_pdf", "street_number_app"]),
+    ("rule_2", "Rule 2 - Diagram Number Verification", verify_diagram_number, ["diagramNumber_pdf", "diagram_number_app", "top_of_bottom_floor_app", "top_of_next_higher_floor_app", "Section_C_LAG_app"]),
+    ("rule_3", "Rule 3 - Crawlspace Details Verification", verify_crawlSpace_details, ["diagramNumber_pdf", "diagrams_for_crawlspace", "total_square_footage", "enclosure_Size", "crawlspace_square_footage", "garage_square_footage"]),
+    ("rule_4", "Rule 4 - CBRS/OPA Details Verification", verify_CBRS_OPA_details, ["CBRS_OPA_app", "CBRS", "OPA"]),
+    ("rule_5", "Rule 5 - Construction Status Verification", verify_construction_status, ["Construction_status_pdf", "Construction_status_app"]),
+    ("rule_6", "Rule 6 - Certifier Verification", verify_certifier, ["Elevation_Certificate_Section_Used", "section_c_measurements_used", "certifier_name_pdf", "certifier_license_number"]),
+    ("rule_7", "Rule 7 - Section C Measurements Verification", verify_sectionC_measurements, ["HAG_pdf", "LAG_pdf", "section_c_measurements_used", "top_of_bottom_floor_pdf", "top_of_bottom_floor_app", "top_of_next_higher_floor_app", "top_of_next_higher_floor_pdf", "LAG_app", "diagramNumber_pdf", "diagram_choices_1", "diagram_choices_2", "diagram_choices_3", "diagram_choices_4", "diagram_choices_5"]),
+    ("rule_8", "Rule 8 - Section E Measurements Verification", verify_sectionE_measurements, ["Elevation_Certificate_Section_Used", "section_e_measurements_used", "e1b", "top_of_bottom_floor_app", "diagramNumber_pdf", "diagram_choices_6", "LAG_pdf", "diagram_choices_7", "diagram_choices_8", "diagram_choices_9", "diagram_choices_10", "e2", "e1a"]),
+    ("rule_9", "Rule 9 - Section H Measurements Verification", verify_sectionH_measurements, ["Elevation_Certificate_Section_Used", "diagramNumber_pdf", "diagram_choices_11", "h1a_top_of_bottom_floor", "LAG_pdf", "diagram_choices_12", "diagram_choices_13", "h1b_top_of_next_higher_floor"]),
+    ("rule_10", "Rule 10 - Machinery Logic Verification", verify_Machinery_logic, ["bfe", "flood_zone_app", "machinery", "diagramNumber_pdf", "diagram_choices_14", "top_of_next_higher_floor_pdf", "c2e_elevation_of_mahinery", "top_of_bottom_floor_pdf", "e4_top_of_platform", "e1b", "h2", "diagram_choices_15", "e2"]),
+    ("rule_11", "Rule 11 - Vents Details Verification", verify_vents_details, ["diagramNumber_pdf", "diagram_choices_10", "total_number_of_openings", "number_of_flood_openings_app", "total_area_of_openings", "area_of_flood_openings_app"]),
+    ("rule_12", "Rule 12 - Photograph Requirement", verify_photograph_requirement, ["Construction_status_app"]),
+    ("rule_13", "Rule 13 - Building Eligibility", None, [IMAGES]),
+    ("rule_14", "Rule 14 - Occupancy Verification", verify_occupancy, ["occupancy_type_app", "occupancy_type_ec", IMAGES]),
+    ("rule_15", "Rule 15 - Under Water Verification", None, [IMAGES]),
+    ("rule_16", "Rule 16 - Foundation Eligibility", None, [IMAGES]),
+    ("rule_17", "Rule 17 - Foundation Type Verification", verify_foundation_type, ["diagram_number_app", IMAGES]),
+    ("rule_18", "Rule 18 - Number of Floors Verification", verify_number_of_floors, [IMAGES, "number_of_floors_app"]),
+    ("rule_19", "Rule 19 - Dormers Verification", None, [IMAGES]),
+    ("rule_20", "Rule 20 - Construction Type Verification", verify_construction_type, ["construction_type_app", IMAGES]),
+    ("rule_21", "Rule 21 - Additions Verification", None, [IMAGES]),
+    ("rule_22", "Rule 22 - Diagram 5 Verification", None, [IMAGES]),
+    ("rule_23", "Rule 23 - Diagram 6 Verification", verify_diagram6, ["diagram_number_app", IMAGES]),
+    ("rule_24", "Rule 24 - Machinery Verification", verify_machinery, ["appliances_on_first_floor", "foundation_type_app", IMAGES]),
+    ("additional_checks", "Additional Things Verification", verify_additional_things, ["firm_date_app", "firm_date_pdf", "suffix_app", "suffix_pdf", "flood_zone_app", "flood_zone_pdf"]),
+    ("form_validation", "Form Validation", form_validation, ["EC_expiration", "survey_date"]),
+]
+
+# Modules the rules delegate to: photo preparation, selection and quality gate, model routing
+RULE_MODULES = ["page_render", "photo_prep", "photo_select", "photo_quality", "model_router"]
+# Environment settings of those modules; their defaults are part of the module code
+PHOTO_SETTINGS = [
+    "PHOTO_MAX_LONG_EDGE", "PHOTO_MAX_SHORT_EDGE", "PHOTO_JPEG_QUALITY", "PHOTO_TOP_K", "PHOTO_DUPLICATE_DISTANCE",
+    "PHOTO_MIN_SHARPNESS", "PHOTO_REJECT_SHARPNESS", "PHOTO_MIN_SHORT_SIDE", "PHOTO_REJECT_SHORT_SIDE",
+]
+
+# Any change to the rule code, or to the modules it delegates to, invalidates every stored fingerprint
+_sha = hashlib.sha256()
+for _path in [__file__] + [os.path.join(os.path.dirname(os.path.abspath(__file__)), f"{m}.py") for m in RULE_MODULES]:
+    with open(_path, "rb") as _f:
+        _sha.update(_f.read())
+RULES_CODE_FINGERPRINT = _sha.hexdigest()
+
+
+def _fingerprint(value):
+    return hashlib.sha256(json.dumps(value, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def photo_set_fingerprint(image_paths):
+    """Digest of the photo contents, independent of their order and file names."""
+    digests = []
+    for path in image_paths:
+        sha = hashlib.sha256()
+        with open(path, "rb") as f:
+            for chunk in iter(lambda: f.read(1024 * 1024), b""):
+                sha.update(chunk)
+        digests.append(sha.hexdigest())
+    return _fingerprint(sorted(digests))
+
+
+def image_rules_config():
+    """Settings the image rule answers depend on besides the photos: detail mode, models, photo handling."""
+    return {
+        "detail": IMAGE_DETAIL_MODE,
+        "models": models_for("image_question"),
+        "photo_settings": {name: os.getenv(name) for name in PHOTO_SETTINGS},
+    }
+
+
+def rule_fingerprint(inputs, extracted_vars, photos_fingerprint):
+    values = [photos_fingerprint if name == IMAGES else extracted_vars.get(name) for name in inputs]
+    return _fingerprint([RULES_CODE_FINGERPRINT, values])
+
+
+def evaluate_rule(label, rule_fn, inputs, extracted_vars, image_paths=None):
+    """One rule on the extracted variables; a rule that raises is reported as failed with the error."""
+    try:
+        return rule_fn(*[image_paths if name == IMAGES else extracted_vars[name] for name in inputs])
+    except Exception as e:
+        return {"rule": label, "status": "❌", "details": [f"Error: {str(e)}"]}
+
+
+def _reusable(result):
+    # Rules that errored are always evaluated again
+    if not isinstance(result, dict) or "status" not in result:
+        return False
+    details = result.get("details") or []
+    return not (details and str(details[0]).startswith("Error:"))
+
+
 # CLI execution
 if __name__ == "__main__":
     print("Running all comparison rules...")
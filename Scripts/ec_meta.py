@@ -0,0 +1,22 @@
+import os
+import json
+
+# Sidecar written next to each EC JSON by process_EC: page labels, layout confidences and regions,
+# cached page renders and the photo pages found in the PDF.
+
+
+def meta_path_for(json_path):
+    return os.path.splitext(json_path)[0] + "_meta.json"
+
+
+def load_EC_meta(json_path):
+    try:
+        with open(meta_path_for(json_path), encoding="utf-8") as f:
+            return json.load(f)
+    except (IOError, json.JSONDecodeError):
+        return {"pages": {}, "photos": []}
+
+
+def save_EC_meta(json_path, meta):
+    with open(meta_path_for(json_path), "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False, indent=2)
@@ -0,0 +1,221 @@
+import json
+import re
+
+# Tolerant, single-pass JSON parser for LLM replies.
+# It reads the reply left to right, keeps every member it could read, and fixes the usual defects:
+# prose or code fences around the object, single quotes, Python literals, unquoted keys or values,
+# trailing/missing commas, unescaped inner quotes and a reply cut off before its closing braces.
+
+_NUMBER = re.compile(r"-?\d+(\.\d+)?([eE][+-]?\d+)?")
+_LITERALS = {"true": True, "false": False, "null": None, "True": True, "False": False, "None": None}
+_ESCAPES = {'"': '"', "'": "'", "\\": "\\", "/": "/", "b": "\b", "f": "\f", "n": "\n", "r": "\r", "t": "\t"}
+
+
+class _Reader:
+    def __init__(self, text):
+        self.text = text
+        self.pos = 0
+        self.repairs = []
+
+    def eof(self):
+        return self.pos >= len(self.text)
+
+    def peek(self):
+        return self.text[self.pos]
+
+    def skip_ws(self):
+        while not self.eof() and self.text[self.pos].isspace():
+            self.pos += 1
+
+    def repair(self, what):
+        if what not in self.repairs:
+            self.repairs.append(what)
+
+
+def _closes_string(r, i):
+    """A quote at i ends the string only if structure, another string or the end of input follows it."""
+    j = i + 1
+    while j < len(r.text) and r.text[j] in " \t\r":
+        j += 1
+    return j >= len(r.text) or r.text[j] in ",:}]\n" or (j > i + 1 and r.text[j] == r.text[i])
+
+
+def _parse_string(r):
+    quote = r.peek()
+    if quote == "'":
+        r.repair("single quotes")
+    r.pos += 1
+    chars = []
+    while not r.eof():
+        c = r.peek()
+        if c == "\\" and r.pos + 1 < len(r.text):
+            nxt = r.text[r.pos + 1]
+            if nxt in _ESCAPES:
+                chars.append(_ESCAPES[nxt])
+                r.pos += 2
+            elif nxt == "u" and re.fullmatch(r"[0-9a-fA-F]{4}", r.text[r.pos + 2:r.pos + 6]):
+                chars.append(chr(int(r.text[r.pos + 2:r.pos + 6], 16)))
+                r.pos += 6
+            else:
+                r.repair("invalid escape")
+                chars.append(c)
+                r.pos += 1
+            continue
+        if c == quote:
+            if _closes_string(r, r.pos):
+                r.pos += 1
+                return "".join(chars)
+            r.repair("unescaped quote")
+        chars.append(c)
+        r.pos += 1
+    r.repair("unterminated string")
+    return "".join(chars)
+
+
+def _parse_bare(r, stops, key=False):
+    start = r.pos
+    while not r.eof() and r.peek() not in stops:
+        r.pos += 1
+    word = r.text[start:r.pos].strip()
+    if word in _LITERALS:
+        if word not in ("true", "false", "null"):
+            r.repair("python literal")
+        return _LITERALS[word]
+    match = _NUMBER.fullmatch(word)
+    # Numbers with leading zeros (ZIP codes, panel numbers) stay strings
+    if match and not re.match(r"-?0\d", word):
+        return float(word) if (match.group(1) or match.group(2)) else int(word)
+    r.repair("unquoted key" if key else "unquoted text")
+    return word
+
+
+def _parse_value(r, stops):
+    r.skip_ws()
+    c = r.peek()
+    if c == "{":
+        return _parse_object(r)
+    if c == "[":
+        return _parse_array(r)
+    if c in "\"'":
+        return _parse_string(r)
+    return _parse_bare(r, stops)
+
+
+def _parse_object(r):
+    r.pos += 1
+    obj = {}
+    after_comma = False
+    while True:
+        r.skip_ws()
+        if r.eof():
+            r.repair("closed object")
+            return obj
+        c = r.peek()
+        if c == ",":
+            r.repair("extra comma")
+            r.pos += 1
+            continue
+        if c in "}]":
+            if c == "]":
+                r.repair("mismatched bracket")
+            if after_comma:
+                r.repair("trailing comma")
+            r.pos += 1
+            return obj
+
+        start = r.pos
+        key = _parse_string(r) if c in "\"'" else _parse_bare(r, ":,}]\n", key=True)
+        key = key if isinstance(key, str) else json.dumps(key)
+        r.skip_ws()
+        if r.eof():
+            r.repair("incomplete member dropped")
+            return obj
+        if r.peek() == ":":
+            r.pos += 1
+        else:
+            r.repair("missing colon")
+        r.skip_ws()
+        if r.eof():
+            r.repair("incomplete member dropped")
+            return obj
+        if r.peek() in ",}":
+            r.repair("missing value")
+            obj[key] = ""
+        else:
+            obj[key] = _parse_value(r, ",}]\n")
+        if r.pos == start:
+            # Nothing consumed: skip the offending character to guarantee progress
+            r.pos += 1
+        r.skip_ws()
+        after_comma = False
+        if not r.eof():
+            if r.peek() == ",":
+                r.pos += 1
+                after_comma = True
+            elif r.peek() not in "}]":
+                r.repair("missing comma")
+
+
+def _parse_array(r):
+    r.pos += 1
+    arr = []
+    after_comma = False
+    while True:
+        r.skip_ws()
+        if r.eof():
+            r.repair("closed array")
+            return arr
+        c = r.peek()
+        if c == ",":
+            r.repair("extra comma")
+            r.pos += 1
+            continue
+        if c in "]}":
+            if c == "}":
+                r.repair("mismatched bracket")
+            if after_comma:
+                r.repair("trailing comma")
+            r.pos += 1
+            return arr
+        start = r.pos
+        arr.append(_parse_value(r, ",]}\n"))
+        if r.pos == start:
+            r.pos += 1
+        r.skip_ws()
+        after_comma = False
+        if not r.eof():
+            if r.peek() == ",":
+                r.pos += 1
+                after_comma = True
+            elif r.peek() not in "]}":
+                r.repair("missing comma")
+
+
+def repair_json(text):
+    """
+    Parse an LLM reply into a JSON value, repairing it where needed.
+
+    Returns:
+        tuple: (parsed value, list of repairs applied; empty when the reply was valid JSON).
+
+    Raises:
+        ValueError: if the reply contains no JSON object or array at all.
+    """
+    text = text or ""
+    try:
+        return json.loads(text), []
+    except json.JSONDecodeError:
+        pass
+
+    starts = [i for i in (text.find("{"), text.find("[")) if i >= 0]
+    if not starts:
+        raise ValueError("No JSON object found in response.")
+    r = _Reader(text)
+    r.pos = min(starts)
+    if text[:r.pos].strip():
+        r.repair("leading text removed")
+    value = _parse_object(r) if text[r.pos] == "{" else _parse_array(r)
+    rest = text[r.pos:].strip()
+    if rest and rest != "```":
+        r.repair("trailing text removed")
+    return value, r.repairs
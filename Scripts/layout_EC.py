@@ -0,0 +1,350 @@
+import re
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Printed item codes (A7., C2., B12.) and sub-item markers (a), b)) that start a new field on the form
+ITEM_CODE = re.compile(r"^[A-H]\d{1,2}\.?$")
+SUBITEM_CODE = re.compile(r"^[a-h]\)$")
+CHECK_MARKS = {"x", "✓", "✔", "☒", "☑", "■", "●", "⊠"}
+
+# Minimum number of positioned words for a page to count as having a usable text layer
+MIN_TEXT_LAYER_WORDS = 40
+# Height (in PDF points) of the band read underneath a label for "below" regions
+BELOW_BAND = 20
+# Horizontal gap (in PDF points) that separates two columns of labels printed on one line
+COLUMN_GAP = 12
+
+# FEMA EC (FF-206-FY-22-152) field template.
+# Each field is anchored on its printed label and read from the neighbouring region.
+#   anchor: label prefix as printed on the form (tokens are compared case/punctuation-insensitively)
+#   after:  anchor of a preceding item the match must follow (sub-items such as "a)" repeat across items)
+#   label:  full printed label, skipped when reading a "right" region
+#   path:   where the value is written in the per-page dict, using the key names extract_essential_variables looks up
+#   region: "right" (rest of the label's line), "below" (box under the label) or "choice" (checked option)
+#   kind:   used to score how plausible the value read from the region is
+EC_FIELD_TEMPLATE = [
+    {"item": "Expiration", "anchor": "Expiration", "region": "right", "kind": "date",
+     "path": ("Form", "Expiration Date")},
+    {"item": "A2", "anchor": "A2. Building Street Address", "region": "below", "kind": "text",
+     "path": ("Section A", "Building Street Address (including Apt., Unit, Suite, and/or Bldg. No.) or P.O. Route and Box No.")},
+    {"item": "A2.city", "anchor": "City", "after": "A2. Building Street Address", "region": "below", "kind": "text",
+     "path": ("Section A", "City")},
+    {"item": "A2.state", "anchor": "State", "after": "A2. Building Street Address", "region": "below", "kind": "text",
+     "path": ("Section A", "State")},
+    {"item": "A2.zip", "anchor": "ZIP Code", "after": "A2. Building Street Address", "region": "below", "kind": "zip",
+     "path": ("Section A", "ZIP Code")},
+    {"item": "A7", "anchor": "A7. Building Diagram Number", "label": "A7. Building Diagram Number",
+     "region": "right", "kind": "diagram", "path": ("Section A", "Building Diagram")},
+    {"item": "A8.a", "anchor": "a) Square footage", "after": "A8.", "label": "a) Square footage of crawlspace or enclosure(s)",
+     "region": "right", "kind": "number", "path": ("Section A", "Crawlspace", "Square footage of crawlspace or enclosure(s)")},
+    {"item": "A8.b", "anchor": "b) Number of permanent flood openings", "after": "A8.",
+     "label": "b) Number of permanent flood openings in the crawlspace or enclosure(s) within 1.0 foot above adjacent grade",
+     "region": "right", "kind": "number",
+     "path": ("Section A", "Crawlspace", "Number of permanent flood openings in the crawlspace or enclosures within 1.0 foot above adjacent grade")},
+    {"item": "A8.c", "anchor": "c) Total net area", "after": "A8.", "label": "c) Total net area of flood openings in A8.b",
+     "region": "right", "kind": "number", "path": ("Section A", "Crawlspace", "Total net area of flood openings in A8.b")},
+    {"item": "A9.a", "anchor": "a) Square footage", "after": "A9.", "label": "a) Square footage of attached garage",
+     "region": "right", "kind": "number", "path": ("Section A", "Garage", "SquareFootage")},
+    {"item": "A9.b", "anchor": "b) Number of permanent flood openings", "after": "A9.",
+     "label": "b) Number of permanent flood openings in the attached garage within 1.0 foot above adjacent grade",
+     "region": "right", "kind": "number",
+     "path": ("Section A", "Garage", "Number of permanent flood openings in the crawlspace or enclosures within 1.0 foot above adjacent grade")},
+    {"item": "A9.c", "anchor": "c) Total net area", "after": "A9.", "label": "c) Total net area of flood openings in A9.b",
+     "region": "right", "kind": "number", "path": ("Section A", "Garage", "Total net area of flood openings in A9.b")},
+    {"item": "B5", "anchor": "B5. Suffix", "region": "below", "kind": "suffix", "path": ("Section B", "B5. Suffix")},
+    {"item": "B6", "anchor": "B6. FIRM Index Date", "region": "below", "kind": "date", "path": ("Section B", "B6 FIRM Index Date")},
+    {"item": "B8", "anchor": "B8. Flood Zone", "region": "below", "kind": "zone", "path": ("Section B", "B8. Flood Zone(s)")},
+    {"item": "B12.cbrs", "anchor": "B12.", "region": "choice", "kind": "choice", "options": ["Yes", "No"],
+     "path": ("Section B", "CBRS")},
+    {"item": "B12.opa", "anchor": "B12.", "region": "choice", "kind": "choice", "options": ["Yes", "No"],
+     "path": ("Section B", "OPA")},
+    {"item": "C1", "anchor": "C1. Building elevations are based on", "region": "choice", "kind": "choice",
+     "options": ["Construction Drawings", "Building Under Construction", "Finished Construction"],
+     "path": ("Section C", "Building elevations are based on")},
+    {"item": "C2.a", "anchor": "a) Top of bottom floor", "after": "C2.",
+     "label": "a) Top of bottom floor (including basement, crawlspace, or enclosure floor)",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Top of Bottom Floor")},
+    {"item": "C2.b", "anchor": "b) Top of the next higher floor", "after": "C2.", "label": "b) Top of the next higher floor",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Top of Next Higher Floor")},
+    {"item": "C2.c", "anchor": "c) Bottom of the lowest horizontal", "after": "C2.",
+     "label": "c) Bottom of the lowest horizontal structural member (V Zones only)",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Bottom of the lowest horizontal structural member")},
+    {"item": "C2.d", "anchor": "d) Attached garage", "after": "C2.", "label": "d) Attached garage (top of slab)",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Attached garage (top of slab)")},
+    {"item": "C2.e", "anchor": "e) Lowest elevation of machinery", "after": "C2.",
+     "label": "e) Lowest elevation of machinery or equipment servicing the building",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Lowest elevation of machinery or equipment servicing the building")},
+    {"item": "C2.f", "anchor": "f) Lowest adjacent", "after": "C2.", "label": "f) Lowest adjacent (finished) grade next to building (LAG)",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Lowest Adjacent Grade (LAG) next to building")},
+    {"item": "C2.g", "anchor": "g) Highest adjacent", "after": "C2.", "label": "g) Highest adjacent (finished) grade next to building (HAG)",
+     "region": "right", "kind": "elevation", "path": ("Section C", "Highest Adjacent Grade (HAG)")},
+    {"item": "D.name", "anchor": "Certifier's Name", "region": "below", "kind": "text", "path": ("Section D", "Certifier's Name")},
+    {"item": "D.license", "anchor": "License Number", "region": "below", "kind": "text", "path": ("Section D", "License Number")},
+    {"item": "D.date", "anchor": "Date", "after": "Certifier's Name", "region": "below", "kind": "date", "path": ("Section D", "Date")},
+    {"item": "E1.a", "anchor": "a) Top of bottom floor", "after": "E1.",
+     "label": "a) Top of bottom floor (including basement, crawlspace, or enclosure) is",
+     "region": "right", "kind": "elevation",
+     "path": ("Section E", "Top of Bottom Floor (including basement, crawlspace, or enclosure) is")},
+    {"item": "E1.b", "anchor": "b) Top of bottom floor", "after": "E1.",
+     "label": "b) Top of bottom floor (including basement, crawlspace, or enclosure) is",
+     "region": "right", "kind": "elevation", "path": ("Section E", "e1b")},
+    {"item": "E2", "anchor": "E2.", "label": "E2. For Building Diagrams 6-9 with permanent flood openings provided in Section A Items 8 and/or 9 (see pages 1-2 of Instructions), the next higher floor (C2.b in applicable Building Diagram) of the building is",
+     "region": "right", "kind": "elevation",
+     "path": ("Section E", "Top of Next Higher Floor (elevation C2.b in the diagrams) of the building is")},
+    {"item": "E4", "anchor": "E4. Top of platform", "label": "E4. Top of platform of machinery and/or equipment servicing the building is",
+     "region": "right", "kind": "elevation",
+     "path": ("Section E", "Top of platform of machinery and/or equipment servicing the building is")},
+]
+
+# EC sections for which every key the rules read is in the template above. Only pages made up of these
+# sections can skip the vision extraction; the other sections carry fields the template does not cover
+# (building occupancy, A8/A9 engineered openings, B9 BFE, H2 machinery, ...).
+LAYOUT_COMPLETE_SECTIONS = {"c", "d", "e"}
+
+VALUE_PATTERNS = {
+    "elevation": re.compile(r"^(-?\d+(\.\d+)?|N/?A)$", re.IGNORECASE),
+    "number": re.compile(r"^(\d+(\.\d+)?|N/?A)$", re.IGNORECASE),
+    "diagram": re.compile(r"^([1-9]|1[ab]|2[ab])$", re.IGNORECASE),
+    "zone": re.compile(r"^(A|AE|AH|AO|AR|A99|A\d{1,2}|V|VE|V\d{1,2}|D|B|C|X)(\s*[,/]\s*(A|AE|AH|AO|AR|A99|A\d{1,2}|V|VE|V\d{1,2}|D|B|C|X))*$", re.IGNORECASE),
+    "suffix": re.compile(r"^[A-Z]$", re.IGNORECASE),
+    "date": re.compile(r"^(\d{1,2}[/-]\d{1,2}[/-]\d{2,4}|[A-Za-z]+\.? \d{1,2},? \d{4})$"),
+    "zip": re.compile(r"^\d{5}(-\d{4})?$"),
+}
+# Units and leaders printed next to values that are not part of the value itself
+VALUE_NOISE = {"feet", "meters", "ft", "ft.", "sq", "in", "sq.", "in.", "above", "below", "or", "the", "hag", "lag",
+               "hag.", "lag.", "(hag)", "(lag)"}
+
+
+def _norm(token):
+    return re.sub(r"[^a-z0-9]", "", token.lower())
+
+
+def _is_anchor_word(word):
+    text = word[4]
+    return bool(ITEM_CODE.match(text) or SUBITEM_CODE.match(text))
+
+
+def _token_matches(word, token):
+    # Labels such as "Zone(s)" or "enclosure(s)" are matched by their stem
+    word = _norm(word)
+    return word == token or (len(token) >= 4 and word.startswith(token))
+
+
+def _find_phrase(words, phrase, start=0):
+    """Return (first, last) indices of the first occurrence of phrase at or after start, or None."""
+    tokens = [t for t in (_norm(p) for p in phrase.split()) if t]
+    if not tokens:
+        return None
+    for i in range(start, len(words) - len(tokens) + 1):
+        if all(_token_matches(words[i + k][4], tokens[k]) for k in range(len(tokens))):
+            return i, i + len(tokens) - 1
+    return None
+
+
+def _skip_label(words, first, last, label):
+    """Extend the anchor match over the rest of the printed label."""
+    if not label:
+        return last
+    tokens = [t for t in (_norm(p) for p in label.split()) if t]
+    k = last - first + 1
+    i = last + 1
+    while i < len(words) and k < len(tokens):
+        current = _norm(words[i][4])
+        if not current:
+            i += 1
+            continue
+        if current != tokens[k]:
+            break
+        last = i
+        i += 1
+        k += 1
+    return last
+
+
+def _same_line(word, ref, tolerance=2.0):
+    center = (word[1] + word[3]) / 2
+    return ref[1] - tolerance <= center <= ref[3] + tolerance
+
+
+def _right_limit(words, ref, page_width, columns=False):
+    """
+    x position of the next printed item on the same line, else the page edge.
+    With columns=True the next label column (a word after a wide gap) also ends the region.
+    """
+    limit = page_width
+    line = sorted((w for w in words if w[0] >= ref[2] and _same_line(w, ref)), key=lambda w: w[0])
+    previous_end = ref[2]
+    for w in line:
+        if _is_anchor_word(w) or (columns and w[0] - previous_end > COLUMN_GAP):
+            limit = min(limit, w[0])
+            break
+        previous_end = w[2]
+    return limit
+
+
+def _clean_value(region_words, kind):
+    tokens = [w[4] for w in region_words if re.search(r"[A-Za-z0-9]", w[4])]
+    if kind in ("elevation", "number"):
+        tokens = [t for t in tokens if t.lower() not in VALUE_NOISE]
+    return " ".join(tokens).strip()
+
+
+def _score_value(value, kind):
+    if not value:
+        return 0.0
+    pattern = VALUE_PATTERNS.get(kind)
+    if pattern is None:
+        return 0.85
+    if pattern.match(value):
+        return 0.95
+    # Right kind of content but with extra tokens around it (e.g. "12.3 NAVD")
+    if kind in ("elevation", "number") and re.search(r"-?\d+(\.\d+)?", value):
+        return 0.6
+    return 0.4
+
+
+def _read_right(words, first, last, page_width):
+    end = words[last]
+    limit = _right_limit(words, end, page_width)
+    region = [w for i, w in enumerate(words)
+              if i > last and _same_line(w, end) and end[2] <= w[0] < limit]
+    bbox = (end[2], end[1], limit, end[3])
+    return region, bbox
+
+
+def _read_below(words, first, last, page_width):
+    start, end = words[first], words[last]
+    limit = _right_limit(words, end, page_width, columns=True)
+    top, bottom = end[3], end[3] + BELOW_BAND
+    region = [w for w in words
+              if top <= (w[1] + w[3]) / 2 <= bottom and start[0] - 4 <= w[0] < limit and not _is_anchor_word(w)]
+    if region:
+        # Only the first line under the label belongs to its box
+        first_line = min(region, key=lambda w: w[1])
+        region = [w for w in region if _same_line(w, first_line)]
+    bbox = (start[0] - 4, top, limit, bottom)
+    return region, bbox
+
+
+def _read_choice(words, first, last, options):
+    """Return the single checked option after the anchor, with its confidence."""
+    marked = []
+    window = words[last + 1:last + 80]
+    for option in options:
+        match = _find_phrase(window, option)
+        if match is None:
+            continue
+        j = match[0]
+        opt = window[j]
+        # A mark glyph fused to the option ("☒Yes") or printed as the word right before it
+        has_mark = opt[4][:1].lower() in CHECK_MARKS and len(opt[4]) > 1
+        if j > 0:
+            mark = window[j - 1]
+            if mark[4].strip().lower() in CHECK_MARKS and _same_line(mark, opt) and opt[0] - mark[2] <= 24:
+                has_mark = True
+        if has_mark:
+            marked.append(option)
+    if len(marked) == 1:
+        return marked[0], 0.9
+    return "", 0.3 if not marked else 0.2
+
+
+def _set_path(data, path, value):
+    node = data
+    for key in path[:-1]:
+        node = node.setdefault(key, {})
+    node[path[-1]] = value
+
+
+def has_text_layer(page):
+    return len(page.get_text("words")) >= MIN_TEXT_LAYER_WORDS
+
+
+def extract_layout_page(page):
+    """
+    Read the EC template fields from one page's positioned text layer.
+
+    Returns:
+        tuple: (page dict in the shape process_EC writes, {item: confidence}, {item: bbox}).
+        Fields whose label is not printed on the page are left out of all three.
+    """
+    words = page.get_text("words", sort=True)
+    page_width = page.rect.width
+    data, confidence, regions = {}, {}, {}
+
+    for field in EC_FIELD_TEMPLATE:
+        start = 0
+        if field.get("after"):
+            after = _find_phrase(words, field["after"])
+            if after is None:
+                continue
+            start = after[1] + 1
+        match = _find_phrase(words, field["anchor"], start)
+        if match is None:
+            continue
+        first, last = match
+
+        if field["region"] == "choice":
+            value, score = _read_choice(words, first, last, field["options"])
+            bbox = (words[first][0], words[first][1], page_width, words[first][3] + BELOW_BAND)
+        else:
+            last = _skip_label(words, first, last, field.get("label"))
+            reader = _read_right if field["region"] == "right" else _read_below
+            region_words, bbox = reader(words, first, last, page_width)
+            value = _clean_value(region_words, field["kind"])
+            score = _score_value(value, field["kind"])
+            if field["region"] == "right" and not value:
+                # Long labels wrap, leaving the value on the next line
+                region_words, bbox = _read_below(words, first, last, page_width)
+                value = _clean_value(region_words, field["kind"])
+                score = _score_value(value, field["kind"]) * 0.8
+
+        _set_path(data, field["path"], value)
+        confidence[field["item"]] = round(score, 2)
+        regions[field["item"]] = [round(v, 1) for v in bbox]
+
+    return data, confidence, regions
+
+
+def overlay_fields(data, layout_data, confidence, min_confidence):
+    """
+    Write the confident layout values over a vision-extracted page dict.
+    Keys are matched the way search_key matches them, within the field's section only (generic labels such
+    as "City" or "Date" repeat across sections); unmatched values are added under their template path.
+    """
+    for field in EC_FIELD_TEMPLATE:
+        item = field["item"]
+        if confidence.get(item, 0.0) < min_confidence:
+            continue
+        node = layout_data
+        for key in field["path"]:
+            node = node.get(key, {}) if isinstance(node, dict) else {}
+        target = _norm(field["path"][-1])
+        if not any(_replace_key(section, target, node) for section in _section_nodes(data, field["path"][0])):
+            _set_path(data, field["path"], node)
+    return data
+
+
+def is_layout_complete(sections):
+    """True when a page only holds sections whose rule inputs are all read by the template."""
+    return bool(sections) and set(sections) <= LAYOUT_COMPLETE_SECTIONS
+
+
+def _section_nodes(data, section):
+    # Vision output names sections "Section A", "SECTION A - PROPERTY INFORMATION", ...
+    target = _norm(section)
+    return [value for key, value in data.items() if _norm(key).startswith(target) and isinstance(value, (dict, list))]
+
+
+def _replace_key(data, target, value):
+    if isinstance(data, dict):
+        for key in data:
+            if _norm(key) == target and not isinstance(data[key], (dict, list)):
+                data[key] = value
+                return True
+        return any(_replace_key(v, target, value) for v in data.values())
+    if isinstance(data, list):
+        return any(_replace_key(item, target, value) for item in data)
+    return False
+
@@ -0,0 +1,101 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import contextvars
+from contextlib import contextmanager
+import openai
+from openai.types.chat import ChatCompletion
+
+# Single entry point for chat completions, so token usage and latency can be measured per block of work.
+# The active blocks live in a context variable: worker threads started with contextvars.copy_context().run
+# count towards the blocks of the thread that started them, other threads do not.
+_active = contextvars.ContextVar("llm_usage_blocks", default=())
+_totals_lock = threading.Lock()
+
+# Cassettes: "record" saves every request / response pair, "replay" serves them without calling the API
+CASSETTE_MODE = os.getenv("LLM_CASSETTE_MODE", "off").lower()
+CASSETTE_DIR = os.getenv("LLM_CASSETTE_DIR", "cassettes")
+# Replay latency: "original" sleeps for the recorded latency, a number of seconds is a fixed synthetic latency
+REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "original")
+
+
+# API errors worth retrying with backoff. Anything else - a rejected request, a cassette miss, a reply the
+# caller cannot use - fails at once, and model_router escalates instead
+TRANSIENT_ERRORS = (openai.APIConnectionError, openai.APITimeoutError, openai.RateLimitError, openai.InternalServerError)
+
+
+class CassetteMissError(LookupError):
+    """Replay mode and no recording exists for the request."""
+
+
+def request_key(kwargs):
+    return hashlib.sha256(json.dumps(kwargs, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+def _cassette_path(key):
+    return os.path.join(CASSETTE_DIR, key[:2], f"{key}.json")
+
+
+def _record(key, kwargs, response, seconds):
+    path = _cassette_path(key)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    cassette = {
+        "model": kwargs.get("model"),
+        "latency": round(seconds, 3),
+        "recorded_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "response": response.model_dump(mode="json"),
+    }
+    # Written aside and renamed, so a concurrent replay never reads half a file
+    with open(f"{path}.tmp{threading.get_ident()}", "w", encoding="utf-8") as f:
+        json.dump(cassette, f)
+    os.replace(f"{path}.tmp{threading.get_ident()}", path)
+
+
+def _replay(key, kwargs):
+    path = _cassette_path(key)
+    if not os.path.exists(path):
+        raise CassetteMissError(f"No recording of this {kwargs.get('model')} request ({key}) in {CASSETTE_DIR}.")
+    with open(path, encoding="utf-8") as f:
+        cassette = json.load(f)
+    latency = cassette["latency"] if REPLAY_LATENCY == "original" else float(REPLAY_LATENCY)
+    if latency > 0:
+        time.sleep(latency)
+    return ChatCompletion.model_validate(cassette["response"])
+
+
+def chat_completion(**kwargs):
+    """openai.chat.completions.create, with the usage added to every active measure_usage() block of this thread."""
+    start = time.perf_counter()
+    if CASSETTE_MODE == "replay":
+        response = _replay(request_key(kwargs), kwargs)
+    else:
+        response = openai.chat.completions.create(**kwargs)
+        if CASSETTE_MODE == "record":
+            _record(request_key(kwargs), kwargs, response, time.perf_counter() - start)
+    seconds = time.perf_counter() - start
+
+    usage = getattr(response, "usage", None)
+    with _totals_lock:
+        for totals in _active.get():
+            totals["calls"] += 1
+            totals["model_seconds"] += seconds
+            if usage is not None:
+                totals["prompt_tokens"] += usage.prompt_tokens or 0
+                totals["completion_tokens"] += usage.completion_tokens or 0
+    return response
+
+
+@contextmanager
+def measure_usage():
+    """Collect calls, prompt / completion tokens, time spent waiting on the model and wall time of the block."""
+    totals = {"calls": 0, "prompt_tokens": 0, "completion_tokens": 0, "model_seconds": 0.0, "seconds": 0.0}
+    token = _active.set(_active.get() + (totals,))
+    start = time.perf_counter()
+    try:
+        yield totals
+    finally:
+        totals["seconds"] = round(time.perf_counter() - start, 3)
+        totals["model_seconds"] = round(totals["model_seconds"], 3)
+        _active.reset(token)
@@ -0,0 +1,306 @@
+import os
+import re
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+import subprocess
+import statistics
+import urllib.request
+import urllib.error
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from concurrent.futures import ThreadPoolExecutor
+
+# Load generator for app.py. Submissions (EC, application, photos, then /process) arrive as a Poisson
+# process at a configurable rate; model calls go to a local fake OpenAI endpoint so only our service is
+# measured. Each run writes a JSON report (configuration, throughput, latency percentiles, error rates,
+# server RSS over time) so worker / concurrency configurations can be compared across runs.
+
+SESSION_STEPS = ["/upload_ec", "/upload_application", "/upload_photos", "/process"]
+RSS_SAMPLE_SECONDS = 1.0
+# Canned structured reply of the fake endpoint for extraction prompts
+DEFAULT_FAKE_JSON = {"status": "load test", "buildingDiagramNumber": "1A"}
+
+
+# ---------------------------------------------------------------------------
+# Fake model endpoint
+# ---------------------------------------------------------------------------
+
+def _fake_handler(latency, jitter, fake_json):
+    class FakeOpenAI(BaseHTTPRequestHandler):
+        def do_POST(self):
+            body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+            messages = body.get("messages", [])
+            text = json.dumps(messages)
+            if "as 'True' or 'False'" in text:
+                # Image questions: one True per "Qn:" line
+                questions = len(re.findall(r"Q\d+:", text)) or 1
+                content = "\n".join(f"Q{i + 1}: True" for i in range(questions))
+            else:
+                content = json.dumps(fake_json)
+            time.sleep(max(0.0, random.gauss(latency, jitter)))
+            reply = json.dumps({
+                "id": f"chatcmpl-{uuid.uuid4().hex}",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": body.get("model", "fake"),
+                "choices": [{"index": 0, "finish_reason": "stop", "message": {"role": "assistant", "content": content}}],
+                "usage": {"prompt_tokens": len(text) // 4, "completion_tokens": len(content) // 4,
+                          "total_tokens": (len(text) + len(content)) // 4},
+            }).encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(reply)))
+            self.end_headers()
+            self.wfile.write(reply)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FakeOpenAI
+
+
+def start_fake_endpoint(port=0, latency=1.0, jitter=0.3, fake_json=None):
+    """Serve /v1/chat/completions in a background thread; returns the server (its base URL via server_port)."""
+    server = ThreadingHTTPServer(("127.0.0.1", port), _fake_handler(latency, jitter, fake_json or DEFAULT_FAKE_JSON))
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+# ---------------------------------------------------------------------------
+# Server process and RSS
+# ---------------------------------------------------------------------------
+
+def _process_tree(pid):
+    pids, stack = [], [pid]
+    while stack:
+        current = stack.pop()
+        pids.append(current)
+        try:
+            for task in os.listdir(f"/proc/{current}/task"):
+                with open(f"/proc/{current}/task/{task}/children") as f:
+                    stack.extend(int(child) for child in f.read().split())
+        except OSError:
+            pass
+    return pids
+
+
+def rss_mb(pid):
+    """Resident memory of a process and its children (e.g. gunicorn workers), from /proc."""
+    total_kb = 0
+    for current in _process_tree(pid):
+        try:
+            with open(f"/proc/{current}/status") as f:
+                total_kb += next((int(line.split()[1]) for line in f if line.startswith("VmRSS:")), 0)
+        except OSError:
+            pass
+    return round(total_kb / 1024, 1)
+
+
+def start_server(command, base_url, model_url, timeout=60):
+    """Start the service with its model calls pointed at the fake endpoint and wait until it answers."""
+    scripts_dir = os.path.dirname(os.path.abspath(__file__))
+    env = dict(os.environ, OPENAI_BASE_URL=model_url, OPENAI_API_KEY=os.getenv("OPENAI_API_KEY", "load-test"),
+               PYTHONPATH=os.pathsep.join([os.path.dirname(scripts_dir), scripts_dir]))
+    process = subprocess.Popen(command, shell=True, cwd=scripts_dir, env=env)
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        try:
+            urllib.request.urlopen(base_url + "/", timeout=2)
+            return process
+        except urllib.error.HTTPError:
+            return process
+        except OSError:
+            if process.poll() is not None:
+                raise RuntimeError(f"Server exited with code {process.returncode}")
+            time.sleep(0.5)
+    process.terminate()
+    raise RuntimeError(f"Server did not answer on {base_url} within {timeout} s")
+
+
+# ---------------------------------------------------------------------------
+# Client
+# ---------------------------------------------------------------------------
+
+def _multipart(files, fields):
+    """Encode [(field, path)] and {field: value} as multipart/form-data."""
+    boundary = uuid.uuid4().hex
+    parts = [
+        f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode("utf-8")
+        for name, value in fields.items()
+    ]
+    for field, path in files:
+        with open(path, "rb") as f:
+            content = f.read()
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{field}"; filename="{os.path.basename(path)}"\r\n'
+            f"Content-Type: application/octet-stream\r\n\r\n".encode("utf-8") + content + b"\r\n"
+        )
+    return b"".join(parts) + f"--{boundary}--\r\n".encode("utf-8"), f"multipart/form-data; boundary={boundary}"
+
+
+def _post(url, files=None, fields=None, timeout=600):
+    """POST files (multipart) or fields (JSON); returns (status, seconds, response JSON or None)."""
+    if files:
+        data, content_type = _multipart(files, fields or {})
+    else:
+        data, content_type = json.dumps(fields or {}).encode("utf-8"), "application/json"
+    request = urllib.request.Request(url, data=data, method="POST", headers={"Content-Type": content_type})
+    start = time.perf_counter()
+    body = None
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            status = response.status
+            body = response.read()
+    except urllib.error.HTTPError as e:
+        status = e.code
+    except OSError as e:
+        status = type(e).__name__
+    seconds = time.perf_counter() - start
+    try:
+        body = json.loads(body) if body else None
+    except ValueError:
+        body = None
+    return status, seconds, body
+
+
+def run_session(base_url, fixtures):
+    """One submission: the uploads, then /process, all in one job. Returns [(endpoint, status, seconds)]."""
+    files = {
+        "/upload_ec": [("ec_file", fixtures["ec"])],
+        "/upload_application": [("application_file", fixtures["application"])] if fixtures.get("application") else [],
+        "/upload_photos": [("photos", p) for p in fixtures["photos"]],
+        "/process": None,
+    }
+    results = []
+    job = {}
+    for endpoint in SESSION_STEPS:
+        if endpoint != "/process" and not files[endpoint]:
+            continue
+        status, seconds, body = _post(base_url + endpoint, files[endpoint], job)
+        results.append((endpoint, status, seconds))
+        if status != 200:
+            break
+        # The first upload creates the job, the later steps name it
+        if not job and isinstance(body, dict) and body.get("job_id"):
+            job = {"job_id": body["job_id"]}
+    return results
+
+
+def _percentiles(values):
+    values = sorted(values)
+    if not values:
+        return {}
+    pick = lambda share: round(values[min(len(values) - 1, int(round(share * (len(values) - 1))))], 3)
+    return {"p50": pick(0.5), "p95": pick(0.95), "p99": pick(0.99), "mean": round(statistics.mean(values), 3)}
+
+
+def load_test(base_url, fixtures, rate, duration, max_in_flight=64, server_pid=None, seed=None):
+    """Poisson arrivals of rate submissions per second for duration seconds."""
+    rng = random.Random(seed)
+    requests, sessions, rss = [], [], []
+    lock = threading.Lock()
+    done = threading.Event()
+
+    def sample_rss():
+        start = time.perf_counter()
+        while not done.is_set():
+            rss.append((round(time.perf_counter() - start, 1), rss_mb(server_pid)))
+            done.wait(RSS_SAMPLE_SECONDS)
+
+    def session():
+        start = time.perf_counter()
+        results = run_session(base_url, fixtures)
+        with lock:
+            requests.extend(results)
+            sessions.append((time.perf_counter() - start, all(status == 200 for _, status, _ in results)))
+
+    if server_pid:
+        threading.Thread(target=sample_rss, daemon=True).start()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=max_in_flight) as executor:
+        next_arrival = 0.0
+        while next_arrival < duration:
+            time.sleep(max(0.0, next_arrival - (time.perf_counter() - start)))
+            executor.submit(session)
+            next_arrival += rng.expovariate(rate)
+    elapsed = time.perf_counter() - start
+    done.set()
+
+    endpoints = {}
+    for endpoint in SESSION_STEPS:
+        hits = [(status, seconds) for e, status, seconds in requests if e == endpoint]
+        if hits:
+            errors = [s for s, _ in hits if s != 200]
+            endpoints[endpoint] = dict(
+                requests=len(hits),
+                error_rate=round(len(errors) / len(hits), 3),
+                errors={str(s): errors.count(s) for s in set(errors)},
+                latency_s=_percentiles([seconds for _, seconds in hits]),
+            )
+    completed = [seconds for seconds, ok in sessions if ok]
+    return {
+        "submissions": len(sessions),
+        "completed": len(completed),
+        "elapsed_s": round(elapsed, 1),
+        "throughput_per_min": round(60 * len(completed) / elapsed, 2) if elapsed else None,
+        "session_latency_s": _percentiles(completed),
+        "endpoints": endpoints,
+        "rss_mb": {"peak": max((m for _, m in rss), default=None), "timeline": rss},
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Load-test the Flask service against a fake model endpoint.")
+    parser.add_argument("--ec", required=True, help="EC PDF fixture")
+    parser.add_argument("--application", help="Application PDF fixture")
+    parser.add_argument("--photos", nargs="*", default=[], help="Photo fixtures")
+    parser.add_argument("--rate", type=float, default=0.2, help="Submissions per second (Poisson arrivals)")
+    parser.add_argument("--duration", type=float, default=60, help="Seconds during which submissions arrive")
+    parser.add_argument("--max-in-flight", type=int, default=64, help="Client-side cap on concurrent submissions")
+    parser.add_argument("--url", default="http://127.0.0.1:5000", help="Service base URL")
+    parser.add_argument("--server-cmd", help='Start the service, e.g. "gunicorn -w 4 --threads 8 -b 127.0.0.1:5000 app:app"')
+    parser.add_argument("--server-pid", type=int, help="PID of an already running service, for RSS")
+    parser.add_argument("--model-latency", type=float, default=1.0, help="Mean fake model latency in seconds")
+    parser.add_argument("--model-jitter", type=float, default=0.3)
+    parser.add_argument("--fake-json", help="File with the JSON the fake endpoint returns for extraction prompts")
+    parser.add_argument("--label", default="", help="Name of the configuration under test")
+    parser.add_argument("--seed", type=int)
+    parser.add_argument("--output", help="Write the report to this JSON file")
+    args = parser.parse_args()
+
+    fake_json = None
+    if args.fake_json:
+        with open(args.fake_json, encoding="utf-8") as f:
+            fake_json = json.load(f)
+    fake = start_fake_endpoint(latency=args.model_latency, jitter=args.model_jitter, fake_json=fake_json)
+    model_url = f"http://127.0.0.1:{fake.server_port}/v1"
+
+    server = None
+    server_pid = args.server_pid
+    if args.server_cmd:
+        server = start_server(args.server_cmd, args.url, model_url)
+        server_pid = server.pid
+    elif not server_pid:
+        print(f"Start the service with OPENAI_BASE_URL={model_url} (fake model endpoint), then press Enter.", file=sys.stderr)
+        input()
+
+    try:
+        fixtures = {"ec": args.ec, "application": args.application, "photos": args.photos}
+        report = load_test(args.url, fixtures, args.rate, args.duration, args.max_in_flight, server_pid, args.seed)
+    finally:
+        if server:
+            server.terminate()
+        fake.shutdown()
+
+    report = dict({"label": args.label, "config": {
+        "rate": args.rate, "duration": args.duration, "max_in_flight": args.max_in_flight,
+        "server_cmd": args.server_cmd, "model_latency": args.model_latency, "model_jitter": args.model_jitter,
+    }}, **report)
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in report.items() if k != "rss_mb"} | {"peak_rss_mb": report["rss_mb"]["peak"]}, indent=2))
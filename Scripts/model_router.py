@@ -0,0 +1,149 @@
+import os
+import re
+import time
+import logging
+import threading
+from json_repair import repair_json
+
+logger = logging.getLogger(__name__)
+
+# Cheap-first model cascade. Each call class is sent to its configured (cheaper / faster) model first;
+# the result is validated and only a failed validation escalates to the fallback model.
+FALLBACK_MODEL = os.getenv("ROUTE_FALLBACK_MODEL", "gpt-4o")
+ROUTING_ENABLED = os.getenv("MODEL_ROUTING", "1") == "1"
+
+# call class -> first model (override with ROUTE_MODEL_<CLASS>, e.g. ROUTE_MODEL_EC_PAGE=gpt-4o)
+CALL_CLASSES = {
+    "ec_page": "gpt-4o-mini",
+    "application": "gpt-4o-mini",
+    "application_page": "gpt-4o-mini",
+    "image_question": "gpt-4o-mini",
+    "field_crop": "gpt-4o-mini",
+}
+
+# Keys whose values are elevations / heights in feet, and the range they must fall in: from the lowest US
+# ground (Death Valley, -282 ft) to the highest incorporated town (Alma, CO, 10,578 ft); anything outside
+# is a misread. Only elevation items count ("top of bottom floor", not "square footage of enclosure floor").
+ELEVATION_KEY = re.compile(
+    r"elevation|\btop of\b.*\bfloor\b|\bfloor height\b|\badjacent\b.*\bgrade\b|\blag\b|\bhag\b|\bbfe\b", re.IGNORECASE
+)
+NOT_ELEVATION_KEY = re.compile(r"square|\barea\b|\bsq\b", re.IGNORECASE)
+ELEVATION_RANGE = (-300.0, 11000.0)
+
+# call class -> {"calls", "escalated", "failures", "models": {model: {"calls", "seconds"}}}
+_stats = {}
+_lock = threading.Lock()
+
+
+def models_for(call_class):
+    first = os.getenv(f"ROUTE_MODEL_{call_class.upper()}", CALL_CLASSES.get(call_class, FALLBACK_MODEL))
+    if not ROUTING_ENABLED or first == FALLBACK_MODEL:
+        return [FALLBACK_MODEL]
+    return [first, FALLBACK_MODEL]
+
+
+def _record(call_class, model, seconds, escalated=False, failed=False):
+    with _lock:
+        stats = _stats.setdefault(call_class, {"calls": 0, "escalated": 0, "failures": 0, "models": {}})
+        model_stats = stats["models"].setdefault(model, {"calls": 0, "seconds": 0.0})
+        model_stats["calls"] += 1
+        model_stats["seconds"] += seconds
+        if escalated:
+            stats["escalated"] += 1
+        if failed:
+            stats["failures"] += 1
+
+
+def route(call_class, call, validate, steps=None):
+    """
+    Run call(model) on the models of a call class in order until validate(result) passes.
+    steps replaces the models with (model, *args) tuples tried in order as call(model, *args), for call
+    classes that escalate other settings (image detail) together with the model.
+    A call that raises counts as a failed validation; the last step's result (or error) is returned as is.
+    """
+    steps = steps or [(model,) for model in models_for(call_class)]
+    with _lock:
+        _stats.setdefault(call_class, {"calls": 0, "escalated": 0, "failures": 0, "models": {}})["calls"] += 1
+    for i, step in enumerate(steps):
+        model, last = step[0], i == len(steps) - 1
+        start = time.perf_counter()
+        try:
+            result = call(*step)
+        except Exception as e:
+            _record(call_class, model, time.perf_counter() - start, escalated=not last, failed=last)
+            if last:
+                raise
+            logger.warning(f"{call_class}: {step} failed ({type(e).__name__}: {e}), escalating to {steps[i + 1]}.")
+            continue
+        seconds = time.perf_counter() - start
+        if last or validate(result):
+            _record(call_class, model, seconds)
+            return result
+        _record(call_class, model, seconds, escalated=True)
+        logger.info(f"{call_class}: {step} result failed validation, escalating to {steps[i + 1]}.")
+
+
+def routing_summary():
+    """Per call class: calls, escalation rate and mean latency per model."""
+    summary = {}
+    with _lock:
+        for call_class, stats in _stats.items():
+            summary[call_class] = {
+                "calls": stats["calls"],
+                "escalated": stats["escalated"],
+                "failures": stats["failures"],
+                "escalation_rate": round(stats["escalated"] / stats["calls"], 3) if stats["calls"] else None,
+                "models": {
+                    model: {"calls": m["calls"], "mean_seconds": round(m["seconds"] / m["calls"], 3)}
+                    for model, m in stats["models"].items()
+                },
+            }
+    return summary
+
+
+# ---------------------------------------------------------------------------
+# Validators
+# ---------------------------------------------------------------------------
+
+def _numbers(value):
+    match = re.search(r"-?\d+(\.\d+)?", str(value))
+    return float(match.group()) if match else None
+
+
+def plausible_elevations(data):
+    """False if any elevation-like field holds a number outside ELEVATION_RANGE."""
+    stack = [data]
+    while stack:
+        current = stack.pop()
+        if isinstance(current, dict):
+            for key, value in current.items():
+                if isinstance(value, (dict, list)):
+                    stack.append(value)
+                elif ELEVATION_KEY.search(str(key)) and not NOT_ELEVATION_KEY.search(str(key)):
+                    number = _numbers(value) if isinstance(value, str) else value
+                    if isinstance(number, (int, float)) and not isinstance(number, bool) \
+                            and not ELEVATION_RANGE[0] < number < ELEVATION_RANGE[1]:
+                        return False
+        elif isinstance(current, list):
+            stack.extend(current)
+    return True
+
+
+def valid_json_object(text, required_keys=None):
+    """Reply parses to a non-empty object, holds every required key and plausible elevations."""
+    try:
+        data, _ = repair_json(text)
+    except ValueError:
+        return False
+    if not isinstance(data, dict) or not data:
+        return False
+    if required_keys and any(key not in data for key in required_keys):
+        return False
+    return plausible_elevations(data)
+
+
+def valid_true_false(answer, question_count=1):
+    answer = str(answer).strip().lower()
+    if question_count == 1:
+        return answer in ("true", "false")
+    return len(re.findall(r"\b(true|false)\b", answer)) == question_count
@@ -0,0 +1,80 @@
+import os
+import logging
+import threading
+import pytesseract
+from pytesseract import Output
+
+try:
+    import tesserocr
+except ImportError:  # the warm in-process engine is optional; pytesseract is the fallback
+    tesserocr = None
+
+logger = logging.getLogger(__name__)
+
+# OCR engines for process_application, selected with OCR_BACKEND:
+#   "tesserocr"   - one warm libtesseract API per worker thread, images passed in memory
+#   "pytesseract" - a tesseract process per page (language data reloaded every call)
+#   "auto"        - tesserocr when installed, otherwise pytesseract
+OCR_BACKEND = os.getenv("OCR_BACKEND", "auto").lower()
+OCR_LANG = os.getenv("OCR_LANG", "eng")
+
+_local = threading.local()
+
+
+def _tesserocr_api():
+    """The calling thread's PyTessBaseAPI, created (and its language data loaded) on first use."""
+    api = getattr(_local, "api", None)
+    if api is None:
+        api = tesserocr.PyTessBaseAPI(lang=OCR_LANG)
+        _local.api = api
+    return api
+
+
+def _tesserocr_data(img):
+    api = _tesserocr_api()
+    api.SetImage(img)
+    return api.GetUTF8Text(), [float(c) for c in api.AllWordConfidences()]
+
+
+def _pytesseract_data(img):
+    data = pytesseract.image_to_data(img, lang=OCR_LANG, output_type=Output.DICT)
+    lines, confidences = {}, []
+    for i, word in enumerate(data["text"]):
+        if not word.strip():
+            continue
+        confidences.append(float(data["conf"][i]))
+        line_key = (data["block_num"][i], data["par_num"][i], data["line_num"][i])
+        lines.setdefault(line_key, []).append(word)
+    text, previous_block = "", None
+    for (block, _, _), words in lines.items():
+        if previous_block is not None and block != previous_block:
+            text += "\n"
+        text += " ".join(words) + "\n"
+        previous_block = block
+    return text, confidences
+
+
+# Backends returning (text, per-word confidences 0-100) from a single recognition pass
+DATA_BACKENDS = {
+    "tesserocr": _tesserocr_data,
+    "pytesseract": _pytesseract_data,
+}
+
+
+def resolve_backend(name=None):
+    name = (name or OCR_BACKEND).lower()
+    if name == "auto":
+        return "tesserocr" if tesserocr is not None else "pytesseract"
+    if name not in DATA_BACKENDS:
+        raise ValueError(f"Unknown OCR backend: {name}. Choose from: auto, {', '.join(DATA_BACKENDS)}.")
+    if name == "tesserocr" and tesserocr is None:
+        logger.warning("tesserocr is not installed, falling back to pytesseract.")
+        return "pytesseract"
+    return name
+
+
+def image_to_text_with_confidence(img, backend=None):
+    """OCR a PIL image; returns (text, mean word confidence 0-100, or None when no words were found)."""
+    text, confidences = DATA_BACKENDS[resolve_backend(backend)](img)
+    confidence = sum(confidences) / len(confidences) if confidences else None
+    return text, confidence
@@ -0,0 +1,138 @@
+import os
+import re
+import logging
+import fitz  # PyMuPDF
+from PIL import ImageStat
+from page_render import render_page
+
+try:
+    import pytesseract
+except ImportError:  # OCR of pages without a text layer is optional
+    pytesseract = None
+
+logger = logging.getLogger(__name__)
+
+PAGE_DATA = "data"
+PAGE_PHOTO = "photo"
+PAGE_BOILERPLATE = "boilerplate"
+
+# Item labels and headings printed on the EC data sections (A-H)
+DATA_KEYWORDS = [
+    "section a", "section b", "section c", "section d", "section e", "section g", "section h",
+    "building diagram number", "flood zone", "firm index date", "building elevations are based on",
+    "top of bottom floor", "top of the next higher floor", "lowest adjacent", "highest adjacent",
+    "certifier's name", "license number", "property information", "flood insurance rate map",
+    "building elevation information", "machinery and equipment", "community information",
+]
+# Headings and captions of the building photograph pages
+PHOTO_KEYWORDS = [
+    "building photographs", "photo one", "photo two", "photo three", "photo four",
+    "front view", "rear view", "right side view", "left side view",
+]
+# Instruction, privacy and burden-disclosure pages that carry no submission data
+BOILERPLATE_KEYWORDS = [
+    "instructions for completing", "paperwork burden disclosure", "privacy act statement",
+    "purpose of the elevation certificate", "who can complete", "the elevation certificate is important",
+    "diagram 2a", "diagram 2b", "this page intentionally left blank",
+]
+
+# Fewer words than this and the page is treated as blank
+MIN_PAGE_WORDS = 8
+# Share of the page covered by embedded images above which a photo heading means a photo page
+PHOTO_COVERAGE = 0.25
+CLASSIFY_DPI = 72
+
+
+def _hits(text, keywords):
+    return [k for k in keywords if k in text]
+
+
+def _normalize_text(text):
+    text = text.lower().replace("’", "'")
+    return re.sub(r"\s+", " ", text)
+
+
+def _image_coverage(page):
+    page_area = abs(page.rect) or 1.0
+    covered = 0.0
+    for info in page.get_image_info():
+        covered += abs(fitz.Rect(info["bbox"]) & page.rect)
+    return min(covered / page_area, 1.0)
+
+
+def _ocr_low_dpi(page):
+    """Quick low-resolution OCR for pages without a text layer; returns (text, pixel stddev)."""
+    img = render_page(page, dpi=CLASSIFY_DPI)
+    stddev = ImageStat.Stat(img).stddev[0]
+    if pytesseract is None:
+        return "", stddev
+    try:
+        return pytesseract.image_to_string(img), stddev
+    except (pytesseract.TesseractNotFoundError, pytesseract.TesseractError) as e:
+        logger.warning(f"Low-DPI OCR unavailable for page classification: {str(e)}")
+        return "", stddev
+
+
+def classify_page(page):
+    """
+    Label a PDF page as a data section, a photo page or boilerplate without any model call.
+
+    Returns:
+        dict: {"label": ..., "source": "text" | "ocr", "sections": [EC section letters printed], "reason": ...}
+    """
+    text = page.get_text()
+    source = "text"
+    coverage = _image_coverage(page)
+    stddev = None
+    if len(text.split()) < MIN_PAGE_WORDS:
+        # Scanned page: the embedded image is the whole page, so coverage says nothing about photos
+        text, stddev = _ocr_low_dpi(page)
+        source = "ocr"
+        coverage = 0.0
+
+    text = _normalize_text(text)
+    sections = sorted(set(re.findall(r"\bsection ([a-h])\b", text)))
+    data_hits = _hits(text, DATA_KEYWORDS)
+    photo_hits = _hits(text, PHOTO_KEYWORDS)
+    boilerplate_hits = _hits(text, BOILERPLATE_KEYWORDS)
+
+    if len(text.split()) < MIN_PAGE_WORDS:
+        if source == "text" and coverage > PHOTO_COVERAGE:
+            return {"label": PAGE_PHOTO, "source": source, "sections": sections, "reason": f"image coverage {coverage:.0%}"}
+        if stddev is not None and stddev > 40:
+            # Almost no text but a busy image: a photograph scanned on its own page
+            return {"label": PAGE_PHOTO, "source": source, "sections": sections, "reason": f"untitled image page (stddev {stddev:.0f})"}
+        return {"label": PAGE_BOILERPLATE, "source": source, "sections": sections, "reason": "blank page"}
+    if photo_hits and (coverage > PHOTO_COVERAGE or len(data_hits) < 3):
+        return {"label": PAGE_PHOTO, "source": source, "sections": sections, "reason": ", ".join(photo_hits)}
+    # Instruction pages quote the item labels too, so their headings are checked first
+    if boilerplate_hits:
+        return {"label": PAGE_BOILERPLATE, "source": source, "sections": sections, "reason": ", ".join(boilerplate_hits)}
+    if len(data_hits) >= 2:
+        return {"label": PAGE_DATA, "source": source, "sections": sections, "reason": ", ".join(data_hits[:5])}
+    # Unrecognised pages (flood reports, declarations, ...) still go to extraction as before
+    return {"label": PAGE_DATA, "source": source, "sections": sections, "reason": "unrecognised layout"}
+
+
+def classify_pages(doc, page_limit=None):
+    """Classify the first page_limit pages of an open fitz document."""
+    count = min(len(doc), page_limit) if page_limit else len(doc)
+    labels = []
+    for i in range(count):
+        result = classify_page(doc[i])
+        logger.info(f"Page {i+1}: {result['label']} ({result['source']}: {result['reason']})")
+        labels.append(result)
+    return labels
+
+
+def save_photo_pages(doc, page_numbers, output_dir, dpi=150):
+    """Render photo pages to PNG files for the image-rule pipeline; returns the file paths."""
+    paths = []
+    if not page_numbers:
+        return paths
+    os.makedirs(output_dir, exist_ok=True)
+    for i in page_numbers:
+        path = os.path.join(output_dir, f"page_{i+1}.png")
+        doc[i].get_pixmap(dpi=dpi).save(path)
+        paths.append(path)
+    return paths
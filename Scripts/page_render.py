@@ -0,0 +1,22 @@
+import fitz  # PyMuPDF
+from PIL import Image
+
+
+def render_page(page, dpi=None, zoom=None, clip=None, gray=True):
+    """
+    Render a PDF page to a PIL image without copying the pixels.
+
+    Pages are rendered single-channel by default: Tesseract binarises its input anyway, and an "L"
+    pixmap is a third of the size of an RGB one. The image is a view on the pixmap's sample buffer
+    (frombuffer over samples_mv), so the pixmap is kept on the image for as long as the image lives.
+    """
+    colorspace = fitz.csGRAY if gray else fitz.csRGB
+    if dpi:
+        pix = page.get_pixmap(dpi=dpi, clip=clip, colorspace=colorspace, alpha=False)
+    else:
+        pix = page.get_pixmap(matrix=fitz.Matrix(zoom or 1, zoom or 1), clip=clip, colorspace=colorspace, alpha=False)
+    mode = "L" if gray else "RGB"
+    img = Image.frombuffer(mode, (pix.width, pix.height), pix.samples_mv, "raw", mode, pix.stride, 1)
+    # samples_mv is only valid while the pixmap exists
+    img._pixmap = pix
+    return img
@@ -0,0 +1,146 @@
+import os
+import re
+import base64
+import hashlib
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from io import BytesIO
+import fitz  # PyMuPDF
+from PIL import Image, ImageOps, UnidentifiedImageError
+from page_render import render_page
+from photo_select import photo_metrics
+
+logger = logging.getLogger(__name__)
+
+# Photos are prepared once per upload and the encoded payloads reused by every image rule.
+# At "high" detail the model scales an image to fit 2048x2048 and then its short side to 768,
+# so larger uploads only cost bandwidth and encoding time.
+MAX_LONG_EDGE = int(os.getenv("PHOTO_MAX_LONG_EDGE", "2048"))
+MAX_SHORT_EDGE = int(os.getenv("PHOTO_MAX_SHORT_EDGE", "768"))
+JPEG_QUALITY = int(os.getenv("PHOTO_JPEG_QUALITY", "85"))
+# At "low" detail the model sees a single 512x512 view
+LOW_DETAIL_EDGE = 512
+# Resolution at which pages of PDF photo reports are rendered
+PDF_PHOTO_DPI = 150
+
+# Uploads whose prepared photos are kept, least recently used first out
+PHOTO_CACHE_SIZE = int(os.getenv("PHOTO_CACHE_SIZE", "64"))
+BLOB_NAME = re.compile(r"^[0-9a-f]{64}$")
+
+# content digest -> list of prepared photos
+_photo_cache = OrderedDict()
+_cache_lock = threading.Lock()
+# content digest -> client file name, set for the job being processed (uploads are stored under their digest)
+upload_names = contextvars.ContextVar("upload_names", default={})
+
+
+def _target_size(width, height):
+    scale = min(1.0, MAX_LONG_EDGE / max(width, height), MAX_SHORT_EDGE / min(width, height))
+    return max(1, round(width * scale)), max(1, round(height * scale))
+
+
+def _encode(img, source, page=None):
+    img = img.convert("RGB")
+    original_size = img.size
+    size = _target_size(*img.size)
+    if size != img.size:
+        img = img.resize(size, Image.LANCZOS)
+    buffered = BytesIO()
+    img.save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    data = buffered.getvalue()
+    return {
+        "source": source,
+        "page": page,
+        "image": img,
+        "size": img.size,
+        "original_size": original_size,
+        "bytes": len(data),
+        "url": f"data:image/jpeg;base64,{base64.b64encode(data).decode('utf-8')}",
+    }
+
+
+def low_detail_url(photo):
+    """JPEG data URL of the photo at the 512px the model uses for "low" detail, encoded on first use."""
+    if "low_url" not in photo and "image" in photo:
+        img = photo["image"].copy()
+        img.thumbnail((LOW_DETAIL_EDGE, LOW_DETAIL_EDGE), Image.LANCZOS)
+        buffered = BytesIO()
+        img.save(buffered, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+        photo["low_url"] = f"data:image/jpeg;base64,{base64.b64encode(buffered.getvalue()).decode('utf-8')}"
+    return photo["low_url"]
+
+
+def _decode(path):
+    """Decode one upload into upright PIL images; PDF photo reports give one image per page."""
+    if path.lower().endswith(".pdf"):
+        doc = fitz.open(path)
+        images = []
+        for i, page in enumerate(doc):
+            images.append((render_page(page, dpi=PDF_PHOTO_DPI, gray=False), i + 1))
+        return images
+    with Image.open(path) as img:
+        return [(ImageOps.exif_transpose(img), None)]
+
+
+def release_image(photo):
+    """Compute the metrics and the low-detail payload, then drop the decoded image; only those are reused."""
+    if "image" in photo:
+        photo_metrics(photo)
+        low_detail_url(photo)
+        del photo["image"]
+
+
+def _digest(path):
+    # Uploads are stored under their SHA-256; other files (EC photo pages) are hashed
+    name = os.path.splitext(os.path.basename(path))[0]
+    if BLOB_NAME.match(name):
+        return name
+    sha = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            sha.update(chunk)
+    return sha.hexdigest()
+
+
+def prepare_photo(path):
+    """Prepared (decoded, oriented, downscaled, JPEG-encoded) payloads of one upload, cached by content digest."""
+    key = _digest(path)
+    with _cache_lock:
+        if key in _photo_cache:
+            _photo_cache.move_to_end(key)
+            return _photo_cache[key]
+    try:
+        photos = [_encode(img, path, page) for img, page in _decode(path)]
+        # Finished before the payloads are cached: once shared between threads they are only read
+        for photo in photos:
+            release_image(photo)
+    except (UnidentifiedImageError, OSError, RuntimeError) as e:
+        logger.warning(f"Skipping unreadable photo {path}: {str(e)}")
+        photos = []
+    else:
+        logger.info(f"Prepared {path}: {len(photos)} image(s), {os.path.getsize(path)} -> "
+                    f"{sum(p['bytes'] for p in photos)} bytes")
+    with _cache_lock:
+        photos = _photo_cache.setdefault(key, photos)
+        _photo_cache.move_to_end(key)
+        while len(_photo_cache) > PHOTO_CACHE_SIZE:
+            _photo_cache.popitem(last=False)
+    return photos
+
+
+def photo_name(path):
+    """Client file name of an upload in the current job, or the file's own name."""
+    names = upload_names.get()
+    return names.get(_digest(path), os.path.basename(path)) if names else os.path.basename(path)
+
+
+def prepare_photos(paths):
+    """Prepared payloads of the uploads, each named after its client file name (view hints are read from it)."""
+    photos = []
+    for path in paths:
+        name = photo_name(path)
+        # Cached payloads are shared by jobs that uploaded the same content under other names
+        photos.extend(dict(photo, name=name) for photo in prepare_photo(path))
+    return photos
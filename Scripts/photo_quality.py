@@ -0,0 +1,74 @@
+import os
+import logging
+from photo_select import photo_metrics
+
+logger = logging.getLogger(__name__)
+
+# Local quality gate run on upload, before any vision call: rejected photos never reach the model,
+# flagged photos are still used but reported back with the upload.
+QUALITY_OK = "ok"
+QUALITY_FLAGGED = "flagged"
+QUALITY_REJECTED = "rejected"
+
+# Laplacian variance (on the 512px grayscale thumbnail) below which a photo is blurry / unusable
+MIN_SHARPNESS = float(os.getenv("PHOTO_MIN_SHARPNESS", "60"))
+REJECT_SHARPNESS = float(os.getenv("PHOTO_REJECT_SHARPNESS", "10"))
+# Mean brightness bounds (0-255) and share of clipped pixels
+DARK_MEAN, BRIGHT_MEAN = 45.0, 215.0
+REJECT_DARK_MEAN, REJECT_BRIGHT_MEAN = 20.0, 240.0
+MAX_CLIPPED = 0.35
+# Short side, in pixels of the original upload
+MIN_SHORT_SIDE = int(os.getenv("PHOTO_MIN_SHORT_SIDE", "480"))
+REJECT_SHORT_SIDE = int(os.getenv("PHOTO_REJECT_SHORT_SIDE", "200"))
+
+
+def assess_photo(photo):
+    """Quality verdict of one prepared photo: {"source", "page", "status", "issues", "metrics"}."""
+    metrics = photo_metrics(photo)
+    exposure = metrics["exposure"]
+    short_side = min(photo.get("original_size", photo["size"]))
+    rejected, flagged = [], []
+
+    if short_side < REJECT_SHORT_SIDE:
+        rejected.append(f"resolution too low ({short_side}px short side)")
+    elif short_side < MIN_SHORT_SIDE:
+        flagged.append(f"low resolution ({short_side}px short side)")
+
+    if metrics["sharpness"] < REJECT_SHARPNESS:
+        rejected.append(f"too blurry (sharpness {metrics['sharpness']:.0f})")
+    elif metrics["sharpness"] < MIN_SHARPNESS:
+        flagged.append(f"blurry (sharpness {metrics['sharpness']:.0f})")
+
+    if exposure["mean"] < REJECT_DARK_MEAN or exposure["mean"] > REJECT_BRIGHT_MEAN:
+        rejected.append(f"unusable exposure (mean brightness {exposure['mean']:.0f})")
+    elif exposure["mean"] < DARK_MEAN or exposure["dark"] > MAX_CLIPPED:
+        flagged.append(f"underexposed (mean brightness {exposure['mean']:.0f}, {exposure['dark']:.0%} near-black)")
+    elif exposure["mean"] > BRIGHT_MEAN or exposure["bright"] > MAX_CLIPPED:
+        flagged.append(f"overexposed (mean brightness {exposure['mean']:.0f}, {exposure['bright']:.0%} near-white)")
+
+    status = QUALITY_REJECTED if rejected else QUALITY_FLAGGED if flagged else QUALITY_OK
+    return {
+        "source": photo["source"],
+        "page": photo["page"],
+        "status": status,
+        "issues": rejected + flagged,
+        "metrics": {
+            "sharpness": round(metrics["sharpness"], 1),
+            "brightness": round(exposure["mean"], 1),
+            "width": photo.get("original_size", photo["size"])[0],
+            "height": photo.get("original_size", photo["size"])[1],
+        },
+    }
+
+
+def check_photo_quality(photos):
+    verdicts = [assess_photo(photo) for photo in photos]
+    for verdict in verdicts:
+        if verdict["status"] != QUALITY_OK:
+            logger.warning(f"{verdict['source']}: {verdict['status']} - {'; '.join(verdict['issues'])}")
+    return verdicts
+
+
+def usable_photos(photos):
+    """Prepared photos that passed the gate (flagged ones included)."""
+    return [photo for photo in photos if assess_photo(photo)["status"] != QUALITY_REJECTED]
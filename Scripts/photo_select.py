@@ -0,0 +1,153 @@
+import os
+import re
+import logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+# Local selection of the photos sent with each vision question: near-duplicates are dropped with a
+# perceptual hash, the rest ranked by view coverage, sharpness and exposure, and only the top K kept.
+PHOTO_TOP_K = int(os.getenv("PHOTO_TOP_K", "6"))
+# Hamming distance (out of 64 bits) under which two photos count as the same shot
+DUPLICATE_DISTANCE = int(os.getenv("PHOTO_DUPLICATE_DISTANCE", "8"))
+HASH_SIZE = 8
+# Side of the grayscale thumbnail used for the quality metrics
+METRIC_SIZE = 512
+
+# View hints read from file names (and page captions) -> views
+VIEW_HINTS = {
+    "front": ["front", "street", "facade"],
+    "back": ["back", "rear"],
+    "side": ["side", "left", "right"],
+    "foundation": ["foundation", "crawl", "pier", "pile", "basement", "slab", "vent", "stem"],
+    "roof": ["roof", "dormer", "attic"],
+}
+# Views every selection should cover when such photos exist
+CORE_VIEWS = ["front", "back", "foundation"]
+# Question wording -> views that answer it
+QUESTION_VIEWS = {
+    "foundation": ["foundation"], "crawl": ["foundation"], "pier": ["foundation"], "basement": ["foundation"],
+    "elevated": ["foundation"], "water": ["foundation", "front"], "dormer": ["roof"], "roof": ["roof"],
+    "addition": ["side", "back"], "floor": ["front", "side"],
+}
+
+
+def _gray(img, size=None):
+    gray = img.convert("L")
+    if size:
+        gray.thumbnail((size, size))
+    return np.asarray(gray, dtype=np.float64)
+
+
+def _dct_matrix(n):
+    k = np.arange(n)
+    matrix = np.cos(np.pi * (2 * k[None, :] + 1) * k[:, None] / (2 * n))
+    matrix[0] /= np.sqrt(2)
+    return matrix * np.sqrt(2 / n)
+
+
+_DCT32 = _dct_matrix(32)
+
+
+def phash(img):
+    """64-bit DCT perceptual hash as a boolean array."""
+    pixels = np.asarray(img.convert("L").resize((32, 32)), dtype=np.float64)
+    low = (_DCT32 @ pixels @ _DCT32.T)[:HASH_SIZE, :HASH_SIZE]
+    return (low > np.median(low)).flatten()
+
+
+def dhash(img):
+    """64-bit gradient hash; cheaper than phash, used as a tie-breaker."""
+    pixels = np.asarray(img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE)), dtype=np.int16)
+    return (pixels[:, 1:] > pixels[:, :-1]).flatten()
+
+
+def hamming(a, b):
+    return int(np.count_nonzero(a != b))
+
+
+def laplacian_variance(gray):
+    """Variance of the 4-neighbour Laplacian; low values mean a blurry photo."""
+    lap = (gray[:-2, 1:-1] + gray[2:, 1:-1] + gray[1:-1, :-2] + gray[1:-1, 2:] - 4 * gray[1:-1, 1:-1])
+    return float(lap.var())
+
+
+def exposure_stats(gray):
+    """Mean brightness and the shares of nearly black and nearly white pixels."""
+    hist = np.bincount(gray.astype(np.uint8).ravel(), minlength=256) / gray.size
+    return {
+        "mean": float(gray.mean()),
+        "dark": float(hist[:16].sum()),
+        "bright": float(hist[240:].sum()),
+    }
+
+
+def photo_views(photo):
+    name = (photo.get("name") or os.path.basename(photo["source"])).lower()
+    words = re.split(r"[^a-z]+", name)
+    return sorted(view for view, hints in VIEW_HINTS.items() if any(h in w for w in words for h in hints))
+
+
+def photo_metrics(photo):
+    """Hashes and quality metrics of a prepared photo, computed once and kept on the payload."""
+    if "metrics" not in photo:
+        gray = _gray(photo["image"], METRIC_SIZE)
+        exposure = exposure_stats(gray)
+        sharpness = laplacian_variance(gray)
+        # 1.0 for mid-grey exposure with no clipping, falling to 0 for black or blown-out frames
+        exposure_score = max(0.0, 1 - abs(exposure["mean"] - 128) / 128 - exposure["dark"] - exposure["bright"])
+        photo["metrics"] = {
+            "phash": phash(photo["image"]),
+            "dhash": dhash(photo["image"]),
+            "sharpness": sharpness,
+            "exposure": exposure,
+            "score": min(sharpness / 500, 1.0) * 0.6 + exposure_score * 0.4,
+        }
+    return photo["metrics"]
+
+
+def dedupe_photos(photos, max_distance=None):
+    """Keep the best-scoring photo of every group of near-duplicates, in their original order."""
+    max_distance = DUPLICATE_DISTANCE if max_distance is None else max_distance
+    ranked = sorted(photos, key=lambda p: photo_metrics(p)["score"], reverse=True)
+    kept = []
+    for photo in ranked:
+        m = photo_metrics(photo)
+        if any(hamming(m["phash"], photo_metrics(k)["phash"]) <= max_distance
+               and hamming(m["dhash"], photo_metrics(k)["dhash"]) <= 2 * max_distance for k in kept):
+            continue
+        kept.append(photo)
+    return [p for p in photos if any(p is k for k in kept)]
+
+
+def _wanted_views(questions):
+    text = " ".join(questions).lower()
+    views = []
+    for word, question_views in QUESTION_VIEWS.items():
+        if word in text:
+            views.extend(v for v in question_views if v not in views)
+    return views + [v for v in CORE_VIEWS if v not in views]
+
+
+def select_photos(photos, questions, k=None):
+    """
+    Near-duplicate-free top-K photos for a question block: first the best photo of each view
+    the questions (and the core front/back/foundation set) call for, then the highest scores.
+    """
+    k = PHOTO_TOP_K if k is None else k
+    unique = dedupe_photos(photos)
+    if k <= 0 or len(unique) <= k:
+        selected = unique
+    else:
+        ranked = sorted(unique, key=lambda p: photo_metrics(p)["score"], reverse=True)
+        selected = []
+        for view in _wanted_views(questions):
+            for photo in ranked:
+                if view in photo_views(photo) and not any(photo is s for s in selected):
+                    selected.append(photo)
+                    break
+            if len(selected) >= k:
+                break
+        selected += [p for p in ranked if not any(p is s for s in selected)][:k - len(selected)]
+    logger.info(f"Selected {len(selected)} of {len(photos)} photos ({len(photos) - len(unique)} near-duplicates)")
+    return selected
@@ -0,0 +1,174 @@
+import os
+import re
+import base64
+import logging
+from io import BytesIO
+import fitz  # PyMuPDF
+import openai
+from PIL import Image
+from page_render import render_page
+from model_router import route, ELEVATION_RANGE
+from llm_calls import chat_completion, TRANSIENT_ERRORS
+from tenacity import retry, retry_if_exception_type, stop_after_attempt, wait_exponential, RetryError
+
+logger = logging.getLogger(__name__)
+
+# Critical extracted variables re-read from their form region when missing or implausible:
+# variable -> (template item, EC section, printed label, value kind)
+CRITICAL_FIELDS = {
+    "diagramNumber_pdf": ("A7", "a", "A7. Building Diagram Number", "diagram"),
+    "flood_zone_pdf": ("B8", "b", "B8. Flood Zone(s)", "zone"),
+    "top_of_bottom_floor_pdf": ("C2.a", "c", "C2.a Top of bottom floor (including basement, crawlspace, or enclosure floor)", "elevation"),
+    "top_of_next_higher_floor_pdf": ("C2.b", "c", "C2.b Top of the next higher floor", "elevation"),
+    "LAG_pdf": ("C2.f", "c", "C2.f Lowest adjacent (finished) grade next to building (LAG)", "elevation"),
+    "HAG_pdf": ("C2.g", "c", "C2.g Highest adjacent (finished) grade next to building (HAG)", "elevation"),
+}
+
+# Approximate item positions on the FEMA EC pages as fractions of the page (x0, y0, x1, y1),
+# used when the page had no text layer and so no anchored region was recorded
+FALLBACK_REGIONS = {
+    "A7": (0.0, 0.42, 1.0, 0.62),
+    "B8": (0.0, 0.68, 1.0, 0.86),
+    "C2.a": (0.0, 0.22, 1.0, 0.40),
+    "C2.b": (0.0, 0.25, 1.0, 0.43),
+    "C2.f": (0.0, 0.32, 1.0, 0.50),
+    "C2.g": (0.0, 0.34, 1.0, 0.52),
+}
+
+VALID_DIAGRAMS = {"1", "1a", "1b", "2", "2a", "2b", "3", "4", "5", "6", "7", "8", "9"}
+VALID_ZONE = re.compile(r"^(a|ae|ah|ao|ar|a99|a\d{1,2}|v|ve|v\d{1,2}|d|b|c|x)$")
+CROP_DPI = 200
+# Margin (in PDF points) added around an anchored value region so the crop shows the printed label too
+LABEL_MARGIN = 250
+
+
+def _normalize(value):
+    return re.sub(r"[^a-zA-Z0-9]", "", str(value or "")).lower()
+
+
+def is_plausible(kind, value):
+    if kind == "diagram":
+        return _normalize(value) in VALID_DIAGRAMS
+    if kind == "zone":
+        return bool(VALID_ZONE.match(_normalize(value)))
+    if kind == "elevation":
+        # None is a missing value; 0.0 is a genuine elevation (at the datum)
+        return isinstance(value, (int, float)) and ELEVATION_RANGE[0] < value < ELEVATION_RANGE[1]
+    return bool(value)
+
+
+def parse_answer(kind, answer):
+    answer = answer.strip().strip('"').strip("'")
+    if kind == "diagram":
+        match = re.search(r"\b([1-9][ABab]?)\b", answer)
+        return match.group(1).lower() if match else ""
+    if kind == "zone":
+        return _normalize(answer)
+    if kind == "elevation":
+        match = re.search(r"-?\d+(\.\d+)?", answer)
+        return float(match.group()) if match else None
+    return answer
+
+
+def _page_image(meta, page_key, clip=None):
+    """Cached render of the page (cropped to clip, in PDF points) or a fresh render of just the clip."""
+    page_meta = meta["pages"][page_key]
+    render = page_meta.get("render")
+    if render and os.path.exists(render):
+        img = Image.open(render)
+        if clip is None:
+            return img
+        scale = page_meta.get("dpi", 300) / 72
+        return img.crop(tuple(int(v * scale) for v in clip))
+    doc = fitz.open(meta["pdf_path"])
+    page = doc[int(page_key.split("_")[1]) - 1]
+    return render_page(page, dpi=CROP_DPI, clip=fitz.Rect(clip) if clip else None, gray=False)
+
+
+def crop_field(meta, item, section):
+    """Crop the form region of one template item; returns a PIL image or None."""
+    pages = meta.get("pages", {})
+    for page_key, page_meta in pages.items():
+        bbox = page_meta.get("regions", {}).get(item)
+        if bbox:
+            x0, y0, x1, y1 = bbox
+            clip = (max(0.0, x0 - LABEL_MARGIN), max(0.0, y0 - 6), x1, y1 + 6)
+            return _page_image(meta, page_key, clip)
+
+    fraction = FALLBACK_REGIONS.get(item)
+    for page_key, page_meta in pages.items():
+        if fraction and page_meta.get("label") == "data" and section in page_meta.get("sections", []):
+            img = _page_image(meta, page_key)
+            width, height = img.size
+            return img.crop((int(fraction[0] * width), int(fraction[1] * height),
+                             int(fraction[2] * width), int(fraction[3] * height)))
+    return None
+
+
+@retry(retry=retry_if_exception_type(TRANSIENT_ERRORS), stop=stop_after_attempt(3), wait=wait_exponential(multiplier=1, min=4, max=10))
+def ask_field_value(crop, label, model="gpt-4o"):
+    buffered = BytesIO()
+    crop.save(buffered, format="PNG")
+    image_base64 = base64.b64encode(buffered.getvalue()).decode("utf-8")
+    openai.api_key = os.getenv("OPENAI_API_KEY")
+    response = chat_completion(
+        model=model,
+        messages=[
+            {
+                "role": "user",
+                "content": [
+                    {
+                        "type": "text",
+                        "text": f"This image is a crop of a FEMA Elevation Certificate around item '{label}'. Reply with only the value entered for that item, without units or explanation. Reply with an empty string if the item is blank."
+                    },
+                    {
+                        "type": "image_url",
+                        "image_url": {"url": f"data:image/png;base64,{image_base64}", "detail": "high"}
+                    }
+                ]
+            }
+        ],
+        max_tokens=20,
+        temperature=0.0
+    )
+    return response.choices[0].message.content.strip()
+
+
+def refine_critical_fields(extracted_vars, meta):
+    """
+    Second pass after extract_essential_variables: re-read missing or implausible critical fields
+    from a crop of their form region instead of re-running the whole EC extraction.
+    Updates extracted_vars in place and returns a report of the fields that were retried.
+    """
+    report = []
+    if not meta or not meta.get("pages"):
+        return report
+
+    # Elevations the EC left blank; extract_float_value reads them as 0.0
+    missing = set(extracted_vars.get("missing_pdf_fields", []))
+    for name, (item, section, label, kind) in CRITICAL_FIELDS.items():
+        before = None if name in missing else extracted_vars.get(name)
+        if is_plausible(kind, before):
+            continue
+        crop = crop_field(meta, item, section)
+        if crop is None:
+            report.append({"field": name, "item": item, "before": before, "status": "no region"})
+            continue
+        try:
+            answer = route(
+                "field_crop",
+                lambda model: ask_field_value(crop, label, model),
+                lambda reply: is_plausible(kind, parse_answer(kind, reply))
+            )
+            after = parse_answer(kind, answer)
+        except Exception as e:
+            cause = e.last_attempt.exception() if isinstance(e, RetryError) else e
+            logger.error(f"{item}: field re-extraction failed: {cause}")
+            report.append({"field": name, "item": item, "before": before, "status": "failed"})
+            continue
+        if is_plausible(kind, after):
+            extracted_vars[name] = after
+            report.append({"field": name, "item": item, "before": before, "after": after, "status": "filled"})
+        else:
+            report.append({"field": name, "item": item, "before": before, "after": after, "status": "unresolved"})
+    return report
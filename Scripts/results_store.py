@@ -0,0 +1,216 @@
+import os
+import re
+import json
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+# Persistent store of validation outcomes: one row per submission (summary, extracted variables, input
+# digests, rule input fingerprints) and one row per rule result, indexed on rule, status and date for
+# reporting queries.
+# The database is a SQLite file (RESULTS_DB, set per deployment) and must live on the local disk of a single
+# host: SQLite locking is not safe on network file systems, and it is not mirrored to the storage backend.
+# Multi-node deployments run /process and the /results endpoints on that host, or give each node its own
+# RESULTS_DB and report per node.
+RESULTS_DB = os.getenv("RESULTS_DB", os.path.join("JSONs", "results.db"))
+STATUS_NAMES = {"✅": "pass", "❌": "fail", "⚠️": "warning"}
+MAX_QUERY_ROWS = 1000
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS submissions (
+    job_id TEXT PRIMARY KEY,
+    evaluated_at TEXT NOT NULL,
+    overall_status TEXT,
+    total_rules INTEGER,
+    failed_rules INTEGER,
+    warning_rules INTEGER,
+    summary TEXT,
+    variables TEXT,
+    inputs TEXT,
+    fingerprints TEXT
+);
+CREATE TABLE IF NOT EXISTS rule_results (
+    job_id TEXT NOT NULL REFERENCES submissions (job_id) ON DELETE CASCADE,
+    rule_key TEXT NOT NULL,
+    rule TEXT,
+    status TEXT,
+    details TEXT,
+    evaluated_at TEXT NOT NULL,
+    PRIMARY KEY (job_id, rule_key)
+);
+CREATE INDEX IF NOT EXISTS idx_rule_results_rule ON rule_results (rule_key, status, evaluated_at);
+CREATE INDEX IF NOT EXISTS idx_rule_results_status ON rule_results (status, evaluated_at);
+CREATE INDEX IF NOT EXISTS idx_rule_results_date ON rule_results (evaluated_at);
+CREATE INDEX IF NOT EXISTS idx_submissions_date ON submissions (evaluated_at);
+CREATE INDEX IF NOT EXISTS idx_submissions_status ON submissions (overall_status, evaluated_at);
+"""
+
+_initialized = set()
+_init_lock = threading.Lock()
+
+
+@contextmanager
+def connect(db_path=None):
+    db_path = db_path or RESULTS_DB
+    os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+    conn = sqlite3.connect(db_path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA foreign_keys = ON")
+    try:
+        with _init_lock:
+            if db_path not in _initialized:
+                # WAL lets the query endpoints read while a submission is being written
+                conn.execute("PRAGMA journal_mode = WAL")
+                conn.executescript(SCHEMA)
+                _initialized.add(db_path)
+        with conn:
+            yield conn
+    finally:
+        conn.close()
+
+
+def status_name(status):
+    return STATUS_NAMES.get(status, status)
+
+
+def rule_key(rule):
+    """"7", "rule_7" and "Rule 7" all name rule_7; other keys (form_validation) are kept."""
+    match = re.fullmatch(r"(?:rule[_ ]?)?(\d+)", str(rule).strip(), re.IGNORECASE)
+    return f"rule_{match.group(1)}" if match else str(rule).strip()
+
+
+def _rule_entries(results):
+    return {k: v for k, v in results.items() if isinstance(v, dict) and "status" in v and "rule" in v}
+
+
+def save_submission(job_id, results, inputs=None, db_path=None):
+    """Store (or replace) the outcome of run_all_comparisons for a job; inputs are e.g. its upload digests."""
+    evaluated_at = time.strftime("%Y-%m-%dT%H:%M:%S")
+    summary = results.get("summary", {})
+    rules = _rule_entries(results)
+    with connect(db_path) as conn:
+        conn.execute("DELETE FROM submissions WHERE job_id = ?", (job_id,))
+        conn.execute(
+            "INSERT INTO submissions (job_id, evaluated_at, overall_status, total_rules, failed_rules, warning_rules, "
+            "summary, variables, inputs, fingerprints) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+            (
+                job_id, evaluated_at, status_name(summary.get("overall_status")),
+                summary.get("total_rules"), summary.get("failed_rules"), summary.get("warning_rules"),
+                json.dumps(summary, ensure_ascii=False, default=str),
+                json.dumps(results.get("extracted_variables", {}), ensure_ascii=False, default=str),
+                json.dumps(inputs or {}, ensure_ascii=False),
+                json.dumps(results.get("fingerprints", {})),
+            ),
+        )
+        conn.executemany(
+            "INSERT INTO rule_results VALUES (?, ?, ?, ?, ?, ?)",
+            [
+                (job_id, key, r["rule"], status_name(r["status"]), json.dumps(r.get("details"), ensure_ascii=False, default=str), evaluated_at)
+                for key, r in rules.items()
+            ],
+        )
+    return evaluated_at
+
+
+def get_submission(job_id, db_path=None):
+    """Stored summary, variables, inputs and rule results of a job, or None."""
+    with connect(db_path) as conn:
+        row = conn.execute("SELECT * FROM submissions WHERE job_id = ?", (job_id,)).fetchone()
+        if row is None:
+            return None
+        rules = conn.execute("SELECT * FROM rule_results WHERE job_id = ? ORDER BY rule_key", (job_id,)).fetchall()
+    return {
+        "job_id": job_id,
+        "evaluated_at": row["evaluated_at"],
+        "overall_status": row["overall_status"],
+        "summary": json.loads(row["summary"]),
+        "extracted_variables": json.loads(row["variables"]),
+        "inputs": json.loads(row["inputs"]),
+        "fingerprints": json.loads(row["fingerprints"] or "{}"),
+        "rules": {
+            r["rule_key"]: {"rule": r["rule"], "status": r["status"], "details": json.loads(r["details"])} for r in rules
+        },
+    }
+
+
+def previous_results(job_id, db_path=None):
+    """Stored outcome of a job in the shape run_all_comparisons returns, for incremental re-validation."""
+    submission = get_submission(job_id, db_path)
+    if submission is None:
+        return None
+    glyphs = {name: glyph for glyph, name in STATUS_NAMES.items()}
+    previous = {key: dict(r, status=glyphs.get(r["status"], r["status"])) for key, r in submission["rules"].items()}
+    previous["summary"] = submission["summary"]
+    previous["fingerprints"] = submission["fingerprints"]
+    return previous
+
+
+def _filters(rule=None, status=None, since=None, until=None):
+    clauses, params = [], []
+    if rule:
+        clauses.append("rule_key = ?")
+        params.append(rule_key(rule))
+    if status:
+        clauses.append("status = ?")
+        params.append(status_name(status).lower())
+    if since:
+        clauses.append("evaluated_at >= ?")
+        params.append(since)
+    if until:
+        # A bare date includes the whole day
+        clauses.append("evaluated_at <= ?")
+        params.append(until + "T23:59:59" if len(until) == 10 else until)
+    return (" WHERE " + " AND ".join(clauses)) if clauses else "", params
+
+
+def query_rule_results(rule=None, status=None, since=None, until=None, limit=100, offset=0, db_path=None):
+    """Rule results filtered on rule, status and evaluation date range (ISO dates), newest first."""
+    where, params = _filters(rule, status, since, until)
+    limit = max(1, min(int(limit), MAX_QUERY_ROWS))
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT job_id, rule_key, rule, status, details, evaluated_at FROM rule_results{where} "
+            "ORDER BY evaluated_at DESC, job_id LIMIT ? OFFSET ?",
+            params + [limit, int(offset)],
+        ).fetchall()
+    return [dict(r, details=json.loads(r["details"])) for r in rows]
+
+
+def rule_statistics(since=None, until=None, db_path=None):
+    """Per rule: count of results per status in the date range."""
+    where, params = _filters(since=since, until=until)
+    with connect(db_path) as conn:
+        rows = conn.execute(
+            f"SELECT rule_key, rule, status, COUNT(*) AS n FROM rule_results{where} GROUP BY rule_key, status",
+            params,
+        ).fetchall()
+    stats = {}
+    for r in rows:
+        entry = stats.setdefault(r["rule_key"], {"rule": r["rule"], "total": 0})
+        entry[r["status"]] = r["n"]
+        entry["total"] += r["n"]
+    return stats
+
+
+def load_book(since=None, until=None, db_path=None):
+    """
+    Every stored submission evaluated in the date range, for re-scoring.
+
+    Returns:
+        list: {"job_id", "variables", "statuses"} per submission, statuses being the stored rule statuses as glyphs.
+    """
+    where, params = _filters(since=since, until=until)
+    glyphs = {name: glyph for glyph, name in STATUS_NAMES.items()}
+    with connect(db_path) as conn:
+        rows = conn.execute(f"SELECT job_id, variables FROM submissions{where} ORDER BY job_id", params).fetchall()
+        statuses = {}
+        for r in conn.execute(
+            f"SELECT job_id, rule_key, status FROM rule_results WHERE job_id IN (SELECT job_id FROM submissions{where})",
+            params,
+        ):
+            statuses.setdefault(r["job_id"], {})[r["rule_key"]] = glyphs.get(r["status"], r["status"])
+    return [
+        {"job_id": r["job_id"], "variables": json.loads(r["variables"] or "{}"), "statuses": statuses.get(r["job_id"], {})}
+        for r in rows
+    ]
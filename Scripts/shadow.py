@@ -0,0 +1,189 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from llm_calls import measure_usage
+
+logger = logging.getLogger(__name__)
+
+# Shadow evaluation: a sample of production calls is mirrored in the background to a candidate
+# configuration, and fields, rule verdicts, latency and token use are compared with the primary one.
+SAMPLE_RATE = float(os.getenv("SHADOW_SAMPLE_RATE", "0"))
+CANDIDATE_MODEL = os.getenv("SHADOW_MODEL", "gpt-4o-mini")
+CANDIDATE_IMAGE_DETAIL = os.getenv("SHADOW_IMAGE_DETAIL", "low")
+CANDIDATE_EC_DPI = int(os.getenv("SHADOW_EC_DPI", "200"))
+REPORT_PATH = os.getenv("SHADOW_REPORT_PATH", os.path.join("JSONs", "shadow_report.jsonl"))
+SHADOW_DIR = os.path.join("JSONs", "shadow")
+# Mismatching fields listed per EC comparison
+MAX_LISTED_MISMATCHES = 20
+# Image rules are not re-run for the verdict comparison (their answers are compared per question)
+IMAGE_RULES = {f"rule_{n}" for n in range(12, 25)}
+# Candidate extractions remembered for the verdict comparison of their job, oldest dropped first
+MAX_SHADOW_ECS = int(os.getenv("SHADOW_MAX_ECS", "64"))
+
+_executor = ThreadPoolExecutor(max_workers=int(os.getenv("SHADOW_WORKERS", "2")), thread_name_prefix="shadow")
+_lock = threading.Lock()
+# primary EC JSON path -> candidate EC JSON path
+_shadow_EC = OrderedDict()
+
+
+def sampled():
+    return SAMPLE_RATE > 0 and random.random() < SAMPLE_RATE
+
+
+def candidate_config():
+    return {"model": CANDIDATE_MODEL, "image_detail": CANDIDATE_IMAGE_DETAIL, "ec_dpi": CANDIDATE_EC_DPI}
+
+
+def record(entry):
+    entry = dict(entry, timestamp=time.strftime("%Y-%m-%dT%H:%M:%S"), config=candidate_config())
+    os.makedirs(os.path.dirname(REPORT_PATH) or ".", exist_ok=True)
+    with _lock:
+        with open(REPORT_PATH, "a", encoding="utf-8") as f:
+            f.write(json.dumps(entry, ensure_ascii=False, default=str) + "\n")
+
+
+def _normalize(value):
+    return re.sub(r"[^a-z0-9.\-]", "", str(value).lower())
+
+
+def _flatten(data, prefix=""):
+    flat = {}
+    items = data.items() if isinstance(data, dict) else enumerate(data) if isinstance(data, list) else []
+    for key, value in items:
+        path = f"{prefix}/{key}" if prefix else str(key)
+        if isinstance(value, (dict, list)):
+            flat.update(_flatten(value, path))
+        else:
+            flat[path.lower()] = _normalize(value)
+    return flat
+
+
+def compare_fields(primary, candidate):
+    """Field-by-field agreement of two extractions, keyed on the primary's fields."""
+    primary, candidate = _flatten(primary), _flatten(candidate)
+    mismatched = [key for key, value in primary.items() if key in candidate and candidate[key] != value]
+    missing = [key for key in primary if key not in candidate]
+    matched = len(primary) - len(mismatched) - len(missing)
+    return {
+        "fields": len(primary),
+        "matched": matched,
+        "agreement": round(matched / len(primary), 3) if primary else None,
+        "missing": len(missing),
+        "mismatched": mismatched[:MAX_LISTED_MISMATCHES],
+    }
+
+
+def _deltas(primary_usage, candidate_usage):
+    """Candidate minus primary: negative values are savings."""
+    return {
+        "latency_delta_s": round(candidate_usage["seconds"] - primary_usage["seconds"], 3),
+        "prompt_tokens_delta": candidate_usage["prompt_tokens"] - primary_usage["prompt_tokens"],
+        "completion_tokens_delta": candidate_usage["completion_tokens"] - primary_usage["completion_tokens"],
+    }
+
+
+def shadow_EC(process_EC, pdf_path, json_path, primary_usage, shadow_dir=None):
+    """Re-extract an EC with the candidate configuration in the background and compare the fields."""
+    def run():
+        try:
+            with measure_usage() as usage:
+                shadow_path = process_EC(pdf_path, output_dir=shadow_dir or SHADOW_DIR, dpi=CANDIDATE_EC_DPI, model=CANDIDATE_MODEL)
+            with open(json_path, encoding="utf-8") as f:
+                primary = json.load(f)
+            with open(shadow_path, encoding="utf-8") as f:
+                candidate = json.load(f)
+            with _lock:
+                _shadow_EC[json_path] = shadow_path
+                _shadow_EC.move_to_end(json_path)
+                while len(_shadow_EC) > MAX_SHADOW_ECS:
+                    _shadow_EC.popitem(last=False)
+            record(dict({"kind": "ec", "pdf": pdf_path, "fields": compare_fields(primary, candidate),
+                         "primary": primary_usage, "candidate": usage}, **_deltas(primary_usage, usage)))
+        except Exception as e:
+            logger.error(f"Shadow EC extraction failed for {pdf_path}: {str(e)}")
+            record({"kind": "ec", "pdf": pdf_path, "error": str(e)})
+    return _executor.submit(run)
+
+
+def shadow_verdicts(run_all_comparisons, load_EC_meta, json_path, data_app, primary_results):
+    """Run the document rules on the candidate EC extraction of json_path (if one exists) and compare verdicts."""
+    with _lock:
+        shadow_path = _shadow_EC.get(json_path)
+    if not shadow_path:
+        return None
+
+    def run():
+        try:
+            with open(shadow_path, encoding="utf-8") as f:
+                candidate_pdf = json.load(f)
+            # No field re-extraction: it makes paid calls, and the comparison is of the candidate extraction as is
+            candidate_results = run_all_comparisons(candidate_pdf, data_app, [], load_EC_meta(shadow_path), refine=False)
+            disagreements = []
+            compared = 0
+            for key, result in primary_results.items():
+                if not isinstance(result, dict) or "status" not in result or key in IMAGE_RULES:
+                    continue
+                candidate = candidate_results.get(key, {})
+                compared += 1
+                if candidate.get("status") != result["status"]:
+                    disagreements.append({"rule": result.get("rule", key), "primary": result["status"], "candidate": candidate.get("status")})
+            record({"kind": "verdicts", "ec": json_path, "rules": compared,
+                    "agreement": round(1 - len(disagreements) / compared, 3) if compared else None,
+                    "disagreements": disagreements})
+        except Exception as e:
+            logger.error(f"Shadow verdict comparison failed for {json_path}: {str(e)}")
+            record({"kind": "verdicts", "ec": json_path, "error": str(e)})
+    return _executor.submit(run)
+
+
+def shadow_image_question(ask_candidate, primary_answer, primary_usage, rule):
+    """Ask an image question again with ask_candidate(model, detail) in the background and compare answers."""
+    def run():
+        try:
+            with measure_usage() as usage:
+                answer = ask_candidate(CANDIDATE_MODEL, CANDIDATE_IMAGE_DETAIL)
+            record(dict({"kind": "image", "rule": rule, "agree": _normalize(answer) == _normalize(primary_answer),
+                         "primary_answer": primary_answer, "candidate_answer": answer,
+                         "primary": primary_usage, "candidate": usage}, **_deltas(primary_usage, usage)))
+        except Exception as e:
+            logger.error(f"Shadow image question failed for {rule}: {str(e)}")
+            record({"kind": "image", "rule": rule, "error": str(e)})
+    return _executor.submit(run)
+
+
+def _mean(values):
+    values = [v for v in values if v is not None]
+    return round(sum(values) / len(values), 3) if values else None
+
+
+def shadow_report(limit=50):
+    """Aggregate of the shadow report per kind of comparison, plus the latest entries."""
+    entries = []
+    if os.path.exists(REPORT_PATH):
+        with open(REPORT_PATH, encoding="utf-8") as f:
+            entries = [json.loads(line) for line in f if line.strip()]
+
+    summary = {}
+    for kind in ("ec", "verdicts", "image"):
+        done = [e for e in entries if e["kind"] == kind and "error" not in e]
+        if kind == "ec":
+            agreement = [e["fields"]["agreement"] for e in done]
+        elif kind == "verdicts":
+            agreement = [e["agreement"] for e in done]
+        else:
+            agreement = [1.0 if e["agree"] else 0.0 for e in done]
+        summary[kind] = {
+            "comparisons": len(done),
+            "errors": len([e for e in entries if e["kind"] == kind and "error" in e]),
+            "mean_agreement": _mean(agreement),
+            "mean_latency_delta_s": _mean([e.get("latency_delta_s") for e in done]),
+            "mean_prompt_tokens_delta": _mean([e.get("prompt_tokens_delta") for e in done]),
+            "mean_completion_tokens_delta": _mean([e.get("completion_tokens_delta") for e in done]),
+        }
+    return {"sample_rate": SAMPLE_RATE, "candidate": candidate_config(), "summary": summary, "recent": entries[-limit:]}
@@ -0,0 +1,68 @@
+import os
+import logging
+import threading
+import contextvars
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from photo_prep import photo_name
+
+logger = logging.getLogger(__name__)
+
+# Background execution of the rules that depend only on the photos. They start as soon as the photos
+# are uploaded, in parallel with EC / application extraction, and the comparison step collects the answers.
+MAX_WORKERS = int(os.getenv("SPECULATIVE_WORKERS", "4"))
+# Seconds the comparison step waits for a rule still running before asking again itself
+WAIT_SECONDS = float(os.getenv("SPECULATIVE_WAIT_SECONDS", "120"))
+# Photo sets whose answers are kept
+MAX_PHOTO_SETS = 8
+
+_executor = ThreadPoolExecutor(max_workers=MAX_WORKERS, thread_name_prefix="speculative")
+# photo-set fingerprint -> {rule key: Future}
+_runs = OrderedDict()
+_lock = threading.Lock()
+
+
+def photo_set_key(image_paths):
+    """Fingerprint of a photo set; a re-uploaded (changed) file gives a new key."""
+    key = []
+    for path in sorted(image_paths):
+        stat = os.stat(path)
+        # The client file names steer the view hints, so the same content under other names is another set
+        key.append((os.path.abspath(path), stat.st_mtime, stat.st_size, photo_name(path)))
+    return tuple(key)
+
+
+def start_rules(image_paths, rules):
+    """Submit rule_fn(image_paths) for every {rule key: rule_fn} not already running for this photo set."""
+    key = photo_set_key(image_paths)
+    with _lock:
+        futures = _runs.setdefault(key, {})
+        _runs.move_to_end(key)
+        for rule_key, rule_fn in rules.items():
+            if rule_key not in futures:
+                # The context carries the job's upload names to the rule
+                futures[rule_key] = _executor.submit(contextvars.copy_context().run, rule_fn, list(image_paths))
+        while len(_runs) > MAX_PHOTO_SETS:
+            _runs.popitem(last=False)
+    logger.info(f"Speculative photo rules started: {', '.join(rules)}")
+    return list(futures)
+
+
+def collect(image_paths, rule_key):
+    """
+    Precomputed result of a rule for this photo set, or None if it was never started or is still
+    running after WAIT_SECONDS. Exceptions raised by the rule are re-raised to the caller.
+    """
+    try:
+        key = photo_set_key(image_paths)
+    except OSError:
+        return None
+    with _lock:
+        future = _runs.get(key, {}).get(rule_key)
+    if future is None:
+        return None
+    try:
+        return future.result(timeout=WAIT_SECONDS)
+    except TimeoutError:
+        logger.warning(f"{rule_key}: speculative run still pending after {WAIT_SECONDS:.0f}s, running inline.")
+        return None
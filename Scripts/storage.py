@@ -0,0 +1,314 @@
+import os
+import io
+import shutil
+import threading
+
+try:
+    import boto3
+    from boto3.s3.transfer import TransferConfig
+except ImportError:  # Only needed for STORAGE_BACKEND=s3 against a real endpoint
+    boto3 = None
+    TransferConfig = None
+
+# Storage backend shared by the web and worker nodes. Files keep their working-directory layout
+# (blobs/..., jobs/<job_id>/...) and the relative path is the object key, so every node can rebuild
+# its local working copy from the backend. "local" is a directory (the working directory itself by
+# default, i.e. no copies); "s3" is any S3-compatible object store, with multipart transfers.
+STORAGE_BACKEND = os.getenv("STORAGE_BACKEND", "local").lower()
+STORAGE_ROOT = os.getenv("STORAGE_ROOT", ".")
+S3_BUCKET = os.getenv("S3_BUCKET", "")
+S3_PREFIX = os.getenv("S3_PREFIX", "")
+# S3-compatible endpoint (e.g. MinIO); "memory://" uses the in-process stand-in
+S3_ENDPOINT_URL = os.getenv("S3_ENDPOINT_URL") or None
+MULTIPART_THRESHOLD = int(os.getenv("S3_MULTIPART_THRESHOLD", str(8 * 1024 * 1024)))
+MULTIPART_CHUNKSIZE = int(os.getenv("S3_MULTIPART_CHUNKSIZE", str(8 * 1024 * 1024)))
+MAX_CONCURRENCY = int(os.getenv("S3_MAX_CONCURRENCY", "4"))
+
+
+def _key(path):
+    return os.path.relpath(path).replace(os.sep, "/")
+
+
+def _part(path):
+    # Written aside per thread and renamed, so readers and concurrent fetches never see half a file
+    return f"{path}.part{threading.get_ident()}"
+
+
+class LocalStorage:
+    """Files under a root directory; with the working directory as root, local paths already are the store."""
+
+    def __init__(self, root="."):
+        self.root = root
+
+    def _path(self, key):
+        return os.path.join(self.root, *key.split("/"))
+
+    def is_working_copy(self):
+        return os.path.realpath(self.root) == os.path.realpath(".")
+
+    def put_stream(self, key, stream):
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        with open(_part(path), "wb") as f:
+            shutil.copyfileobj(stream, f, MULTIPART_CHUNKSIZE)
+        os.replace(_part(path), path)
+
+    def get_stream(self, key, stream):
+        with open(self._path(key), "rb") as f:
+            shutil.copyfileobj(f, stream, MULTIPART_CHUNKSIZE)
+
+    def put_file(self, key, local_path):
+        if os.path.realpath(self._path(key)) == os.path.realpath(local_path):
+            return
+        with open(local_path, "rb") as f:
+            self.put_stream(key, f)
+
+    def get_file(self, key, local_path):
+        if os.path.realpath(self._path(key)) == os.path.realpath(local_path):
+            return
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        with open(_part(local_path), "wb") as f:
+            self.get_stream(key, f)
+        os.replace(_part(local_path), local_path)
+
+    def exists(self, key):
+        return os.path.isfile(self._path(key))
+
+    def delete(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def list(self, prefix):
+        base = self._path(prefix.rstrip("/"))
+        for folder, _, names in os.walk(base):
+            for name in names:
+                yield os.path.relpath(os.path.join(folder, name), self.root).replace(os.sep, "/")
+
+
+class S3Storage:
+    """Objects in an S3-compatible bucket under an optional prefix; transfers are streamed and multipart."""
+
+    def __init__(self, bucket, prefix="", client=None, endpoint_url=None):
+        if client is None:
+            if boto3 is None:
+                raise ImportError("boto3 is required for the S3 storage backend.")
+            client = boto3.client("s3", endpoint_url=endpoint_url)
+        self.client = client
+        self.bucket = bucket
+        self.prefix = prefix.strip("/") + "/" if prefix.strip("/") else ""
+        # Files above the threshold go up and down in parts, several at a time
+        self.config = TransferConfig(
+            multipart_threshold=MULTIPART_THRESHOLD, multipart_chunksize=MULTIPART_CHUNKSIZE, max_concurrency=MAX_CONCURRENCY
+        ) if TransferConfig else None
+
+    def is_working_copy(self):
+        return False
+
+    def _transfer_args(self):
+        return {"Config": self.config} if self.config else {}
+
+    def put_stream(self, key, stream):
+        self.client.upload_fileobj(stream, self.bucket, self.prefix + key, **self._transfer_args())
+
+    def get_stream(self, key, stream):
+        self.client.download_fileobj(self.bucket, self.prefix + key, stream, **self._transfer_args())
+
+    def put_file(self, key, local_path):
+        with open(local_path, "rb") as f:
+            self.put_stream(key, f)
+
+    def get_file(self, key, local_path):
+        os.makedirs(os.path.dirname(local_path) or ".", exist_ok=True)
+        with open(_part(local_path), "wb") as f:
+            self.get_stream(key, f)
+        os.replace(_part(local_path), local_path)
+
+    def exists(self, key):
+        try:
+            self.client.head_object(Bucket=self.bucket, Key=self.prefix + key)
+            return True
+        except Exception as e:
+            if _is_missing(e):
+                return False
+            raise
+
+    def delete(self, key):
+        self.client.delete_object(Bucket=self.bucket, Key=self.prefix + key)
+
+    def list(self, prefix):
+        paginator = self.client.get_paginator("list_objects_v2")
+        for page in paginator.paginate(Bucket=self.bucket, Prefix=self.prefix + prefix):
+            for item in page.get("Contents", []):
+                yield item["Key"][len(self.prefix):]
+
+
+def _is_missing(error):
+    code = str(getattr(error, "response", {}).get("Error", {}).get("Code", ""))
+    return code in ("404", "NoSuchKey", "NotFound")
+
+
+# ---------------------------------------------------------------------------
+# In-process stand-in for the subset of the boto3 S3 client used above
+# ---------------------------------------------------------------------------
+
+class MemoryS3Error(Exception):
+    def __init__(self, code, key):
+        super().__init__(f"{code}: {key}")
+        self.response = {"Error": {"Code": code, "Key": key}}
+
+
+class MemoryS3Client:
+    """Objects kept in a dict; multipart transfers are simulated by moving data in chunksize parts."""
+
+    def __init__(self):
+        self.objects = {}
+        self.parts = 0
+        self._lock = threading.Lock()
+
+    def upload_fileobj(self, Fileobj, Bucket, Key, Config=None, ExtraArgs=None):
+        chunk_size = Config.multipart_chunksize if Config else MULTIPART_CHUNKSIZE
+        buffer = io.BytesIO()
+        while True:
+            part = Fileobj.read(chunk_size)
+            if not part:
+                break
+            buffer.write(part)
+            self.parts += 1
+        with self._lock:
+            self.objects[(Bucket, Key)] = buffer.getvalue()
+
+    def download_fileobj(self, Bucket, Key, Fileobj, Config=None):
+        data = self._get(Bucket, Key)
+        chunk_size = Config.multipart_chunksize if Config else MULTIPART_CHUNKSIZE
+        for start in range(0, len(data), chunk_size):
+            Fileobj.write(data[start:start + chunk_size])
+
+    def head_object(self, Bucket, Key):
+        return {"ContentLength": len(self._get(Bucket, Key))}
+
+    def delete_object(self, Bucket, Key):
+        with self._lock:
+            self.objects.pop((Bucket, Key), None)
+        return {}
+
+    def get_paginator(self, operation):
+        client = self
+
+        class Paginator:
+            def paginate(self, Bucket, Prefix=""):
+                with client._lock:
+                    keys = sorted(k for b, k in client.objects if b == Bucket and k.startswith(Prefix))
+                for start in range(0, len(keys), 1000):
+                    yield {"Contents": [{"Key": k} for k in keys[start:start + 1000]]}
+        return Paginator()
+
+    def _get(self, Bucket, Key):
+        with self._lock:
+            if (Bucket, Key) not in self.objects:
+                raise MemoryS3Error("404", Key)
+            return self.objects[(Bucket, Key)]
+
+
+# ---------------------------------------------------------------------------
+# Working copy <-> backend
+# ---------------------------------------------------------------------------
+
+_storage = None
+_storage_lock = threading.Lock()
+
+
+def get_storage():
+    global _storage
+    with _storage_lock:
+        if _storage is None:
+            if STORAGE_BACKEND == "s3":
+                client = MemoryS3Client() if S3_ENDPOINT_URL == "memory://" else None
+                _storage = S3Storage(S3_BUCKET, S3_PREFIX, client=client, endpoint_url=S3_ENDPOINT_URL)
+            else:
+                _storage = LocalStorage(STORAGE_ROOT)
+        return _storage
+
+
+def set_storage(storage):
+    """Use another backend (e.g. an S3Storage on a MemoryS3Client)."""
+    global _storage
+    with _storage_lock:
+        _storage = storage
+
+
+def sync_up(path, skip_existing=False):
+    """Copy a working-copy file to the backend; skip_existing for immutable content already there."""
+    storage = get_storage()
+    if not storage.is_working_copy() and not (skip_existing and storage.exists(_key(path))):
+        storage.put_file(_key(path), path)
+    return path
+
+
+def sync_tree(folder):
+    for base, _, names in os.walk(folder):
+        for name in names:
+            sync_up(os.path.join(base, name))
+
+
+def ensure_local(path):
+    """Fetch an immutable file (blob, extraction output) into the working copy if it is not there yet."""
+    storage = get_storage()
+    if not os.path.exists(path) and not storage.is_working_copy() and storage.exists(_key(path)):
+        storage.get_file(_key(path), path)
+    return path
+
+
+def ensure_local_tree(folder):
+    storage = get_storage()
+    if os.path.isdir(folder) or storage.is_working_copy():
+        return folder
+    for key in storage.list(_key(folder) + "/"):
+        storage.get_file(key, os.path.join(*key.split("/")))
+    return folder
+
+
+def stored(path):
+    """True when the backend holds the file."""
+    return get_storage().exists(_key(path))
+
+
+def remove(path):
+    """Delete a file from the working copy and from the backend."""
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+    storage = get_storage()
+    if not storage.is_working_copy():
+        storage.delete(_key(path))
+
+
+def list_paths(folder, working_copy=True):
+    """
+    Working-copy paths of the files under folder in the backend and, with working_copy, in this node's
+    working copy as well (files other nodes deleted from the backend).
+    """
+    paths = set()
+    storage = get_storage()
+    if working_copy or storage.is_working_copy():
+        for base, _, names in os.walk(folder):
+            paths.update(os.path.relpath(os.path.join(base, name)) for name in names)
+    if not storage.is_working_copy():
+        paths.update(os.path.join(*key.split("/")) for key in storage.list(_key(folder) + "/"))
+    return paths
+
+
+def remove_tree(folder):
+    for path in list_paths(folder):
+        remove(path)
+    shutil.rmtree(folder, ignore_errors=True)
+
+
+def refresh(path):
+    """Fetch the backend's current version of a mutable file (job manifest), if the backend has one."""
+    storage = get_storage()
+    if not storage.is_working_copy() and storage.exists(_key(path)):
+        storage.get_file(_key(path), path)
+    return path
@@ -0,0 +1,151 @@
+import os
+import re
+import json
+import time
+import uuid
+import threading
+import storage
+from ec_meta import load_EC_meta, meta_path_for
+
+# Per-job workspaces: every submission gets jobs/<job_id>/ with its own JSONs/ directory and a job.json
+# manifest naming its uploads (blob digests) and artifacts (EC JSON, application JSON, photos, results).
+# Stages read and write through the job, so concurrent submissions with the same file names never collide.
+# Manifests and job outputs are mirrored to the storage backend, so any node can pick a job up.
+# Manifest updates are read-modify-write (refresh, modify, sync up) without conditional puts: a job has a
+# single writer at a time: the client drives one stage of a job at a time, and multi-node deployments must
+# route the requests of a job to one node (sticky on job_id). The lock below only serializes one node's threads.
+JOBS_DIR = os.getenv("JOBS_DIR", "jobs")
+JOB_TTL_SECONDS = int(os.getenv("JOB_TTL_SECONDS", str(7 * 24 * 3600)))
+JOB_ID = re.compile(r"^[0-9a-f]{32}$")
+MANIFEST = "job.json"
+
+_lock = threading.Lock()
+
+
+def create_job():
+    job_id = uuid.uuid4().hex
+    os.makedirs(output_dir(job_id))
+    _write_manifest(job_id, {"job_id": job_id, "created": time.strftime("%Y-%m-%dT%H:%M:%S"), "uploads": {}, "artifacts": {}})
+    return job_id
+
+
+def job_dir(job_id):
+    if not job_id or not JOB_ID.match(job_id):
+        raise ValueError(f"Invalid job id: {job_id!r}")
+    return os.path.join(JOBS_DIR, job_id)
+
+
+def job_exists(job_id):
+    try:
+        return os.path.exists(storage.refresh(os.path.join(job_dir(job_id), MANIFEST)))
+    except ValueError:
+        return False
+
+
+def output_dir(job_id):
+    return os.path.join(job_dir(job_id), "JSONs")
+
+
+def _write_manifest(job_id, manifest):
+    path = os.path.join(job_dir(job_id), MANIFEST)
+    os.makedirs(job_dir(job_id), exist_ok=True)
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        json.dump(manifest, f, ensure_ascii=False, indent=2)
+    os.replace(path + ".tmp", path)
+    storage.sync_up(path)
+
+
+def load_manifest(job_id):
+    with open(storage.refresh(os.path.join(job_dir(job_id), MANIFEST)), encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _update_manifest(job_id, section, name, value):
+    with _lock:
+        manifest = load_manifest(job_id)
+        manifest.setdefault(section, {})[name] = value
+        manifest["updated"] = time.strftime("%Y-%m-%dT%H:%M:%S")
+        _write_manifest(job_id, manifest)
+
+
+def set_artifact(job_id, name, value):
+    """Record an artifact of the job (a path, a list of paths) under name."""
+    _update_manifest(job_id, "artifacts", name, value)
+
+
+def record_upload(job_id, filename, digest):
+    """Record the blob an uploaded file was stored as, under its client-supplied name."""
+    _update_manifest(job_id, "uploads", filename, digest)
+
+
+def upload_names(job_id):
+    """digest -> client-supplied name of the files uploaded to the job."""
+    return {digest: filename for filename, digest in load_manifest(job_id).get("uploads", {}).items()}
+
+
+def get_artifact(job_id, name, default=None):
+    return load_manifest(job_id)["artifacts"].get(name, default)
+
+
+def save_json(job_id, name, data):
+    """Write data to JSONs/<name>.json of the job and record it as an artifact."""
+    path = os.path.join(output_dir(job_id), f"{name}.json")
+    os.makedirs(output_dir(job_id), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(data, f, ensure_ascii=False, indent=2)
+    storage.sync_up(path)
+    set_artifact(job_id, name, path)
+    return path
+
+
+def load_job_inputs(job_id):
+    """(data_pdf, data_app, image_paths, ec_meta) of a job; None for whatever was not uploaded."""
+    artifacts = load_manifest(job_id)["artifacts"]
+    data_pdf = data_app = ec_meta = None
+    if artifacts.get("ec_json"):
+        # The extraction folder holds the meta sidecar, page renders and photo pages as well
+        storage.ensure_local_tree(os.path.dirname(artifacts["ec_json"]))
+        with open(storage.ensure_local(artifacts["ec_json"]), encoding="utf-8") as f:
+            data_pdf = json.load(f)
+        storage.ensure_local(meta_path_for(artifacts["ec_json"]))
+        ec_meta = load_EC_meta(artifacts["ec_json"])
+        if ec_meta.get("pdf_path"):
+            storage.ensure_local(ec_meta["pdf_path"])
+    if artifacts.get("application_json"):
+        with open(storage.ensure_local(artifacts["application_json"]), encoding="utf-8") as f:
+            data_app = json.load(f)
+    photos = [storage.ensure_local(p) for p in artifacts.get("photos") or []] or artifacts.get("photos")
+    # Photo pages found inside the EC are photos of the job as well (their folder is local by now)
+    if ec_meta and ec_meta.get("photos"):
+        photos = (photos or []) + [p for p in ec_meta["photos"] if p not in (photos or [])]
+    return data_pdf, data_app, photos, ec_meta
+
+
+def _job_ids():
+    """Ids of the jobs in the backend and in this node's working copy."""
+    ids = {os.path.relpath(path, os.path.relpath(JOBS_DIR)).split(os.sep)[0] for path in storage.list_paths(JOBS_DIR)}
+    return sorted(job_id for job_id in ids if JOB_ID.match(job_id))
+
+
+def _last_update(job_id):
+    """Time of the job's last manifest update, from the backend's copy of the manifest."""
+    manifest = load_manifest(job_id)
+    stamp = manifest.get("updated") or manifest.get("created")
+    return time.mktime(time.strptime(stamp, "%Y-%m-%dT%H:%M:%S"))
+
+
+def expire_jobs(ttl=None):
+    """Delete jobs not updated for ttl seconds; their blob references become dangling. Returns the job ids."""
+    ttl = JOB_TTL_SECONDS if ttl is None else ttl
+    cutoff = time.time() - ttl
+    expired = []
+    for job_id in _job_ids():
+        try:
+            if _last_update(job_id) >= cutoff:
+                continue
+        except FileNotFoundError:
+            # Deleted from the backend by another node: only this working copy is left
+            pass
+        storage.remove_tree(job_dir(job_id))
+        expired.append(job_id)
+    return expired